@@ -0,0 +1,47 @@
+"""time managing the wrapper scripts of many tasks in a Batcave: writing
+them in one batch, looking them up, removing half of the tasks and
+collecting the scripts left unreferenced.
+
+   python -m benchmarks.batcave [ntasks] [nscripts]
+"""
+
+from lib.batcave import Batcave
+
+import os
+import sys
+import tempfile
+import time
+
+
+def main(n=100000, distinct=1000):
+   with tempfile.TemporaryDirectory() as tmp:
+      cave = Batcave(os.path.join(tmp, 'batcave'))
+
+      def put():
+         with cave.batch():
+            for i in range(n):
+               cave.put("_task{}".format(i),
+                        "@echo off\ncd /d %~dp0..\nrun {}\n".format(
+                           i % distinct))
+
+      def lookup():
+         for i in range(n):
+            cave.script("_task{}".format(i))
+
+      def remove():
+         with cave.batch():
+            for i in range(0, n, 2):
+               cave.remove("_task{}".format(i))
+
+      def reload():
+         Batcave(cave.root)
+
+      for fn in [put, lookup, remove, reload, cave.gc]:
+         begin = time.perf_counter()
+         fn()
+         elapsed = time.perf_counter() - begin
+         print("{:8} {:7.3f} s {:8.2f} us/task".format(
+            fn.__name__, elapsed, elapsed * 1e6 / n))
+
+if __name__ == '__main__':
+   main(*[int(arg) for arg in sys.argv[1:]])
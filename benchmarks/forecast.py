@@ -0,0 +1,45 @@
+"""time forecasting the fires of many tasks with mixed schedules over a
+number of days, merged into one time-ordered stream.
+
+   python -m benchmarks.forecast [ntasks] [ndays]
+"""
+
+from lib.engine import merge_fire_times
+from datetime import datetime, timedelta
+
+import sys
+import time
+
+SCHEDULES = [
+   {'schedule': 'minute', 'modifier': 30},
+   {'schedule': 'hourly', 'modifier': 2},
+   {'schedule': 'daily', 'modifier': ''},
+   {'schedule': 'quarterly', 'modifier': ''},
+   {'schedule': 'weekly', 'modifier': 1, 'days': ['MON', 'THU']},
+   {'schedule': 'monthly', 'modifier': 'LASTDAY'},
+   {'schedule': 'monthly', 'modifier': 'SECOND', 'days': ['TUE']},
+   {'schedule': 'onlogon', 'modifier': ''}]
+
+
+def tasks(n):
+   for i in range(n):
+      settings = {'name': "_task{}".format(i), 'days': [], 'months': [],
+                  'start_time': "{:02}:{:02}".format(i // 60 % 24, i % 60),
+                  'start_date': '', 'end_date': ''}
+      settings.update(SCHEDULES[i % len(SCHEDULES)])
+      yield settings
+
+
+def main(n=5000, days=30):
+   after = datetime(2018, 1, 31)
+   begin = time.perf_counter()
+   fires = 0
+   for fire, name in merge_fire_times(tasks(n), after,
+                                      after + timedelta(days=days)):
+      fires += 1
+   elapsed = time.perf_counter() - begin
+   print("{} tasks, {} days: {} fires in {:.3f} s, {:.2f} us/fire".format(
+      n, days, fires, elapsed, elapsed * 1e6 / max(1, fires)))
+
+if __name__ == '__main__':
+   main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,135 @@
+"""compare peak memory and time of parsing the output of
+`schtasks /query /fo csv /v` with the streaming SchtasksBackend._iter_tasks()
+and into a TaskTable against the former parse of the whole output at once,
+on a synthetic csv of 50k tasks written to a temp file that stands in for
+the schtasks pipe.
+
+   python -m benchmarks.schtasks_csv [ntasks]
+"""
+
+from lib.backends import TASK_FIELDS, SchtasksBackend, TaskTable
+from collections import namedtuple
+
+import csv
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+HEADERS = ['HostName', 'TaskName', 'Next Run Time', 'Status',
+           'Logon Mode', 'Last Run Time', 'Last Result', 'Author',
+           'Task To Run', 'Start In', 'Comment', 'Scheduled Task State',
+           'Idle Time', 'Power Management', 'Run As User',
+           'Delete Task If Not Rescheduled',
+           'Stop Task If Runs X Hours and X Mins',
+           'Schedule', 'Schedule Type', 'Start Time', 'Start Date', 'End Date',
+           'Days', 'Months', 'Repeat: Every', 'Repeat: Until: Time',
+           'Repeat: Until: Duration', 'Repeat: Stop If Still Running']
+
+
+def value(field, i):
+   """return the |field| value of the |i|th task. Times and the command are
+   mostly distinct between tasks, the other fields take a few values.
+   """
+
+   if field in ['next_run_time', 'last_run_time', 'start_time']:
+      return '01/31/2018 {:02}:{:02}:00 AM'.format(i // 60 % 12, i % 60)
+   elif field == 'task_to_run':
+      return 'C:\\batcave\\task{}.bat'.format(i)
+   return '{} {}'.format(field, i % 5)
+
+
+def write_csv(fp, ntasks):
+   """write |ntasks| tasks to file |fp| the way schtasks does: a header row
+   per folder of 100 tasks, every other folder being a subfolder
+   """
+
+   writer = csv.writer(fp, quoting=csv.QUOTE_ALL, lineterminator='\n')
+   for i in range(ntasks):
+      folder = i // 100
+      if i % 100 == 0:
+         writer.writerow(HEADERS)
+      prefix = '\\sub{}'.format(folder) if folder % 2 else ''
+      row = ['HOST', '{}\\task{}'.format(prefix, i)] + \
+         [value(f, i) for f in TASK_FIELDS[2:]]
+      writer.writerow(row)
+
+
+def legacy_parse(stdout, top_lv_only=True):
+   """the former SchtasksBackend._format_tasks_to_dict(), building a list
+   of the whole output at every step
+   """
+
+   tasks = list(csv.reader(stdout.splitlines()))
+   orig_headers = tasks[0]
+   headers = [SchtasksBackend._camel_to_snake(h) for h in orig_headers]
+   tasks = [t for t in tasks[1:] if t != orig_headers]
+   if top_lv_only:
+      tasks = [t for t in tasks if len(t[1].split('\\')) <= 2]
+   Task = namedtuple('Task', headers)
+   tasks = [Task(*t) for t in tasks]
+   return {t.task_name.rsplit('\\', 1)[-1]:t for t in tasks}
+
+
+def legacy(path):
+   with open(path) as fp:
+      return legacy_parse(fp.read())
+
+
+def streaming(path):
+   with open(path) as fp:
+      return SchtasksBackend._create_task_dict_from(
+         SchtasksBackend._iter_tasks(fp))
+
+
+def streaming_count(path):
+   with open(path) as fp:
+      return sum(1 for t in SchtasksBackend._iter_tasks(fp))
+
+
+def table(path):
+   with open(path) as fp:
+      return TaskTable.from_rows(*SchtasksBackend._iter_rows(fp))
+
+
+def table_3_fields(path):
+   with open(path) as fp:
+      return TaskTable.from_rows(*SchtasksBackend._iter_rows(fp),
+                                 fields=['next_run_time', 'status'])
+
+
+def measure(fn, path):
+   """return (seconds, peak bytes, result size) of fn(|path|). The time is
+   taken on a separate run since tracing allocations slows it down.
+   """
+
+   begin = time.perf_counter()
+   fn(path)
+   elapsed = time.perf_counter() - begin
+   tracemalloc.start()
+   result = fn(path)
+   peak = tracemalloc.get_traced_memory()[1]
+   tracemalloc.stop()
+   size = result if isinstance(result, int) else len(result)
+   return elapsed, peak, size
+
+
+def main(ntasks=50000):
+   fd, path = tempfile.mkstemp(suffix='.csv')
+   try:
+      with os.fdopen(fd, 'w') as fp:
+         write_csv(fp, ntasks)
+      print("{} tasks, {:.1f} MiB of csv".format(
+         ntasks, os.path.getsize(path) / 2**20))
+      for fn in [legacy, streaming, streaming_count, table,
+                 table_3_fields]:
+         elapsed, peak, size = measure(fn, path)
+         print("{:16} {:7.3f} s {:8.1f} MiB peak {:7} tasks".format(
+            fn.__name__, elapsed, peak / 2**20, size))
+   finally:
+      os.remove(path)
+
+if __name__ == '__main__':
+   main(*[int(arg) for arg in sys.argv[1:]])
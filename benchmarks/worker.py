@@ -0,0 +1,59 @@
+"""compare the time of task queries made by spawning the schtasks stand-in
+tests/fake_schtasks.py for each one, the way SchtasksBackend does, against
+sending them to a long-lived local worker, one at a time and pipelined.
+The local worker keeps its tasks in an InProcessBackend, which spawns
+nothing per operation, the same as the COM driven worker of
+lib.worker.taskservice_worker_argv() does on Windows.
+
+   python -m benchmarks.worker [nqueries]
+"""
+
+from lib.backends import SchtasksBackend
+from lib.worker import WorkerBackend
+
+import os
+import sys
+import tempfile
+import time
+import lib
+
+
+def spawned(n):
+   for i in range(n):
+      SchtasksBackend().query('_foo')
+
+
+def worker(n):
+   backend = WorkerBackend()
+   try:
+      for i in range(n):
+         backend.query('_foo')
+   finally:
+      backend.close()
+
+
+def pipelined(n):
+   backend = WorkerBackend()
+   try:
+      futures = [backend.pool.submit('query', taskname='_foo')
+                 for i in range(n)]
+      for future in futures:
+         future.result()
+   finally:
+      backend.close()
+
+
+def main(n=200):
+   SchtasksBackend.command = [sys.executable, os.path.join(
+      lib.ROOT_PATH, 'tests', 'fake_schtasks.py')]
+   with tempfile.TemporaryDirectory() as tmp:
+      os.environ['FAKE_SCHTASKS'] = os.path.join(tmp, 'tasks.json')
+      for fn in [spawned, worker, pipelined]:
+         begin = time.perf_counter()
+         fn(n)
+         elapsed = time.perf_counter() - begin
+         print("{:10} {:7.3f} s {:8.2f} ms/query".format(
+            fn.__name__, elapsed, elapsed * 1000 / n))
+
+if __name__ == '__main__':
+   main(*[int(arg) for arg in sys.argv[1:]])
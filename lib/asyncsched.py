@@ -0,0 +1,183 @@
+from lib.sched import Sched, DescheduleResult
+
+import asyncio
+import subprocess
+import weakref
+import lib.helpers as dammit
+
+
+def is_transient(err):
+   """return True if exception |err| may go away by trying again. Unlike
+   lib.helpers.is_transient(), a subprocess.CalledProcessError is taken as
+   permanent: schtasks failing, e.g. on access denied or a bad argument,
+   fails the same way on the next attempt.
+   """
+
+   return not isinstance(err, subprocess.CalledProcessError) and \
+      dammit.is_transient(err)
+
+
+class AsyncSched:
+   """asyncio version of Sched. The backend is called through the coroutine
+   versions of its operations, e.g. SchtasksBackend runs schtasks with
+   asyncio.create_subprocess_exec, so one event loop can serve many
+   scheduling requests at once without a thread per request. At most
+   AsyncSched.concurrency operations run at once per event loop. A failed
+   operation is retried as the RetryPolicy AsyncSched.retry_policy says.
+   The file work around the operations, like writing the batcave, is done
+   in the event loop's default executor, so it doesn't block the loop.
+   """
+
+   concurrency = 16
+   retry_policy = dammit.RetryPolicy(max_attempts=3, base_sec=0.5, max_sec=4,
+                                   retryable=is_transient)
+
+   _semaphores = weakref.WeakKeyDictionary()
+
+   def __init__(self, settings_file, batcave='batcave', schema=None,
+                cache=None, backend=None):
+      """create an AsyncSched handle object. The arguments have the same
+      meaning as for Sched().
+      """
+
+      self._sched = Sched(settings_file, batcave, schema, cache, backend)
+
+   @property
+   def sched(self):
+      """return the Sched object this AsyncSched object wraps"""
+
+      return self._sched
+
+   @staticmethod
+   def _semaphore():
+      """return the semaphore limiting the operations running at once in the
+      running event loop
+      """
+
+      loop = asyncio.get_running_loop()
+      semaphore = AsyncSched._semaphores.get(loop)
+      if semaphore is None:
+         semaphore = asyncio.Semaphore(AsyncSched.concurrency)
+         AsyncSched._semaphores[loop] = semaphore
+      return semaphore
+
+   @staticmethod
+   async def _blocking(func, *args):
+      """return func(|*args|) called in the default executor of the running
+      event loop, for the blocking file work like taking the batcave lock
+      """
+
+      return await asyncio.get_running_loop().run_in_executor(
+         None, func, *args)
+
+   @staticmethod
+   async def _call(op, *args):
+      """await the coroutine function |op| called with |*args| while
+      holding the semaphore, retrying it on error. The semaphore is released
+      while waiting to retry.
+      """
+
+      async def attempt():
+         async with AsyncSched._semaphore():
+            return await op(*args)
+
+      return await AsyncSched.retry_policy.acall(attempt)
+
+   @staticmethod
+   async def details_for(taskname, backend=None):
+      """coroutine version of Sched.details_for()"""
+
+      return await AsyncSched._call(
+         (backend or Sched._backend).aquery, taskname)
+
+   @staticmethod
+   async def is_task_scheduled(taskname, backend=None):
+      """coroutine version of Sched.is_task_scheduled()"""
+
+      return bool(await AsyncSched.details_for(taskname, backend))
+
+   @staticmethod
+   async def deschedule_task_with_taskname(taskname, backend=None):
+      """coroutine version of Sched.deschedule_task_with_taskname()"""
+
+      return await AsyncSched._call(
+         (backend or Sched._backend).adelete, taskname)
+
+   @staticmethod
+   async def schedule_many(settings_files, batcave='batcave', schema=None,
+                           cache=None, backend=None):
+      """coroutine version of Sched.schedule_many(). The tasks are created
+      concurrently, as many at once as AsyncSched.concurrency allows.
+      """
+
+      results, batpaths = await AsyncSched._blocking(
+         Sched._prepare_many, settings_files, batcave, schema, cache, backend)
+      indices = list(batpaths)
+      errors = await asyncio.gather(
+         *[AsyncSched._create(sched, batpath)
+           for sched, batpath in batpaths.values()],
+         return_exceptions=True)
+      for i, error in zip(indices, errors):
+         if isinstance(error, Exception):
+            results[i] = results[i]._replace(error=error)
+      return results
+
+   @staticmethod
+   async def _create(sched, batpath):
+      """coroutine version of Sched._create_task() for Sched object |sched|
+      """
+
+      def note():
+         sched._cave().note(sched._settings['name'], sched.fingerprint())
+
+      await AsyncSched._call(sched._backend.acreate, sched._settings, batpath)
+      await AsyncSched._blocking(note)
+
+   @staticmethod
+   async def deschedule_many(tasknames, backend=None, batcave=None):
+      """coroutine version of Sched.deschedule_many(). The tasks are deleted
+      concurrently, as many at once as AsyncSched.concurrency allows.
+      """
+
+      tasknames = list(tasknames)
+      deleted = await asyncio.gather(
+         *[AsyncSched.deschedule_task_with_taskname(taskname, backend)
+           for taskname in tasknames],
+         return_exceptions=True)
+      results = [DescheduleResult(taskname, False, d)
+                 if isinstance(d, Exception) else
+                 DescheduleResult(taskname, d, None)
+                 for taskname, d in zip(tasknames, deleted)]
+      await AsyncSched._blocking(Sched._drop_scripts, batcave, results)
+      return results
+
+   async def schedule_task(self):
+      """coroutine version of Sched.schedule_task()"""
+
+      try:
+         batpath = await AsyncSched._blocking(self._sched._create_bat)
+         await AsyncSched._create(self._sched, batpath)
+      except subprocess.CalledProcessError as cpe:
+         print(cpe.output)
+         raise cpe
+
+   async def deschedule_task(self):
+      """coroutine version of Sched.deschedule_task()"""
+
+      deleted = await AsyncSched.deschedule_task_with_taskname(
+         self._sched._settings['name'], self._sched._backend)
+      await AsyncSched._blocking(
+         lambda: self._sched._cave().remove(self._sched._settings['name']))
+      return deleted
+
+   async def details(self):
+      """coroutine version of Sched.details()"""
+
+      return await AsyncSched.details_for(
+         self._sched._settings['name'], self._sched._backend)
+
+   async def is_scheduled(self):
+      """coroutine version of Sched.is_scheduled()"""
+
+      return await AsyncSched.is_task_scheduled(
+         self._sched._settings['name'], self._sched._backend)
@@ -0,0 +1,183 @@
+import itertools
+import locale
+import os
+import os.path
+import threading
+
+# durability modes of atomic_write(): don't fsync, fsync the file before it
+# is renamed into place, or also fsync its directory after the rename so the
+# rename itself survives a crash
+NONE = 'none'
+FSYNC_FILE = 'file'
+FSYNC_DIR = 'dir'
+DURABILITY = [NONE, FSYNC_FILE, FSYNC_DIR]
+
+_counter = itertools.count()
+
+
+def _to_bytes(data, encoding):
+   """return str or bytes |data| as bytes. A str is written the way a file
+   opened with 'w' would: newlines translated to os.linesep and encoded
+   with |encoding|, the locale's preferred encoding if None. TypeError is
+   raised for any other type of data.
+   """
+
+   if isinstance(data, bytes):
+      return data
+   elif not isinstance(data, str):
+      raise TypeError("can't write {} data".format(type(data).__name__))
+   if os.linesep != '\n':
+      data = data.replace('\n', os.linesep)
+   return data.encode(encoding or locale.getpreferredencoding(False))
+
+
+def _same_content(path, data):
+   """return True if the file |path| exists and holds exactly the bytes
+   |data|
+   """
+
+   try:
+      if os.stat(path).st_size != len(data):
+         return False
+      with open(path, 'rb') as existing:
+         return existing.read() == data
+   except OSError:
+      return False
+
+
+def _fsync_dir(directory):
+   """fsync |directory| where the platform allows opening one"""
+
+   try:
+      fd = os.open(directory, os.O_RDONLY)
+   except OSError:
+      return
+   try:
+      os.fsync(fd)
+   except OSError:
+      pass
+   finally:
+      os.close(fd)
+
+
+def atomic_write(path, data, durability=NONE, encoding=None,
+                 skip_identical=True):
+   """write str or bytes |data| to the file |path| so that readers see
+   either the old or the new content, never a partially written file.
+   |data| is written to a temporary file in the same directory which is
+   then renamed over |path|. |durability| is one of DURABILITY. If
+   |skip_identical| is True and |path| already holds the same bytes,
+   nothing is written. |encoding| is used for str data, see _to_bytes().
+   Return True if the file was written, False if it was skipped.
+   ValueError is raised for an unknown durability mode.
+   """
+
+   if durability not in DURABILITY:
+      raise ValueError("unknown durability {!r}, not one of {}".format(
+         durability, DURABILITY))
+   data = _to_bytes(data, encoding)
+   if skip_identical and _same_content(path, data):
+      return False
+
+   directory, name = os.path.split(os.path.abspath(path))
+   tmppath = os.path.join(directory, ".{}.{}.{}.{}.tmp".format(
+      name, os.getpid(), threading.get_ident(), next(_counter)))
+   fd = os.open(tmppath, os.O_WRONLY | os.O_CREAT | os.O_EXCL |
+                getattr(os, 'O_BINARY', 0), 0o666)
+   try:
+      with os.fdopen(fd, 'wb') as tmp:
+         tmp.write(data)
+         if durability != NONE:
+            tmp.flush()
+            os.fsync(tmp.fileno())
+      try:
+         os.chmod(tmppath, os.stat(path).st_mode & 0o7777)
+      except FileNotFoundError:
+         pass
+      os.replace(tmppath, path)
+   except BaseException:
+      try:
+         os.remove(tmppath)
+      except OSError:
+         pass
+      raise
+   if durability == FSYNC_DIR:
+      _fsync_dir(directory)
+   return True
+
+
+class FileLock:
+   """lock shared between processes, held on the file |path| while in a with
+   block. The file is created if it doesn't exist and left behind
+   afterwards. The lock is reentrant within a process only through nested
+   with blocks on the same FileLock object.
+   """
+
+   def __init__(self, path):
+      """create a FileLock on the file |path|, not acquired yet"""
+
+      self._path = path
+      self._fd = None
+      self._depth = 0
+      self._lock = threading.RLock()
+
+   def __enter__(self):
+      """acquire the lock, blocking until the other holders released it"""
+
+      self._lock.acquire()
+      if self._depth == 0:
+         fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o666)
+         try:
+            _lock_fd(fd)
+         except BaseException:
+            os.close(fd)
+            self._lock.release()
+            raise
+         self._fd = fd
+      self._depth += 1
+      return self
+
+   def __exit__(self, *exc):
+      """release the lock"""
+
+      self._depth -= 1
+      if self._depth == 0:
+         fd, self._fd = self._fd, None
+         try:
+            _unlock_fd(fd)
+         finally:
+            os.close(fd)
+      self._lock.release()
+
+
+if os.name == 'nt':
+   import msvcrt
+   import time
+
+   def _lock_fd(fd):
+      """block until the first byte of the file |fd| is locked"""
+
+      while True:
+         try:
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            return
+         except OSError:
+            time.sleep(0.05)
+
+   def _unlock_fd(fd):
+      """unlock the first byte of the file |fd|"""
+
+      os.lseek(fd, 0, os.SEEK_SET)
+      msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+else:
+   import fcntl
+
+   def _lock_fd(fd):
+      """block until the file |fd| is locked"""
+
+      fcntl.flock(fd, fcntl.LOCK_EX)
+
+   def _unlock_fd(fd):
+      """unlock the file |fd|"""
+
+      fcntl.flock(fd, fcntl.LOCK_UN)
@@ -0,0 +1,1008 @@
+from lib.custom_exceptions import *
+from lib.settings import materialize
+from lib.engine import Engine, run_command, start_datetime, end_datetime
+from collections import namedtuple
+from operator import itemgetter
+from datetime import datetime
+
+import asyncio
+import csv
+import functools
+import itertools
+import json
+import locale
+import os
+import os.path
+import re
+import socket
+import subprocess
+import threading
+import time
+import lib.atomic as atomic
+
+
+# the Task fields in the order of the `schtasks /query /fo csv /v` columns
+TASK_FIELDS = (
+   'host_name', 'task_name', 'next_run_time', 'status', 'logon_mode',
+   'last_run_time', 'last_result', 'author', 'task_to_run', 'start_in',
+   'comment', 'scheduled_task_state', 'idle_time', 'power_management',
+   'run_as_user', 'delete_task_if_not_rescheduled',
+   'stop_task_if_runs_x_hours_and_x_mins', 'schedule', 'schedule_type',
+   'start_time', 'start_date', 'end_date', 'days', 'months', 'repeat_every',
+   'repeat_until_time', 'repeat_until_duration',
+   'repeat_stop_if_still_running')
+
+Task = namedtuple('Task', TASK_FIELDS)
+
+# header signature of a schtasks csv to the Task class of its rows
+_TASK_TYPES = {tuple(TASK_FIELDS): Task}
+_TASK_TYPES_LOCK = threading.Lock()
+
+_SCHEDULE_TYPES = {
+   'once': 'One Time Only',
+   'minute': 'One Time Only, Minute ',
+   'hourly': 'One Time Only, Hourly ',
+   'daily': 'Daily ',
+   'weekly': 'Weekly',
+   'monthly': 'Monthly',
+   'onstart': 'At system start up',
+   'onlogon': 'At logon time',
+   'onidle': 'At idle time'
+}
+
+def _format_dt(dt, fmt):
+   """return datetime |dt| formatted with |fmt|, or 'N/A' if |dt| is None"""
+
+   return 'N/A' if dt is None else dt.strftime(fmt)
+
+
+@functools.lru_cache(maxsize=None)
+def snake_case(s):
+   """return string |s| converted from camel case to snake case. Results
+   are memoized since the same few headers come back on every query.
+   """
+
+   s = re.sub(r'\s+', '_', s)
+   s = re.sub(r'\W+', '', s)
+   s = s[0].lower() + re.sub(r'[A-Z]', r'_\g<0>', s[1:])
+   s = re.sub(r'_+', '_', s)
+   return s.lower()
+
+
+def task_type(headers):
+   """return the Task class for rows of a schtasks csv with the header row
+   |headers|. Its fields are the snake cased headers. The class is created
+   once per distinct header row and cached, and it is the module level Task
+   for the standard `schtasks /query /fo csv /v` headers, so records of
+   repeated queries share one type.
+   """
+
+   headers = tuple(headers)
+   cls = _TASK_TYPES.get(headers)
+   if cls is None:
+      fields = tuple(snake_case(h) for h in headers)
+      with _TASK_TYPES_LOCK:
+         cls = _TASK_TYPES.get(fields) or namedtuple('Task', fields)
+         _TASK_TYPES[fields] = _TASK_TYPES[headers] = cls
+   return cls
+
+
+def make_task(name, settings, batpath=None, start=None, next_run=None,
+              last_run=None, last_result=None, status='Ready'):
+   """return a Task named tuple shaped like a `schtasks /query /fo csv /v`
+   row for the task named |name| with the validated Sched settings
+   |settings| and wrapper script |batpath|. |start|, |next_run| and
+   |last_run| are datetimes or None, where a missing |start| is taken from
+   the settings and the current time. |last_result| is an exit status or
+   None.
+   """
+
+   schedule = settings['schedule'].lower()
+   modifier = settings.get('modifier') or 1
+   start = start or start_datetime(settings, datetime.now())
+   end = end_datetime(settings)
+
+   days, months, repeat_every = 'N/A', 'N/A', 'Disabled'
+   if schedule == 'daily':
+      days = "Every {} day(s)".format(modifier)
+   elif schedule == 'weekly':
+      days = ', '.join(settings.get('days') or []) or 'N/A'
+   elif schedule == 'monthly':
+      months = ', '.join(settings.get('months') or []) or 'N/A'
+   elif schedule == 'minute':
+      repeat_every = "0 Hour(s), {} Minute(s)".format(modifier)
+   elif schedule == 'hourly':
+      repeat_every = "{} Hour(s), 0 Minute(s)".format(modifier)
+
+   return Task(
+      host_name=socket.gethostname(),
+      task_name="\\{}".format(name),
+      next_run_time=_format_dt(next_run, "%m/%d/%Y %I:%M:%S %p"),
+      status=status,
+      logon_mode='Interactive only',
+      last_run_time=_format_dt(last_run, "%m/%d/%Y %I:%M:%S %p"),
+      last_result='N/A' if last_result is None else str(last_result),
+      author='N/A',
+      task_to_run=batpath or settings.get('run_cmd', 'N/A'),
+      start_in='N/A',
+      comment='N/A',
+      scheduled_task_state='Enabled',
+      idle_time='Disabled',
+      power_management='',
+      run_as_user='N/A',
+      delete_task_if_not_rescheduled='Disabled',
+      stop_task_if_runs_x_hours_and_x_mins='72:00:00',
+      schedule='Scheduling data is not available in this format.',
+      schedule_type=_SCHEDULE_TYPES.get(schedule, schedule),
+      start_time=_format_dt(start, "%I:%M:%S %p"),
+      start_date=_format_dt(start, "%m/%d/%Y"),
+      end_date=_format_dt(end, "%m/%d/%Y"),
+      days=days,
+      months=months,
+      repeat_every=repeat_every,
+      repeat_until_time='None' if repeat_every != 'Disabled' else 'Disabled',
+      repeat_until_duration='Disabled',
+      repeat_stop_if_still_running='Disabled')
+
+
+class TaskTable:
+   """tasks stored column by column rather than as one Task named tuple per
+   task. Values that repeat within a column, e.g. the status, author or
+   schedule type, are stored once and shared. Task named tuples are only
+   built for the rows that are accessed, and where() filters a column at a
+   time into a view sharing the columns of the table it was made from.
+   """
+
+   # a column stops sharing its values once it has seen this many rows and
+   # at least half of them were distinct
+   _INTERN_CHECK = 4096
+
+   def __init__(self, fields, columns, index=None):
+      """create a TaskTable with the field names |fields| and the
+      dictionary |columns| of field names to lists of values. |index| is the
+      list of row numbers in the view, all rows if None.
+      """
+
+      self._fields = tuple(fields)
+      self._columns = columns
+      self._index = index
+      self._names = None
+
+   @classmethod
+   def from_rows(cls, headers, rows, fields=None):
+      """return a TaskTable of the csv rows |rows| of a schtasks csv with the
+      header row |headers|. If |fields| is set, only the fields named in it
+      and task_name are kept. ValueError is raised for a field that is not
+      in the headers.
+      """
+
+      names = [snake_case(h) for h in headers]
+      if fields is not None:
+         unknown = [f for f in fields if f not in names]
+         if unknown:
+            raise ValueError("unknown task fields {}".format(unknown))
+         names = [f if f in fields or f == 'task_name' else None
+                  for f in names]
+      indices = [i for i, f in enumerate(names) if f is not None]
+      fields = [names[i] for i in indices]
+      if not fields:
+         return cls(fields, {})
+      getter = itemgetter(*indices) if len(indices) > 1 else \
+         lambda row: (row[indices[0]],)
+      columns = [[] for f in fields]
+      pools = [{} for f in fields]
+
+      for n, row in enumerate(rows, 1):
+         for column, pool, value in zip(columns, pools, getter(row)):
+            if pool is not None:
+               value = pool.setdefault(value, value)
+            column.append(value)
+         if n % cls._INTERN_CHECK == 0:
+            pools = [None if pool is None or len(pool) > n // 2 else pool
+                     for pool in pools]
+      return cls(fields, dict(zip(fields, columns)))
+
+   @classmethod
+   def from_tasks(cls, tasks, fields=None):
+      """return a TaskTable of the iterable of Task named tuples |tasks|. If
+      |fields| is set, only the fields named in it are kept.
+      """
+
+      tasks = iter(tasks)
+      first = next(tasks, None)
+      if first is None:
+         return cls.from_rows(TASK_FIELDS, [], fields)
+      return cls.from_rows(first._fields, itertools.chain([first], tasks),
+                           fields)
+
+   @property
+   def fields(self):
+      """return the tuple of field names"""
+
+      return self._fields
+
+   def _rows(self):
+      """return the row numbers in the view"""
+
+      if self._index is not None:
+         return self._index
+      return range(len(self._columns[self._fields[0]])) \
+         if self._fields else range(0)
+
+   def __len__(self):
+      """return the number of tasks"""
+
+      return len(self._rows())
+
+   def column(self, field):
+      """return the list of values of the field named |field|"""
+
+      column = self._columns[field]
+      if self._index is None:
+         return list(column)
+      return [column[i] for i in self._index]
+
+   def _task(self, row):
+      """return the Task named tuple of row number |row|"""
+
+      return task_type(self._fields)(
+         *[self._columns[f][row] for f in self._fields])
+
+   def __getitem__(self, i):
+      """return the Task named tuple of the |i|th task"""
+
+      return self._task(self._rows()[i])
+
+   def __iter__(self):
+      """return an iterator over the Task named tuples, built one at a
+      time
+      """
+
+      return (self._task(row) for row in self._rows())
+
+   def where(self, **conditions):
+      """return a view of the tasks matching every keyword of |conditions|
+      where the keyword is a field name and the value is either the value
+      the field must be equal to or a predicate called with the field
+      value, e.g. table.where(status='Ready')
+      """
+
+      index = self._rows()
+      for field, cond in conditions.items():
+         column = self._columns[field]
+         if callable(cond):
+            index = [i for i in index if cond(column[i])]
+         else:
+            index = [i for i in index if column[i] == cond]
+      return TaskTable(self._fields, self._columns, list(index))
+
+   def names(self):
+      """return the list of task names without their folder"""
+
+      return [name.rsplit('\\', 1)[-1] for name in self.column('task_name')]
+
+   def get(self, taskname):
+      """return the Task named tuple for the task named |taskname|, or an
+      empty tuple if no such task exists
+      """
+
+      if self._names is None:
+         self._names = dict(zip(self.names(), self._rows()))
+      row = self._names.get(taskname)
+      return () if row is None else self._task(row)
+
+   def __contains__(self, taskname):
+      """return True if a task named |taskname| exists"""
+
+      return bool(self.get(taskname))
+
+   def to_dict(self):
+      """return a dictionary of task names to Task named tuples, the same as
+      Backend.bulk_query() does
+      """
+
+      return dict(zip(self.names(), self))
+
+
+class Backend:
+   """interface of a scheduler backend, which is what Sched creates,
+   deletes and queries tasks through. Tasks are identified by name and
+   described by Task named tuples with the fields in TASK_FIELDS.
+   """
+
+   def create(self, settings, batpath):
+      """create or replace the task described by the validated Sched
+      settings |settings|. |batpath| is the absolute path to the wrapper
+      batch script generated for the task.
+      """
+
+      raise NotImplementedError()
+
+   def delete(self, taskname):
+      """delete the task named |taskname|. Return True on success, False if
+      the task doesn't exist.
+      """
+
+      raise NotImplementedError()
+
+   def query(self, taskname):
+      """return the Task named tuple for the task named |taskname|, or an
+      empty tuple if the task doesn't exist
+      """
+
+      raise NotImplementedError()
+
+   def bulk_query(self, top_lv_only=True):
+      """return a dictionary of task names to Task named tuples for all
+      tasks. If |top_lv_only| is True, only the tasks in the root folder are
+      returned.
+      """
+
+      raise NotImplementedError()
+
+   def table(self, top_lv_only=True, fields=None):
+      """return a TaskTable of all tasks. If |top_lv_only| is True, only the
+      tasks in the root folder are included. If |fields| is set, only the
+      fields named in it are kept.
+      """
+
+      return TaskTable.from_tasks(self.bulk_query(top_lv_only).values(),
+                                  fields)
+
+   # The coroutine versions of the operations. By default they call the
+   # blocking ones directly, which is fine for backends that don't wait on
+   # anything, e.g. InProcessBackend.
+
+   async def acreate(self, settings, batpath):
+      """coroutine version of create()"""
+
+      return self.create(settings, batpath)
+
+   async def adelete(self, taskname):
+      """coroutine version of delete()"""
+
+      return self.delete(taskname)
+
+   async def aquery(self, taskname):
+      """coroutine version of query()"""
+
+      return self.query(taskname)
+
+   async def abulk_query(self, top_lv_only=True):
+      """coroutine version of bulk_query()"""
+
+      return self.bulk_query(top_lv_only)
+
+
+class SchtasksArgv(list):
+   """argument list of a schtasks invocation, without the executable. It is
+   passed to the process as is, so values are never quoted or re-parsed by
+   a shell.
+   """
+
+   # the schedules taking each optional /create flag
+   _MODIFIED = ['minute', 'hourly', 'daily', 'weekly', 'monthly']
+   _DATED = _MODIFIED + ['once']
+   # the monthly modifiers taking the day of the week with /d
+   _WEEKS = ['FIRST', 'SECOND', 'THIRD', 'FOURTH', 'LAST']
+
+   def __init__(self, verb, *flags):
+      """create a SchtasksArgv running the schtasks command |verb|, e.g.
+      '/create', with the valueless flags |*flags|
+      """
+
+      super().__init__([verb, *flags])
+
+   def opt(self, flag, value):
+      """append the option |flag| with |value|, which is a string, an int or
+      a list of strings joined with commas, and return self. Nothing is
+      appended if |value| is None or empty. TypeError is raised for any other
+      type of value.
+      """
+
+      if isinstance(value, bool):
+         raise TypeError("{} takes no bool value".format(flag))
+      elif isinstance(value, int):
+         value = str(value)
+      elif isinstance(value, (list, tuple)):
+         value = ','.join(value)
+      elif value is not None and not isinstance(value, str):
+         raise TypeError("{} takes no {} value".format(
+            flag, type(value).__name__))
+      if value:
+         self.extend([flag, value])
+      return self
+
+   @staticmethod
+   def create(settings, batpath):
+      """return the SchtasksArgv creating, or replacing, the task of the
+      validated Sched settings |settings| running the batch script |batpath|
+      """
+
+      schedule = settings['schedule'].lower()
+      return SchtasksArgv('/create', '/f') \
+         .opt('/tr', batpath) \
+         .opt('/st', settings['start_time']) \
+         .opt('/sc', settings['schedule']) \
+         .opt('/mo', settings['modifier']
+              if schedule in SchtasksArgv._MODIFIED else None) \
+         .opt('/d', settings['days'] if schedule == 'weekly' or
+              schedule == 'monthly' and
+              settings['modifier'] in SchtasksArgv._WEEKS else None) \
+         .opt('/m', settings['months'] if schedule == 'monthly' else None) \
+         .opt('/i', settings.get('idle_time')
+              if schedule == 'onidle' else None) \
+         .opt('/sd', settings['start_date']
+              if schedule in SchtasksArgv._DATED else None) \
+         .opt('/ed', settings['end_date']
+              if schedule in SchtasksArgv._MODIFIED else None) \
+         .opt('/tn', settings['name'])
+
+   @staticmethod
+   def query(taskname=None):
+      """return the SchtasksArgv querying the task named |taskname|, or all
+      tasks if None, verbosely as csv
+      """
+
+      return SchtasksArgv('/query', '/v').opt('/fo', 'csv') \
+         .opt('/tn', taskname)
+
+   @staticmethod
+   def delete(taskname):
+      """return the SchtasksArgv deleting the task named |taskname|"""
+
+      return SchtasksArgv('/delete', '/f').opt('/tn', taskname)
+
+
+class SchtasksBackend(Backend):
+   """backend running schtasks on the command line for every operation"""
+
+   # the command running schtasks, which a stand-in may replace
+   command = ['schtasks']
+
+   @staticmethod
+   def _schtasks(*args):
+      """run schtasks with the arguments |*args|, e.g. a SchtasksArgv,
+      without a shell. subprocess.CalledProcessError is raised on any error.
+      """
+
+      return subprocess.run(
+         [*SchtasksBackend.command, *args],
+         stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True,
+         universal_newlines=True)
+
+   @staticmethod
+   async def _aschtasks(*args):
+      """coroutine version of _schtasks() running schtasks with
+      asyncio.create_subprocess_exec, so the event loop is free while it
+      runs
+      """
+
+      argv = [*SchtasksBackend.command, *args]
+      proc = await asyncio.create_subprocess_exec(
+         *argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+      stdout, _ = await proc.communicate()
+      output = stdout.decode(locale.getpreferredencoding(False)).replace(
+         '\r\n', '\n')
+      if proc.returncode:
+         raise subprocess.CalledProcessError(proc.returncode, argv, output)
+      return subprocess.CompletedProcess(argv, proc.returncode, output)
+
+   @staticmethod
+   def _is_not_found(cpe):
+      """return True if subprocess.CalledProcessError |cpe| is schtasks
+      saying that the task doesn't exist
+      """
+
+      return bool(re.search(
+         r'cannot.*find.*file.*specified', cpe.output, re.I)) and \
+         cpe.returncode == 1
+
+   @staticmethod
+   def _camel_to_snake(s):
+      """return string |s| converted from camel case to snake case"""
+
+      return snake_case(s)
+
+   @staticmethod
+   def _schtasks_lines(*args):
+      """run schtasks with the arguments |*args| like _schtasks() and yield
+      its output line by line as it is read from the pipe.
+      subprocess.CalledProcessError is raised once the output has been read
+      if schtasks failed. Its output attribute holds the first lines of the
+      output only, which is where schtasks puts its error message.
+      """
+
+      cmd = [*SchtasksBackend.command, *args]
+      head = []
+      with subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT,
+                            universal_newlines=True) as proc:
+         for line in proc.stdout:
+            if len(head) < 16:
+               head.append(line)
+            yield line
+      if proc.returncode:
+         raise subprocess.CalledProcessError(
+            proc.returncode, cmd, ''.join(head))
+
+   @staticmethod
+   def _iter_rows(lines, top_lv_only=True):
+      """return the header row of the csv lines |lines| structured like the
+      output of `schtasks /fo csv ...`, or None if there are no lines, and
+      an iterator over the task rows parsed in a single pass. The header
+      rows repeated for every folder are skipped, and so are the tasks
+      outside the root folder if |top_lv_only| is True.
+      """
+
+      reader = csv.reader(lines)
+      orig_headers = next(reader, None)
+
+      def rows():
+         for row in reader:
+            if not row or row == orig_headers:
+               continue
+            # a task name with more than one backslash is not in the root
+            if top_lv_only and row[1].count('\\') > 1:
+               continue
+            yield row
+
+      return orig_headers, rows() if orig_headers else iter([])
+
+   @staticmethod
+   def _iter_tasks(lines, top_lv_only=True):
+      """yield a Task named tuple for each task in the csv lines |lines|
+      structured like the output of `schtasks /fo csv ...`. See _iter_rows().
+      """
+
+      orig_headers, rows = SchtasksBackend._iter_rows(lines, top_lv_only)
+      if orig_headers:
+         Task = task_type(orig_headers)
+         for row in rows:
+            yield Task(*row)
+
+   @staticmethod
+   def _create_task_dict_from(tasklist):
+      """return a dictionary of task names to Task named tuples based
+      on the iterable of Task named tuples |tasklist|
+      """
+
+      return {t.task_name.rsplit('\\', 1)[-1]:t for t in tasklist}
+
+   @staticmethod
+   def _format_tasks_to_dict(raw_tasks, top_lv_only=True):
+      """takes csv output structured like `schtasks /fo csv ...` |raw_tasks|
+      and converts it to a dictionary of task names to Task named tuples.
+      If |top_lv_only| is True, then return only the tasks at the root,
+      otherwise return all tasks. |top_lv_only| is True by default.
+      """
+
+      return SchtasksBackend._create_task_dict_from(
+         SchtasksBackend._iter_tasks(raw_tasks.stdout.splitlines(),
+                                     top_lv_only))
+
+   @staticmethod
+   def iter_tasks(taskname=None, top_lv_only=True):
+      """yield a Task named tuple for each task from `schtasks /fo csv /v
+      ...`, parsing the output as it is read. |taskname| and |top_lv_only|
+      have the same meaning as for _query_tasks_dict().
+      """
+
+      return SchtasksBackend._iter_tasks(SchtasksBackend._schtasks_lines(
+         *SchtasksArgv.query(taskname)), top_lv_only)
+
+   @staticmethod
+   def _query_tasks_dict(taskname=None, top_lv_only=True):
+      """return a dictionary of task names to Task named tuples representing
+      the content from `schtasks /fo csv /v ...`. If |taskname| is set to
+      a non-empty string, '/tn |taskname|' is added to the command invocation.
+      By default, |taskname| is None/falsy which will result in all root tasks
+      to be fetched if |top_lv_only| is True. If |top_lv_only| is False and
+      |taskname| is a non-empty string, then all tasks are fetched.
+      """
+
+      return SchtasksBackend._create_task_dict_from(
+         SchtasksBackend.iter_tasks(taskname, top_lv_only))
+
+   @staticmethod
+   def _delete_task(taskname):
+      """delete task whose name is |taskname|. Return true on success, false
+      if the task name is not found. Raise subprocess.CalledProcessError on
+      any other error.
+      """
+
+      try:
+         SchtasksBackend._schtasks(*SchtasksArgv.delete(taskname))
+      except subprocess.CalledProcessError as cpe:
+         if SchtasksBackend._is_not_found(cpe):
+            return False
+         else:
+            raise cpe
+      return True
+
+   def create(self, settings, batpath):
+      """create a task with schtasks from the validated Sched settings
+      |settings| given the path to the batch script |batpath|. |batpath|
+      should be the absolute path. subprocess.CalledProcessError is raised
+      on error.
+      """
+
+      SchtasksBackend._schtasks(*SchtasksArgv.create(settings, batpath))
+
+   def delete(self, taskname):
+      """delete the task named |taskname| with schtasks. Return True on
+      success, False if the task doesn't exist. Raise
+      subprocess.CalledProcessError on any other error.
+      """
+
+      return SchtasksBackend._delete_task(taskname)
+
+   def query(self, taskname):
+      """return the Task named tuple for the task named |taskname| from
+      schtasks, or an empty tuple if the task doesn't exist. Raise
+      subprocess.CalledProcessError on any other error.
+      """
+
+      try:
+         return SchtasksBackend._query_tasks_dict(taskname)[taskname]
+      except subprocess.CalledProcessError as cpe:
+         if SchtasksBackend._is_not_found(cpe):
+            return ()
+         else:
+            raise cpe
+
+   def bulk_query(self, top_lv_only=True):
+      """return a dictionary of task names to Task named tuples for all
+      tasks from a single schtasks query. If |top_lv_only| is True, only
+      the tasks in the root folder are returned.
+      """
+
+      return SchtasksBackend._query_tasks_dict(top_lv_only=top_lv_only)
+
+   def table(self, top_lv_only=True, fields=None):
+      """return a TaskTable of all tasks from a single schtasks query, parsed
+      straight into columns as it is read. If |top_lv_only| is True, only
+      the tasks in the root folder are included. If |fields| is set, only
+      the fields named in it are kept.
+      """
+
+      orig_headers, rows = SchtasksBackend._iter_rows(
+         SchtasksBackend._schtasks_lines(*SchtasksArgv.query()),
+         top_lv_only)
+      return TaskTable.from_rows(orig_headers or TASK_FIELDS, rows, fields)
+
+   async def acreate(self, settings, batpath):
+      """coroutine version of create()"""
+
+      await SchtasksBackend._aschtasks(*SchtasksArgv.create(settings, batpath))
+
+   async def adelete(self, taskname):
+      """coroutine version of delete()"""
+
+      try:
+         await SchtasksBackend._aschtasks(*SchtasksArgv.delete(taskname))
+      except subprocess.CalledProcessError as cpe:
+         if SchtasksBackend._is_not_found(cpe):
+            return False
+         else:
+            raise cpe
+      return True
+
+   async def aquery(self, taskname):
+      """coroutine version of query()"""
+
+      try:
+         raw_tasks = await SchtasksBackend._aschtasks(
+            *SchtasksArgv.query(taskname))
+      except subprocess.CalledProcessError as cpe:
+         if SchtasksBackend._is_not_found(cpe):
+            return ()
+         else:
+            raise cpe
+      return SchtasksBackend._format_tasks_to_dict(raw_tasks).get(
+         taskname, ())
+
+   async def abulk_query(self, top_lv_only=True):
+      """coroutine version of bulk_query()"""
+
+      return SchtasksBackend._format_tasks_to_dict(
+         await SchtasksBackend._aschtasks(*SchtasksArgv.query()),
+         top_lv_only)
+
+
+class InProcessBackend(Backend):
+   """backend keeping tasks in an Engine in this process, optionally saved
+   to a json file, and firing them itself. Nothing is spawned to create,
+   delete or query a task, and it works wherever Python does. Tasks only
+   fire while run_pending() is being called, either directly or by the
+   thread started with start(). A fired task runs its run_cmd from its
+   working_dir, where '.' is the directory of its wrapper batch script, the
+   same as the wrapper does.
+
+   The json file holds the tasks as of its last rewrite, and a journal next
+   to it, <path>.log, one line per change since, so a change costs the same
+   however many tasks there are. The journal is folded into the json file
+   once it outgrows it.
+   """
+
+   # the journal is folded into the json file once it is bigger than this
+   # many bytes and than the json file itself
+   COMPACT_BYTES = 1 << 20
+
+   def __init__(self, path=None, runner=run_command, clock=time.time,
+                durability=atomic.FSYNC_FILE):
+      """create an InProcessBackend. If |path| is given, tasks are saved to
+      that json file and its journal whenever they change or fire, and
+      loaded from them if they exist. The journal is fsynced after every
+      change and the json file written with lib.atomic.atomic_write(),
+      unless the durability mode |durability| is lib.atomic.NONE. |runner|
+      and |clock| are passed on to the Engine.
+      """
+
+      self._path = path
+      self._journal = None if path is None else path + '.log'
+      self._durability = durability
+      self._lock = threading.Lock()
+      self._saved_size = 0
+      self._journal_size = 0
+      self._engine = Engine(runner, clock, on_fire=self._fired)
+
+      if path is not None:
+         self._restore()
+
+   @property
+   def engine(self):
+      """return the Engine holding the tasks"""
+
+      return self._engine
+
+   @staticmethod
+   def _datetime(ts):
+      """return timestamp |ts| as a datetime, or None if |ts| is None"""
+
+      return None if ts is None else datetime.fromtimestamp(ts)
+
+   @staticmethod
+   def _timestamp(dt):
+      """return datetime |dt| as a timestamp, or None if |dt| is None"""
+
+      return None if dt is None else dt.timestamp()
+
+   @staticmethod
+   def _saved(task):
+      """return ScheduledTask |task| as the dict it is saved as"""
+
+      return {
+         'settings': task.settings,
+         'batpath': task.batpath,
+         'start': InProcessBackend._timestamp(task.start),
+         'last_run': InProcessBackend._timestamp(task.last_run),
+         'last_result': task.last_result
+      }
+
+   def _load(self, saved):
+      """add the task saved as dict |saved| by _saved() to the engine. Like
+      schtasks, runs missed while the task wasn't loaded are skipped.
+      """
+
+      task = self._engine.add(
+         saved['settings'], saved['batpath'],
+         start=InProcessBackend._datetime(saved['start']))
+      task.last_run = InProcessBackend._datetime(saved['last_run'])
+      task.last_result = saved['last_result']
+
+   def _replay(self, record):
+      """apply the journal record |record| to the engine"""
+
+      op, name = record[0], record[1]
+      if op == 'put':
+         self._load(record[2])
+      elif op == 'del':
+         self._engine.remove(name)
+      elif op == 'ran':
+         task = self._engine.get(name)
+         if task is not None:
+            task.last_run = InProcessBackend._datetime(record[2])
+            task.last_result = record[3]
+
+   def _restore(self):
+      """load the tasks from the json file and replay the journal on top"""
+
+      if os.path.isfile(self._path):
+         with open(self._path, 'r') as saved:
+            for task in json.load(saved):
+               self._load(task)
+         self._saved_size = os.path.getsize(self._path)
+
+      try:
+         with open(self._journal, 'rb') as journal:
+            data = journal.read()
+      except FileNotFoundError:
+         return
+      for line in data.splitlines():
+         try:
+            record = json.loads(line.decode('utf-8'))
+         except ValueError:
+            # the last change was cut off by a crash
+            break
+         self._replay(record)
+      self._journal_size = len(data)
+      if data and not data.endswith(b'\n'):
+         with self._lock:
+            self._compact()
+
+   def _compact(self):
+      """write all tasks to the json file and empty the journal. The lock
+      must be held.
+      """
+
+      data = json.dumps([InProcessBackend._saved(task)
+                         for task in self._engine.tasks()])
+      atomic.atomic_write(self._path, data, self._durability)
+      with open(self._journal, 'wb'):
+         pass
+      self._saved_size = len(data)
+      self._journal_size = 0
+
+   def _append(self, records):
+      """append the journal records in the list |records|, if there is a
+      json file, and fold the journal into it once it has grown too big
+      """
+
+      if self._path is None or not records:
+         return
+      data = b''.join(json.dumps(record).encode('utf-8') + b'\n'
+                      for record in records)
+      with self._lock:
+         with open(self._journal, 'ab') as journal:
+            journal.write(data)
+            if self._durability != atomic.NONE:
+               journal.flush()
+               os.fsync(journal.fileno())
+         self._journal_size += len(data)
+         if self._journal_size > InProcessBackend.COMPACT_BYTES and \
+            self._journal_size > self._saved_size:
+            self._compact()
+
+   def _fired(self, fired):
+      """record the last run of each task named in the list |fired|"""
+
+      tasks = [self._engine.get(name) for name in fired]
+      self._append([
+         ['ran', task.name, InProcessBackend._timestamp(task.last_run),
+          task.last_result] for task in tasks if task is not None])
+
+   def create(self, settings, batpath):
+      """create or replace the task described by the validated Sched
+      settings |settings| with wrapper script |batpath|. ValueError is
+      raised for a modifier the schedule doesn't take.
+      """
+
+      task = self._engine.add(materialize(settings), batpath)
+      self._append([['put', task.name, InProcessBackend._saved(task)]])
+
+   def delete(self, taskname):
+      """delete the task named |taskname|. Return True on success, False if
+      the task doesn't exist.
+      """
+
+      if not self._engine.remove(taskname):
+         return False
+      self._append([['del', taskname]])
+      return True
+
+   @staticmethod
+   def _task(task):
+      """return the Task named tuple for ScheduledTask |task|"""
+
+      return make_task(
+         task.name, task.settings, task.batpath, start=task.start,
+         next_run=task.next_run, last_run=task.last_run,
+         last_result=task.last_result,
+         status='Running' if task.running else 'Ready')
+
+   def query(self, taskname):
+      """return the Task named tuple for the task named |taskname|, or an
+      empty tuple if the task doesn't exist
+      """
+
+      self._engine.reap()
+      task = self._engine.get(taskname)
+      return () if task is None else InProcessBackend._task(task)
+
+   def bulk_query(self, top_lv_only=True):
+      """return a dictionary of task names to Task named tuples for all
+      tasks. All tasks are in the root folder, so |top_lv_only| makes no
+      difference.
+      """
+
+      self._engine.reap()
+      return {task.name: InProcessBackend._task(task)
+              for task in self._engine.tasks()}
+
+   def run_pending(self):
+      """fire every task that is due. Return the names of the fired
+      tasks.
+      """
+
+      return self._engine.run_pending()
+
+   def trigger(self, event):
+      """fire every task scheduled on |event|, which is one of 'onstart',
+      'onlogon' or 'onidle'. Return the names of the fired tasks.
+      """
+
+      return self._engine.trigger(event)
+
+   def start(self, poll_s=60):
+      """start firing tasks in a daemon thread, see Engine.start()"""
+
+      self._engine.start(poll_s)
+
+   def stop(self):
+      """stop the thread started with start()"""
+
+      self._engine.stop()
+
+
+class RecordingBackend(Backend):
+   """fake backend for tests that records every call and keeps tasks in a
+   dictionary. |errors| maps an operation name ('create', 'delete', 'query'
+   or 'bulk_query') to an exception raised whenever that operation is
+   called.
+   """
+
+   def __init__(self, errors=None):
+      """create a RecordingBackend with no tasks and no calls. See the class
+      doc for |errors|.
+      """
+
+      self.calls = []
+      self.tasks = {}
+      self.errors = dict(errors or {})
+      self._lock = threading.Lock()
+
+   def _record(self, op, *args):
+      """record a call of |op| with |*args| and raise the error configured
+      for |op|, if any
+      """
+
+      with self._lock:
+         self.calls.append((op, *args))
+      if op in self.errors:
+         raise self.errors[op]
+
+   def create(self, settings, batpath):
+      """record the call and keep the task"""
+
+      settings = materialize(settings)
+      self._record('create', settings['name'])
+      with self._lock:
+         self.tasks[settings['name']] = (settings, batpath)
+
+   def delete(self, taskname):
+      """record the call and drop the task. Return True if it existed."""
+
+      self._record('delete', taskname)
+      with self._lock:
+         return self.tasks.pop(taskname, None) is not None
+
+   def query(self, taskname):
+      """record the call and return the Task named tuple for the task, or an
+      empty tuple if it doesn't exist
+      """
+
+      self._record('query', taskname)
+      with self._lock:
+         task = self.tasks.get(taskname)
+      return () if task is None else make_task(taskname, *task)
+
+   def bulk_query(self, top_lv_only=True):
+      """record the call and return a dictionary of task names to Task named
+      tuples for all tasks
+      """
+
+      self._record('bulk_query', top_lv_only)
+      with self._lock:
+         tasks = dict(self.tasks)
+      return {name: make_task(name, *task) for name, task in tasks.items()}
@@ -0,0 +1,437 @@
+from contextlib import contextmanager
+from collections import Counter
+
+import hashlib
+import json
+import os
+import os.path
+import re
+import threading
+import lib.atomic as atomic
+
+_SHARD = re.compile(r'^[0-9a-f]{2}$')
+_SCRIPT = re.compile(r'^([0-9a-f]{40})\.bat$')
+
+
+class Batcave:
+   """directory of wrapper batch scripts stored by content. A script is
+   named after the sha1 of its content and kept in a subdirectory named
+   after the first two hex digits of it, e.g. batcave/3f/3f2a....bat, so
+   tasks with the same script share one file and no directory holds more
+   than a fraction of the scripts. A script is removed once no task refers
+   to it anymore; gc() removes the ones left behind otherwise, e.g. by a
+   crash.
+
+   Which task uses which script is kept in manifest.json plus a journal,
+   manifest.log, that every change appends a line to, so a change costs
+   the same however many tasks there are. The journal is folded into
+   manifest.json once it outgrows it. Processes sharing a batcave take
+   turns through the lock file manifest.lock: each one appends only its
+   own changes after reading those of the others, and scripts are only
+   removed while holding the lock, so no process removes a script another
+   one has just started using.
+   """
+
+   MANIFEST = 'manifest.json'
+   JOURNAL = 'manifest.log'
+   LOCK = 'manifest.lock'
+
+   # the journal is folded into the manifest once it is bigger than this
+   # many bytes and than the manifest itself
+   COMPACT_BYTES = 1 << 20
+
+   _opened = {}
+   _opened_lock = threading.Lock()
+
+   def __init__(self, root, durability=atomic.NONE):
+      """create a Batcave keeping its scripts in directory |root|, which is
+      created if it doesn't exist. |durability| is the durability of the
+      scripts and manifest written, one of lib.atomic.DURABILITY.
+      """
+
+      self._root = os.path.realpath(root)
+      self._manifest = os.path.join(self._root, Batcave.MANIFEST)
+      self._journal = os.path.join(self._root, Batcave.JOURNAL)
+      self._file_lock = atomic.FileLock(
+         os.path.join(self._root, Batcave.LOCK))
+      self.durability = durability
+      self._lock = threading.RLock()
+      # task name to [digest, fingerprint], with the pending changes applied
+      self._tasks = {}
+      self._refs = Counter()
+      self._stamp = None
+      self._offset = 0
+      self._batches = 0
+      self._pending = []
+      self._contents = {}
+      self._dropped = set()
+
+      with self._locked():
+         self._load()
+
+   @staticmethod
+   def open(root, durability=atomic.NONE):
+      """return the Batcave of directory |root|, the same object for every
+      call with the same directory, with its durability set to
+      |durability|
+      """
+
+      key = os.path.realpath(root)
+      with Batcave._opened_lock:
+         cave = Batcave._opened.get(key)
+         if cave is None:
+            cave = Batcave(key, durability)
+            Batcave._opened[key] = cave
+      cave.durability = durability
+      return cave
+
+   @staticmethod
+   def digest(content):
+      """return the digest a script with str |content| is stored under"""
+
+      return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+   @staticmethod
+   def home(batpath):
+      """return the directory a wrapper script at |batpath| treats as its
+      working directory '.', which is the batcave itself for a script kept
+      in a shard and the script's own directory for any other
+      """
+
+      directory, name = os.path.split(batpath)
+      match = _SCRIPT.match(name)
+      shard = os.path.basename(directory)
+      if match and _SHARD.match(shard) and match.group(1).startswith(shard):
+         return os.path.dirname(directory)
+      return directory
+
+   @property
+   def root(self):
+      """return the absolute path of the batcave directory"""
+
+      return self._root
+
+   def path(self, digest):
+      """return the path of the script with digest |digest|"""
+
+      return os.path.join(self._root, digest[:2], "{}.bat".format(digest))
+
+   def _locked(self):
+      """return the lock file of the batcave, creating the batcave first if
+      it was removed
+      """
+
+      os.makedirs(self._root, exist_ok=True)
+      return self._file_lock
+
+   @staticmethod
+   def _stat(path):
+      """return what identifies the current version of the file |path|, or
+      None if there is none
+      """
+
+      try:
+         st = os.stat(path)
+      except FileNotFoundError:
+         return None
+      return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+   @staticmethod
+   def _size(path):
+      """return the size of the file |path|, 0 if there is none"""
+
+      try:
+         return os.stat(path).st_size
+      except FileNotFoundError:
+         return 0
+
+   def _apply(self, record):
+      """apply the journal record |record| to the tasks in memory and return
+      the set of digests no task refers to anymore because of it
+      """
+
+      op, taskname = record[0], record[1]
+      entry = self._tasks.get(taskname)
+      dropped = set()
+      if op == 'put':
+         if entry is None or entry[0] != record[2]:
+            self._tasks[taskname] = [record[2], None]
+            self._refs[record[2]] += 1
+            if entry is not None:
+               dropped.add(entry[0])
+      elif op == 'note':
+         if entry is not None:
+            self._tasks[taskname] = [entry[0], record[2]]
+      elif op == 'del':
+         if entry is not None:
+            del self._tasks[taskname]
+            dropped.add(entry[0])
+      for digest in dropped:
+         self._refs[digest] -= 1
+         if self._refs[digest] <= 0:
+            del self._refs[digest]
+      return dropped
+
+   def _load(self):
+      """read the manifest and the whole journal into memory. The lock file
+      must be held.
+      """
+
+      stamp = Batcave._stat(self._manifest)
+      tasks = {}
+      if stamp is not None:
+         with open(self._manifest, 'r') as fp:
+            tasks = json.load(fp)['tasks']
+      self._tasks = {name: [entry, None] if isinstance(entry, str) else entry
+                     for name, entry in tasks.items()}
+      self._refs = Counter(entry[0] for entry in self._tasks.values())
+      self._stamp = stamp
+      self._offset = 0
+      self._read_journal()
+
+   def _read_journal(self):
+      """apply the journal records appended since it was last read. The lock
+      file must be held.
+      """
+
+      try:
+         with open(self._journal, 'rb') as fp:
+            fp.seek(self._offset)
+            new = fp.read()
+      except FileNotFoundError:
+         return
+      for line in new.splitlines():
+         if line.strip():
+            self._apply(json.loads(line.decode('utf-8')))
+      self._offset += len(new)
+
+   def _is_stale(self):
+      """return True if another process changed the manifest or journal
+      since they were last read here
+      """
+
+      return Batcave._stat(self._manifest) != self._stamp or \
+         Batcave._size(self._journal) != self._offset
+
+   def _refresh(self):
+      """read what other processes changed since the manifest was last read
+      here and apply the pending changes of this process on top of it. The
+      lock file must be held.
+      """
+
+      if Batcave._stat(self._manifest) != self._stamp or \
+         Batcave._size(self._journal) < self._offset:
+         self._load()
+      elif Batcave._size(self._journal) > self._offset:
+         self._read_journal()
+      else:
+         return
+      for record in self._pending:
+         self._dropped |= self._apply(record)
+
+   def _sync(self):
+      """read what other processes changed, unless nothing changed or a batch
+      is open, in which case that is done when the batch ends
+      """
+
+      if not self._batches and self._is_stale():
+         with self._locked():
+            self._refresh()
+
+   def _ensure(self, digest, content):
+      """write the script |digest| with str |content| unless it is there
+      already. A script that is there has the right content, being named
+      after it and written atomically.
+      """
+
+      path = self.path(digest)
+      if not os.path.isfile(path):
+         os.makedirs(os.path.dirname(path), exist_ok=True)
+         atomic.atomic_write(path, content, self.durability)
+
+   def _compact(self):
+      """fold the journal into the manifest if it has grown too big. The
+      lock file must be held and nothing be pending.
+      """
+
+      size = Batcave._size(self._journal)
+      if size <= Batcave.COMPACT_BYTES or \
+         size <= Batcave._size(self._manifest):
+         return
+      atomic.atomic_write(self._manifest, json.dumps({'tasks': self._tasks}),
+                          self.durability)
+      with open(self._journal, 'wb'):
+         pass
+      self._stamp = Batcave._stat(self._manifest)
+      self._offset = 0
+
+   def _flush(self):
+      """append the pending changes to the journal after reading those of
+      the other processes, and remove the scripts no task uses anymore
+      """
+
+      with self._locked():
+         self._refresh()
+         # a script written before the lock was taken may have been removed
+         # by another process since
+         for digest, content in self._contents.items():
+            if digest in self._refs:
+               self._ensure(digest, content)
+         with open(self._journal, 'ab') as fp:
+            fp.write(b''.join(json.dumps(record).encode('utf-8') + b'\n'
+                              for record in self._pending))
+            if self.durability != atomic.NONE:
+               fp.flush()
+               os.fsync(fp.fileno())
+         self._offset = Batcave._size(self._journal)
+         for digest in self._dropped:
+            if digest not in self._refs:
+               try:
+                  os.remove(self.path(digest))
+               except FileNotFoundError:
+                  pass
+         self._pending = []
+         self._contents = {}
+         self._dropped = set()
+         self._compact()
+
+   @contextmanager
+   def batch(self):
+      """context manager appending the changes made inside it to the journal
+      at once on exit instead of one at a time. Changes made by other
+      processes meanwhile are read on exit.
+      """
+
+      with self._lock:
+         self._sync()
+         self._batches += 1
+      try:
+         yield self
+      finally:
+         with self._lock:
+            self._batches -= 1
+            if not self._batches and self._pending:
+               self._flush()
+
+   def _change(self, record):
+      """make the change described by the journal record |record|"""
+
+      self._pending.append(record)
+      self._dropped |= self._apply(record)
+
+   def put(self, taskname, content):
+      """make str |content| the script of the task named |taskname| and
+      return the absolute path of the script. The script is only written if
+      no task has the same one already.
+      """
+
+      digest = Batcave.digest(content)
+      with self.batch():
+         with self._lock:
+            self._ensure(digest, content)
+            entry = self._tasks.get(taskname)
+            if entry is None or entry[0] != digest:
+               self._contents[digest] = content
+               self._change(['put', taskname, digest])
+      return self.path(digest)
+
+   def note(self, taskname, fingerprint):
+      """remember |fingerprint|, e.g. of the settings the task named
+      |taskname| was last scheduled with, next to its script. Nothing is
+      remembered for a task without a script.
+      """
+
+      with self.batch():
+         with self._lock:
+            entry = self._tasks.get(taskname)
+            if entry is not None and entry[1] != fingerprint:
+               self._change(['note', taskname, fingerprint])
+
+   def remove(self, taskname):
+      """forget the script of the task named |taskname|, removing it if no
+      other task uses it. Return True if the task had one, False otherwise.
+      """
+
+      with self.batch():
+         with self._lock:
+            if taskname not in self._tasks:
+               return False
+            self._change(['del', taskname])
+            return True
+
+   def _entry(self, taskname):
+      """return the [digest, fingerprint] entry of the task named |taskname|,
+      or None if it has none
+      """
+
+      with self._lock:
+         self._sync()
+         return self._tasks.get(taskname)
+
+   def script(self, taskname):
+      """return the path of the script of the task named |taskname|, or None
+      if it has none
+      """
+
+      entry = self._entry(taskname)
+      return None if entry is None else self.path(entry[0])
+
+   def fingerprint(self, taskname):
+      """return what note() remembered for the task named |taskname| since
+      its script last changed, or None
+      """
+
+      entry = self._entry(taskname)
+      return None if entry is None else entry[1]
+
+   def tasknames(self):
+      """return a list of the names of the tasks with a script"""
+
+      with self._lock:
+         self._sync()
+         return list(self._tasks)
+
+   def __contains__(self, taskname):
+      """return True if the task named |taskname| has a script"""
+
+      return self._entry(taskname) is not None
+
+   def __len__(self):
+      """return the number of tasks with a script"""
+
+      with self._lock:
+         self._sync()
+         return len(self._tasks)
+
+   def gc(self):
+      """remove the scripts no task in the manifest refers to and the shard
+      directories left empty. Scripts outside the shards, e.g. ones written
+      before the batcave was managed, are left alone since tasks may still
+      run them. Return the number of scripts removed.
+      """
+
+      removed = 0
+      with self._lock, self._locked():
+         self._refresh()
+         with os.scandir(self._root) as shards:
+            shards = [s.path for s in shards
+                      if _SHARD.match(s.name) and s.is_dir()]
+         for shard in shards:
+            left = 0
+            with os.scandir(shard) as scripts:
+               for script in scripts:
+                  match = _SCRIPT.match(script.name)
+                  if match is None or match.group(1) in self._refs:
+                     left += 1
+                     continue
+                  try:
+                     os.remove(script.path)
+                     removed += 1
+                  except FileNotFoundError:
+                     pass
+            if not left:
+               try:
+                  os.rmdir(shard)
+               except OSError:
+                  pass
+      return removed
@@ -1,6 +1,39 @@
 class InvalidSettingError(Exception):
-   def __init__(self):
-      super().__init__()
+   def __init__(self, path=None, value=None, alternatives=None, reason=None,
+                errors=None):
+      """|path| is the JSON path of the invalid setting, e.g. 'foo.bar[2]',
+      |value| is its value, |alternatives| is the valid value specification
+      it was checked against, and |reason| says what is wrong with it. If
+      |errors| is a non-empty list of InvalidSettingErrors, this error
+      collects all of them and takes the details of the first one.
+      """
+
+      self.errors = errors or []
+      if self.errors:
+         first = self.errors[0]
+         path, value, alternatives, reason = \
+            first.path, first.value, first.alternatives, first.reason
+      self.path = path
+      self.value = value
+      self.alternatives = alternatives
+      self.reason = reason
+
+      if len(self.errors) > 1:
+         super().__init__("{} invalid settings: {}".format(
+            len(self.errors), '; '.join(str(e) for e in self.errors)))
+      elif reason and not path:
+         super().__init__("invalid settings: {}".format(reason))
+      elif reason:
+         super().__init__("invalid setting {}: {}".format(path, reason))
+      elif path is not None:
+         super().__init__("invalid setting {}: {!r} is not one of {!r}".format(
+            path, value, alternatives))
+      else:
+         super().__init__()
+
+   def __reduce__(self):
+      return (InvalidSettingError, (
+         self.path, self.value, self.alternatives, self.reason, self.errors))
 
 class NotYetImplemented(Exception):
    def __init__(self):
@@ -12,4 +45,26 @@ class InvalidWildcardError(Exception):
 
 class InvalidRegexError(Exception):
    def __init__(self, regex_string):
-      super().__init__("invalid regex: \"{}\"".format(regex_string))
\ No newline at end of file
+      super().__init__("invalid regex: \"{}\"".format(regex_string))
+
+class InvalidPatchError(Exception):
+   def __init__(self, reason):
+      super().__init__("invalid patch: {}".format(reason))
+
+class WorkerError(Exception):
+   def __init__(self, kind, message):
+      """|kind| is the name of the exception type a worker process replied
+      with and |message| is its message
+      """
+
+      self.kind = kind
+      self.message = message
+      super().__init__("{} in worker: {}".format(kind, message))
+
+   def __reduce__(self):
+      return (type(self), (self.kind, self.message))
+
+class WorkerCrashedError(WorkerError):
+   def __init__(self, kind='WorkerCrashedError',
+                message='worker process exited'):
+      super().__init__(kind, message)
@@ -0,0 +1,530 @@
+from lib.custom_exceptions import *
+from lib.batcave import Batcave
+from datetime import datetime, timedelta
+
+import calendar
+import heapq
+import itertools
+import os
+import os.path
+import re
+import subprocess
+import threading
+import time
+
+
+EVENT_SCHEDULES = ['onstart', 'onlogon', 'onidle']
+
+_DAYS = ['MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN']
+_MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN',
+           'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+# monthly modifiers picking a week of the month, LAST being the last one
+_WEEKS = ['FIRST', 'SECOND', 'THIRD', 'FOURTH', 'LAST']
+_UNITS = {'minute': timedelta(minutes=1), 'hourly': timedelta(hours=1),
+          'daily': timedelta(days=1)}
+
+
+def _parse_date(date):
+   """return the date of a Sched date setting |date|, e.g. '01\\31\\2018',
+   or None if |date| is empty
+   """
+
+   if not date:
+      return None
+   month, day, year = (int(part) for part in re.split(r'[\\/]', date))
+   return datetime(year, month, day)
+
+
+def start_datetime(settings, created):
+   """return the datetime the schedule in the Sched settings |settings|
+   starts at. A missing start date or start time is taken from datetime
+   |created|, the time the task was created, rounded up to the minute so a
+   'once' task without a start time still fires after it was created.
+   """
+
+   if not settings.get('start_time'):
+      rounded = created.replace(second=0, microsecond=0)
+      created = rounded if rounded == created else \
+         rounded + timedelta(minutes=1)
+   start = _parse_date(settings.get('start_date')) or \
+      created.replace(hour=0, minute=0, second=0, microsecond=0)
+   if settings.get('start_time'):
+      hour, minute = (int(part) for part in settings['start_time'].split(':'))
+   else:
+      hour, minute = created.hour, created.minute
+   return start.replace(hour=hour, minute=minute)
+
+
+def end_datetime(settings):
+   """return the datetime after which the schedule in the Sched settings
+   |settings| doesn't fire anymore, or None if it has no end date. The end
+   date itself is included.
+   """
+
+   end = _parse_date(settings.get('end_date'))
+   return None if end is None else end + timedelta(days=1)
+
+
+def _schedule_of(settings):
+   """return the (schedule, modifier) pair of the Sched settings |settings|
+   with the schedule lower cased and 'quarterly' translated to every 92
+   days, the same as Sched does
+   """
+
+   schedule = settings['schedule'].lower()
+   if schedule == 'quarterly':
+      return 'daily', 92
+   return schedule, settings.get('modifier', '')
+
+
+def _next_weekly(settings, modifier, start, after):
+   """return the first weekly fire at or after datetime |after|. The task
+   fires on its days, the weekday of |start| by default, every |modifier|
+   weeks counted from the week |start| is in.
+   """
+
+   every = modifier or 1
+   days = sorted(_DAYS.index(d) for d in settings.get('days') or []) or \
+      [start.weekday()]
+   monday = start - timedelta(days=start.weekday())
+   after = max(after, start)
+
+   week = (after - monday).days // 7
+   week += -week % every
+   while True:
+      for day in days:
+         fire = monday + timedelta(weeks=week, days=day)
+         if fire >= after:
+            return fire
+      week += every
+
+
+def _nth_weekday(year, month, weekday, week):
+   """return the day of |month| of |year| that is the |week|th, counted
+   from 0, |weekday| of the month, or the last one if |week| is -1
+   """
+
+   if week < 0:
+      last = calendar.monthrange(year, month)[1]
+      return last - (calendar.weekday(year, month, last) - weekday) % 7
+   return 1 + (weekday - calendar.weekday(year, month, 1)) % 7 + 7 * week
+
+
+def _monthly_days(settings, modifier, start, year, month):
+   """return the sorted days of |month| of |year| a monthly schedule with
+   |modifier| fires on: the last day for LASTDAY, its days, the weekday of
+   |start| by default, of the week named by FIRST to LAST, or the first
+   day otherwise
+   """
+
+   if modifier == 'LASTDAY':
+      return [calendar.monthrange(year, month)[1]]
+   elif modifier in _WEEKS:
+      week = _WEEKS.index(modifier) if modifier != 'LAST' else -1
+      days = [_DAYS.index(d) for d in settings.get('days') or []] or \
+         [start.weekday()]
+      return sorted(_nth_weekday(year, month, day, week) for day in days)
+   return [1]
+
+
+def _next_monthly(settings, modifier, start, after):
+   """return the first monthly fire at or after datetime |after|. The task
+   fires on the days given by |modifier|, see _monthly_days(), of its
+   months, or of every month for the LASTDAY and week modifiers. Without
+   months, an integer |modifier| makes it fire every |modifier| months
+   counted from the month |start| is in.
+   """
+
+   if isinstance(modifier, str) and modifier:
+      if modifier != 'LASTDAY' and modifier not in _WEEKS:
+         raise ValueError("unknown monthly modifier {}".format(modifier))
+      every = 1
+   else:
+      every = modifier or 1
+   months = set(_MONTHS.index(m) for m in settings.get('months') or [])
+   after = max(after, start)
+
+   index = start.year * 12 + start.month - 1
+   last = after.year * 12 + after.month - 1
+   if not months:
+      index += -(-(last - index) // every) * every
+   else:
+      index = last
+   while True:
+      year, month = divmod(index, 12)
+      if not months or month in months:
+         for day in _monthly_days(settings, modifier, start, year, month + 1):
+            fire = start.replace(year=year, month=month + 1, day=day)
+            if fire >= after:
+               return fire
+      index += every if not months else 1
+
+
+def next_fire(settings, start, after):
+   """return the first datetime at or after datetime |after| at which the
+   schedule in the Sched settings |settings| starting at datetime |start|
+   fires, or None if it never fires again. Event schedules (onstart,
+   onlogon, onidle) never fire on their own. ValueError is raised for a
+   modifier the schedule doesn't take.
+   """
+
+   schedule, modifier = _schedule_of(settings)
+   if schedule in EVENT_SCHEDULES:
+      return None
+   elif isinstance(modifier, str) and modifier and schedule != 'monthly':
+      raise ValueError("modifier {} is only valid for monthly schedules"
+                       .format(modifier))
+   elif schedule == 'once':
+      fire = start if start >= after else None
+   elif schedule == 'weekly':
+      fire = _next_weekly(settings, modifier, start, after)
+   elif schedule == 'monthly':
+      fire = _next_monthly(settings, modifier, start, after)
+   else:
+      period = _UNITS[schedule] * (modifier or 1)
+      fire = start
+      if after > start:
+         fire += period * -((start - after) // period)
+
+   end = end_datetime(settings)
+   return None if fire is None or end is not None and fire >= end else fire
+
+
+def fire_times(settings, start=None, after=None, count=None):
+   """yield the datetimes at or after datetime |after|, the current time if
+   None, at which the schedule in the Sched settings |settings| starting at
+   datetime |start| fires, in order. A missing |start| is taken from the
+   settings and |after|, as if the task was created then. At most |count|
+   datetimes are yielded if it is given, otherwise they go on for as long
+   as the schedule fires.
+   """
+
+   after = after or datetime.now()
+   start = start or start_datetime(settings, after)
+   fire = next_fire(settings, start, after)
+   schedule, modifier = _schedule_of(settings)
+   # fixed periods are stepped through without searching for each fire
+   period = _UNITS[schedule] * (modifier or 1) if schedule in _UNITS else None
+   end = end_datetime(settings)
+   n = 0
+   while fire is not None and (count is None or n < count):
+      yield fire
+      n += 1
+      if period is None:
+         fire = next_fire(settings, start, fire + timedelta(seconds=1))
+      else:
+         fire += period
+         if end is not None and fire >= end:
+            fire = None
+
+
+def merge_fire_times(tasks, after=None, until=None):
+   """yield a (datetime, name) pair for every fire of the tasks in iterable
+   |tasks|, in time order, from datetime |after| until just before datetime
+   |until|, the current time and never if None. A task is either Sched
+   settings or a (settings, start) pair, see fire_times(). The next fire
+   of every task is kept in a heap, so each pair takes O(log n) in the
+   number of tasks. Fires at the same time come in the order of |tasks|.
+   """
+
+   after = after or datetime.now()
+   heap = []
+   for seq, task in enumerate(tasks):
+      settings, start = task if isinstance(task, tuple) else (task, None)
+      fires = fire_times(settings, start, after)
+      fire = next(fires, None)
+      if fire is not None:
+         heap.append((fire, seq, settings['name'], fires))
+   heapq.heapify(heap)
+
+   while heap:
+      fire, seq, name, fires = heap[0]
+      if until is not None and fire >= until:
+         return
+      yield fire, name
+      fire = next(fires, None)
+      if fire is None:
+         heapq.heappop(heap)
+      else:
+         heapq.heapreplace(heap, (fire, seq, name, fires))
+
+
+def run_command(command, cwd):
+   """start shell command string |command| in directory |cwd| without
+   waiting for it and return its subprocess.Popen object
+   """
+
+   return subprocess.Popen(command, shell=True, cwd=cwd,
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+
+
+class ScheduledTask:
+   """a task held by an Engine"""
+
+   __slots__ = ('name', 'settings', 'batpath', 'start', 'next_run',
+                'last_run', 'last_result', 'proc', 'gen')
+
+   def __init__(self, name, settings, batpath, start):
+      """create a ScheduledTask named |name| with the validated Sched
+      settings |settings|, wrapper script |batpath| and start datetime
+      |start|
+      """
+
+      self.name = name
+      self.settings = settings
+      self.batpath = batpath
+      self.start = start
+      self.next_run = None
+      self.last_run = None
+      self.last_result = None
+      self.proc = None
+      self.gen = 0
+
+   @property
+   def running(self):
+      """return True if the command of the last run is still running"""
+
+      return self.proc is not None and self.proc.poll() is None
+
+
+class Engine:
+   """scheduler firing tasks from a heap ordered by next run time. Adding,
+   replacing, removing and firing a task is O(log n) in the number of
+   tasks. Replaced and removed tasks leave stale heap entries behind that
+   are skipped when they come up and dropped when they outnumber the live
+   ones. Tasks only fire while run_pending() is being called, either
+   directly or by the thread started with start(), so the engine can be
+   driven by a fake clock without sleeping.
+   """
+
+   def __init__(self, runner=run_command, clock=time.time, on_fire=None):
+      """create an Engine. |runner| is called with the command string and
+      working directory of each fired task and returns a
+      subprocess.Popen-like object, or None if the command already finished.
+      |clock| returns the current time in seconds since the epoch.
+      |on_fire| is called with the list of fired task names after tasks
+      have been fired.
+      """
+
+      self._runner = runner
+      self._clock = clock
+      self._on_fire = on_fire
+      self._tasks = {}
+      self._heap = []
+      self._running = set()
+      self._seq = itertools.count()
+      self._lock = threading.RLock()
+      self._wakeup = threading.Event()
+      self._thread = None
+      self._stopping = False
+
+   def now(self):
+      """return the current time from the clock as a datetime"""
+
+      return datetime.fromtimestamp(self._clock())
+
+   def __len__(self):
+      """return the number of tasks"""
+
+      return len(self._tasks)
+
+   def __contains__(self, name):
+      """return True if there is a task named |name|"""
+
+      return name in self._tasks
+
+   def __iter__(self):
+      """return an iterator over the task names"""
+
+      return iter(list(self._tasks))
+
+   def get(self, name):
+      """return the ScheduledTask named |name|, or None if there is none"""
+
+      return self._tasks.get(name)
+
+   def tasks(self):
+      """return a list of all ScheduledTasks"""
+
+      with self._lock:
+         return list(self._tasks.values())
+
+   def _push(self, task):
+      """put |task| on the heap at its next run time, if it has one"""
+
+      if task.next_run is not None:
+         heapq.heappush(self._heap, (
+            task.next_run.timestamp(), next(self._seq), task.gen, task))
+
+   def _compact(self):
+      """drop the stale heap entries once they outnumber the live ones"""
+
+      if len(self._heap) > 2 * len(self._tasks) + 64:
+         self._heap = [e for e in self._heap
+                       if self._tasks.get(e[3].name) is e[3] and
+                          e[2] == e[3].gen]
+         heapq.heapify(self._heap)
+
+   def add(self, settings, batpath=None, start=None):
+      """add the task described by the validated Sched settings |settings|
+      with wrapper script |batpath|, replacing any task with the same name,
+      and return its ScheduledTask. |start| is the datetime its schedule
+      starts at, taken from the settings and the current time if None, e.g.
+      to restore a saved task. The task is due next at the first time its
+      schedule fires from now on.
+      """
+
+      now = self.now()
+      task = ScheduledTask(settings['name'], settings, batpath,
+                           start or start_datetime(settings, now))
+      task.next_run = next_fire(settings, task.start, now)
+      with self._lock:
+         old = self._tasks.get(task.name)
+         if old is not None:
+            old.gen += 1
+            self._running.discard(old)
+         self._tasks[task.name] = task
+         self._push(task)
+         self._compact()
+      self._wakeup.set()
+      return task
+
+   def forecast(self, until=None):
+      """return an iterator of (datetime, name) pairs for the coming fires of
+      all tasks in time order until just before datetime |until|, see
+      merge_fire_times(). Fires missed while run_pending() wasn't called
+      are left out, the same as they are skipped when it is.
+      """
+
+      return merge_fire_times(
+         [(task.settings, task.start) for task in self.tasks()],
+         self.now(), until)
+
+   def remove(self, name):
+      """remove the task named |name|. Return True on success, False if
+      there is no such task.
+      """
+
+      with self._lock:
+         task = self._tasks.pop(name, None)
+         if task is None:
+            return False
+         task.gen += 1
+         self._running.discard(task)
+         self._compact()
+      self._wakeup.set()
+      return True
+
+   def due(self):
+      """return the time in seconds since the epoch the next task is due, or
+      None if no task is due to fire
+      """
+
+      with self._lock:
+         while self._heap:
+            ts, _, gen, task = self._heap[0]
+            if self._tasks.get(task.name) is task and gen == task.gen:
+               return ts
+            heapq.heappop(self._heap)
+      return None
+
+   def reap(self):
+      """record the exit status of the fired tasks that have finished"""
+
+      with self._lock:
+         for task in list(self._running):
+            status = task.proc.poll()
+            if status is not None:
+               task.last_result = status
+               task.proc = None
+               self._running.discard(task)
+
+   def _fire(self, task, now):
+      """run |task| fired at datetime |now|"""
+
+      working_dir = task.settings.get('working_dir', '.')
+      if working_dir.strip() == '.':
+         working_dir = Batcave.home(task.batpath) \
+            if task.batpath else os.getcwd()
+      task.last_run = now
+      task.proc = self._runner(task.settings['run_cmd'], working_dir)
+      if task.proc is None:
+         task.last_result = 0
+      else:
+         self._running.add(task)
+
+   def run_pending(self):
+      """fire every task that is due and schedule its next run. Runs missed
+      while nothing was calling run_pending() are skipped, the same as
+      schtasks does. Return the names of the fired tasks.
+      """
+
+      now = self.now()
+      after = now + timedelta(seconds=1)
+      fired = []
+      with self._lock:
+         self.reap()
+         while self._heap and self._heap[0][0] <= now.timestamp():
+            _, _, gen, task = heapq.heappop(self._heap)
+            if self._tasks.get(task.name) is not task or gen != task.gen:
+               continue
+            self._fire(task, now)
+            task.next_run = next_fire(task.settings, task.start, after)
+            self._push(task)
+            fired.append(task.name)
+      if fired and self._on_fire is not None:
+         self._on_fire(fired)
+      return fired
+
+   def trigger(self, event):
+      """fire every task scheduled on |event|, which is one of 'onstart',
+      'onlogon' or 'onidle'. Return the names of the fired tasks.
+      """
+
+      now = self.now()
+      fired = []
+      with self._lock:
+         for task in self._tasks.values():
+            if task.settings['schedule'].lower() == event:
+               self._fire(task, now)
+               fired.append(task.name)
+      if fired and self._on_fire is not None:
+         self._on_fire(fired)
+      return fired
+
+   def _run(self, poll_s):
+      """fire tasks until stop() is called, waiting at most |poll_s|
+      seconds between checks
+      """
+
+      while not self._stopping:
+         self.run_pending()
+         due = self.due()
+         timeout = poll_s if due is None else \
+            max(0, min(poll_s, due - self._clock()))
+         self._wakeup.wait(timeout)
+         self._wakeup.clear()
+
+   def start(self, poll_s=60):
+      """start firing tasks in a daemon thread. The thread wakes up when the
+      next task is due, when tasks change, and at least every |poll_s|
+      seconds.
+      """
+
+      if self._thread is not None:
+         return
+      self._stopping = False
+      self._thread = threading.Thread(
+         target=self._run, args=[poll_s], daemon=True)
+      self._thread.start()
+
+   def stop(self):
+      """stop the thread started with start() and wait for it to finish"""
+
+      if self._thread is None:
+         return
+      self._stopping = True
+      self._wakeup.set()
+      self._thread.join()
+      self._thread = None
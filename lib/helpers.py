@@ -1,26 +1,182 @@
+import asyncio
+import random
+import threading
 import time
 
-def keep_fkn_trying(
-   callback, args=None, kwargs=None, max_attempts=10, interval_sec=1):
-   attempts = 0
-   most_recent_error = None
-   while attempts < max_attempts:
-      try:
-         if args and kwargs:
-            callback(*args, **kwargs)
-         elif args:
-            callback(*args)
-         elif kwargs:
-            callback(**kwargs)
+# errors that happen again on every attempt, like a path that doesn't exist,
+# so retrying them only delays the error
+PERMANENT_ERRORS = (FileNotFoundError, FileExistsError, NotADirectoryError,
+                    IsADirectoryError, TypeError, ValueError, AttributeError)
+
+def is_transient(err):
+   """return True if exception |err| may go away by trying again, e.g. a
+   file locked by another process
+   """
+
+   return not isinstance(err, PERMANENT_ERRORS)
+
+class RetryMetrics:
+   """counts of what a RetryPolicy did, summed over all its calls"""
+
+   __slots__ = ('calls', 'attempts', 'retries', 'failures', 'sleep_sec',
+                'elapsed_sec')
+
+   def __init__(self):
+      self.calls = 0
+      self.attempts = 0
+      self.retries = 0
+      self.failures = 0
+      self.sleep_sec = 0.0
+      self.elapsed_sec = 0.0
+
+   def __repr__(self):
+      return "RetryMetrics({})".format(', '.join(
+         "{}={!r}".format(k, getattr(self, k)) for k in self.__slots__))
+
+class RetryPolicy:
+   """how to retry a callable that raises. Attempt n (from 0) failing is
+   followed by a wait of up to min(|max_sec|, |base_sec| * |multiplier| ** n)
+   seconds, a random amount of it if |jitter| is True, so callers retrying
+   at the same time spread out. Only the errors for which |retryable|
+   returns True are retried; the others are raised right away. Nothing is
+   retried after |max_attempts| attempts, after the final attempt there's
+   no wait, and no wait is started that would end past |deadline_sec|
+   seconds from the first attempt. The metrics property sums up the calls
+   made with the policy.
+   """
+
+   def __init__(self, max_attempts=10, base_sec=1, multiplier=2,
+                max_sec=30, jitter=True, deadline_sec=None,
+                retryable=is_transient, clock=time.monotonic,
+                sleep=time.sleep, rand=random.random):
+      """create a RetryPolicy, see the class doc. |clock|, |sleep| and
+      |rand| are the time.monotonic, time.sleep and random.random the policy
+      uses, replaceable so tests don't have to wait.
+      """
+
+      self.max_attempts = max_attempts
+      self.base_sec = base_sec
+      self.multiplier = multiplier
+      self.max_sec = max_sec
+      self.jitter = jitter
+      self.deadline_sec = deadline_sec
+      self.retryable = retryable
+      self._clock = clock
+      self._sleep = sleep
+      self._rand = rand
+      self._metrics = RetryMetrics()
+      self._lock = threading.Lock()
+
+   @property
+   def metrics(self):
+      """return the RetryMetrics of the calls made so far"""
+
+      return self._metrics
+
+   def reset_metrics(self):
+      """start counting the metrics from zero again"""
+
+      with self._lock:
+         self._metrics = RetryMetrics()
+
+   def delay(self, attempt):
+      """return the seconds to wait after the failed attempt number
+      |attempt|, counted from 0
+      """
+
+      cap = self.base_sec * self.multiplier ** attempt
+      if self.max_sec is not None:
+         cap = min(self.max_sec, cap)
+      return cap * self._rand() if self.jitter else cap
+
+   def _next_delay(self, attempt, err, start):
+      """return the seconds to wait before retrying after attempt number
+      |attempt| failed with |err| in a call started at |start|, or None if
+      |err| is to be raised
+      """
+
+      if attempt + 1 >= self.max_attempts or not self.retryable(err):
+         return None
+      delay = self.delay(attempt)
+      if self.deadline_sec is not None and \
+         self._clock() + delay - start > self.deadline_sec:
+         return None
+      return delay
+
+   def _record(self, attempts, sleep_sec, start, failed):
+      """add a call of |attempts| attempts that waited |sleep_sec| seconds in
+      total, started at |start| and |failed| or not, to the metrics
+      """
+
+      with self._lock:
+         m = self._metrics
+         m.calls += 1
+         m.attempts += attempts
+         m.retries += attempts - 1
+         m.failures += failed
+         m.sleep_sec += sleep_sec
+         m.elapsed_sec += self._clock() - start
+
+   def call(self, callback, *args, **kwargs):
+      """return callback(|*args|, |**kwargs|), trying again as the policy
+      says while it raises. The error of the last attempt is raised if it
+      never succeeds.
+      """
+
+      start = self._clock()
+      slept = 0
+      for attempt in range(self.max_attempts):
+         try:
+            result = callback(*args, **kwargs)
+         except Exception as err:
+            delay = self._next_delay(attempt, err, start)
+            if delay is None:
+               self._record(attempt + 1, slept, start, True)
+               raise
+         else:
+            self._record(attempt + 1, slept, start, False)
+            return result
+         self._sleep(delay)
+         slept += delay
+
+   async def acall(self, callback, *args, **kwargs):
+      """coroutine version of call() awaiting the coroutine function
+      |callback| and waiting with asyncio.sleep, so the event loop is free
+      between attempts
+      """
+
+      start = self._clock()
+      slept = 0
+      for attempt in range(self.max_attempts):
+         try:
+            result = await callback(*args, **kwargs)
+         except Exception as err:
+            delay = self._next_delay(attempt, err, start)
+            if delay is None:
+               self._record(attempt + 1, slept, start, True)
+               raise
          else:
-            callback()
-      except Exception as err:
-         most_recent_error = err
-         attempts += 1
-         time.sleep(interval_sec)
-         continue
-      most_recent_error = None
-      break
-
-   if most_recent_error:
-      raise most_recent_error
+            self._record(attempt + 1, slept, start, False)
+            return result
+         await asyncio.sleep(delay)
+         slept += delay
+
+def keep_fkn_trying(
+   callback, args=None, kwargs=None, max_attempts=10, interval_sec=1,
+   deadline_sec=None, retryable=is_transient):
+   """call |callback| with list |args| and dictionary |kwargs| until it
+   doesn't raise, at most |max_attempts| times. Each wait between attempts
+   is a random part of |interval_sec| seconds, so callers retrying at the
+   same time spread out while the waits add up to no more than the
+   (|max_attempts| - 1) * |interval_sec| seconds of fixed waits, and the
+   waits stop once |deadline_sec| seconds have passed. Only the errors for
+   which |retryable| returns True are retried. By default that leaves out
+   PERMANENT_ERRORS, so e.g. a TypeError, ValueError or FileNotFoundError
+   is raised on the first attempt. The error of the last attempt is raised
+   if every attempt failed.
+   """
+
+   RetryPolicy(max_attempts, interval_sec, multiplier=1,
+               max_sec=interval_sec, deadline_sec=deadline_sec,
+               retryable=retryable).call(
+      callback, *(args or []), **(kwargs or {}))
@@ -0,0 +1,192 @@
+from lib.backends import Backend, SchtasksBackend
+
+import asyncio
+import threading
+import time
+
+
+class TaskInventory(Backend):
+   """snapshot of all root tasks of a backend, taken with one bulk query and
+   indexed by task name, so looking tasks up doesn't query the backend
+   each time. The snapshot is taken again once it is older than its TTL or
+   after refresh(). TaskInventory is a Backend itself, wrapping another one:
+   tasks created through it invalidate the snapshot and tasks deleted
+   through it are dropped from it, so changes made by this process are
+   seen right away. Changes made elsewhere are seen once the snapshot
+   expires.
+   """
+
+   def __init__(self, backend=None, ttl=5, clock=time.monotonic):
+      """create a TaskInventory of Backend |backend|, SchtasksBackend if
+      None. The snapshot expires |ttl| seconds after it was taken, as
+      measured by |clock|.
+      """
+
+      self._backend = backend or SchtasksBackend()
+      self._ttl = ttl
+      self._clock = clock
+      self._tasks = {}
+      self._taken = None
+      self._gen = 0
+      self._lock = threading.Lock()
+      self._arefreshing = None
+
+   @property
+   def backend(self):
+      """return the wrapped Backend"""
+
+      return self._backend
+
+   def _is_fresh(self):
+      """return True if the snapshot was taken and hasn't expired yet"""
+
+      return self._taken is not None and \
+         self._clock() - self._taken < self._ttl
+
+   def refresh(self):
+      """take a new snapshot with one bulk query of the backend"""
+
+      with self._lock:
+         gen = self._gen
+      taken = self._clock()
+      tasks = self._backend.bulk_query()
+      with self._lock:
+         self._tasks = tasks
+         # a task created or deleted while querying may be out of date in
+         # |tasks|
+         self._taken = taken if gen == self._gen else None
+
+   def invalidate(self):
+      """make the next lookup take a new snapshot"""
+
+      with self._lock:
+         self._gen += 1
+         self._taken = None
+
+   def snapshot(self):
+      """return a dictionary of task names to Task named tuples for all root
+      tasks, taking a new snapshot if the current one has expired
+      """
+
+      if not self._is_fresh():
+         self.refresh()
+      with self._lock:
+         return dict(self._tasks)
+
+   def get(self, taskname):
+      """return the Task named tuple for the task named |taskname|, or an
+      empty tuple if no such task exists
+      """
+
+      if not self._is_fresh():
+         self.refresh()
+      with self._lock:
+         return self._tasks.get(taskname, ())
+
+   def __contains__(self, taskname):
+      """return True if a task named |taskname| exists"""
+
+      return bool(self.get(taskname))
+
+   def create(self, settings, batpath):
+      """create the task with the wrapped backend and invalidate the
+      snapshot
+      """
+
+      try:
+         self._backend.create(settings, batpath)
+      finally:
+         self.invalidate()
+
+   def delete(self, taskname):
+      """delete the task with the wrapped backend and drop it from the
+      snapshot. Return True on success, False if the task doesn't exist.
+      """
+
+      deleted = self._backend.delete(taskname)
+      with self._lock:
+         self._gen += 1
+         self._tasks.pop(taskname, None)
+      return deleted
+
+   def query(self, taskname):
+      """return the Task named tuple for the task named |taskname| from the
+      snapshot, or an empty tuple if no such task exists
+      """
+
+      return self.get(taskname)
+
+   def bulk_query(self, top_lv_only=True):
+      """return a dictionary of task names to Task named tuples for all
+      tasks. Root tasks come from the snapshot, all tasks are queried from
+      the wrapped backend.
+      """
+
+      if top_lv_only:
+         return self.snapshot()
+      return self._backend.bulk_query(top_lv_only)
+
+   async def _arefresh(self):
+      """coroutine version of refresh()"""
+
+      with self._lock:
+         gen = self._gen
+      taken = self._clock()
+      tasks = await self._backend.abulk_query()
+      with self._lock:
+         self._tasks = tasks
+         self._taken = taken if gen == self._gen else None
+
+   async def arefresh(self):
+      """coroutine version of refresh(). Coroutines refreshing at the same
+      time share one bulk query.
+      """
+
+      if self._arefreshing is None:
+         self._arefreshing = asyncio.ensure_future(self._arefresh())
+      refreshing = self._arefreshing
+      try:
+         await asyncio.shield(refreshing)
+      finally:
+         if self._arefreshing is refreshing and refreshing.done():
+            self._arefreshing = None
+
+   async def aget(self, taskname):
+      """coroutine version of get()"""
+
+      if not self._is_fresh():
+         await self.arefresh()
+      with self._lock:
+         return self._tasks.get(taskname, ())
+
+   async def acreate(self, settings, batpath):
+      """coroutine version of create()"""
+
+      try:
+         await self._backend.acreate(settings, batpath)
+      finally:
+         self.invalidate()
+
+   async def adelete(self, taskname):
+      """coroutine version of delete()"""
+
+      deleted = await self._backend.adelete(taskname)
+      with self._lock:
+         self._gen += 1
+         self._tasks.pop(taskname, None)
+      return deleted
+
+   async def aquery(self, taskname):
+      """coroutine version of query()"""
+
+      return await self.aget(taskname)
+
+   async def abulk_query(self, top_lv_only=True):
+      """coroutine version of bulk_query()"""
+
+      if top_lv_only:
+         if not self._is_fresh():
+            await self.arefresh()
+         with self._lock:
+            return dict(self._tasks)
+      return await self._backend.abulk_query(top_lv_only)
@@ -0,0 +1,120 @@
+import json
+import re
+
+
+class ObjectStream:
+   """incremental reader of the top level JSON object in a text file. The
+   file is read in chunks and each (key, value) pair of the object is
+   yielded as soon as it is parsed, so only one top level value needs to
+   be in memory at a time.
+   """
+
+   _WS = re.compile(r'[ \t\n\r]*')
+   # characters that may follow the part of a number parsed so far
+   _NUMBER_TAIL = re.compile(r'[0-9.eE+\-]*')
+
+   def __init__(self, fp, chunk_size=65536):
+      """create an ObjectStream reading the text file object |fp| |chunk_size|
+      characters at a time
+      """
+
+      self._fp = fp
+      self._chunk_size = chunk_size
+      self._decoder = json.JSONDecoder()
+      self._buf = ''
+      self._pos = 0
+      self._eof = False
+
+   def _read_more(self):
+      """append the next chunk of the file to the buffer, dropping what has
+      been parsed already. The chunk is at least as big as what is left
+      in the buffer, so a value spanning many chunks is reparsed a
+      logarithmic number of times. Return False at the end of the file.
+      """
+
+      if self._eof:
+         return False
+      rest = self._buf[self._pos:]
+      chunk = self._fp.read(max(self._chunk_size, len(rest)))
+      if not chunk:
+         self._eof = True
+      self._buf = rest + chunk
+      self._pos = 0
+      return True
+
+   def _error(self, msg):
+      """return a json.JSONDecodeError with message |msg| at the current
+      position
+      """
+
+      return json.JSONDecodeError(msg, self._buf, self._pos)
+
+   def _peek(self):
+      """skip whitespace and return the next character without consuming
+      it, or '' at the end of the file
+      """
+
+      while True:
+         self._pos = ObjectStream._WS.match(self._buf, self._pos).end()
+         if self._pos < len(self._buf) or not self._read_more():
+            return self._buf[self._pos:self._pos + 1]
+
+   def _expect(self, chars):
+      """consume and return the next non-whitespace character, which must
+      be one of |chars|
+      """
+
+      c = self._peek()
+      if not c or c not in chars:
+         raise self._error("Expecting one of {!r}".format(chars))
+      self._pos += 1
+      return c
+
+   def _value(self):
+      """parse and return the next JSON value"""
+
+      self._peek()
+      while True:
+         try:
+            value, end = self._decoder.raw_decode(self._buf, self._pos)
+         except json.JSONDecodeError:
+            if self._read_more():
+               continue
+            raise
+         # a number or literal at the end of the buffer might continue in
+         # the next chunk. raw_decode() stops a number cut off after e.g.
+         # '1.' or '12e' at the part that parses, so a number only counts
+         # as complete once something that can't continue it follows.
+         if isinstance(value, (int, float)) and \
+            not isinstance(value, bool):
+            end_of_number = ObjectStream._NUMBER_TAIL.match(
+               self._buf, end).end()
+         else:
+            end_of_number = end
+         if end_of_number == len(self._buf) and self._read_more():
+            continue
+         self._pos = end
+         return value
+
+   def __iter__(self):
+      """yield the (key, value) pairs of the top level object in the order
+      they appear in the file. A json.JSONDecodeError is raised as soon as
+      the file turns out not to be a single JSON object.
+      """
+
+      self._expect('{')
+      if self._peek() == '}':
+         self._pos += 1
+      else:
+         while True:
+            if self._peek() != '"':
+               raise self._error("Expecting property name enclosed in "
+                                 "double quotes")
+            key = self._value()
+            self._expect(':')
+            yield key, self._value()
+            if self._expect(',}') == '}':
+               break
+
+      if self._peek():
+         raise self._error("Extra data")
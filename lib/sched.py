@@ -1,25 +1,85 @@
-from lib.settings import Settings
+from lib.settings import Settings, materialize
+from lib.schema import fingerprint
+from lib.custom_exceptions import *
+from lib.backends import SchtasksBackend, make_task
+from lib.inventory import TaskInventory
+from lib.batcave import Batcave
+from lib.engine import fire_times, merge_fire_times
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import json
 import os
 import subprocess
+import lib.atomic as atomic
 import lib.helpers as dammit
-import re
-import csv
+
+
+ScheduleResult = namedtuple('ScheduleResult', ['source', 'taskname', 'error'])
+DescheduleResult = namedtuple(
+   'DescheduleResult', ['taskname', 'deleted', 'error'])
+ReconcilePlan = namedtuple(
+   'ReconcilePlan', ['create', 'update', 'delete', 'unchanged', 'invalid'])
+ReconcileResult = namedtuple(
+   'ReconcileResult', ['plan', 'scheduled', 'descheduled'])
 
 
 class Sched:
    """class to manage scheduling tasks"""
 
+   _VALID = {
+      'name': '*:str',
+      'run_cmd': '*:str',
+      'working_dir': '*:str',
+      'start_min': '*:bool',
+      'start_time': [r'\d{2}:\d{2}:re', ''],
+      'schedule': ['once', 'minute', 'hourly', 'daily', 'quarterly',
+                   'weekly', 'monthly', 'onstart', 'onlogon', 'onidle'],
+      'days': ['MON', 'TUE', 'WED', 'THU',
+               'FRI', 'SAT', 'SUN'],
+      'months': ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN',
+                 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC'],
+      'modifier': ['*:int',
+                   'FIRST', 'SECOND', 'THIRD', 'FOURTH',
+                   'LAST', 'LASTDAY', ''],
+      'start_date': [r'\d{2}\\\d{2}\\\d{4}:re', ''],
+      'end_date': [r'\d{2}\\\d{2}\\\d{4}:re', '']
+   }
+
+   _DEFAULTS = {
+      'working_dir': '.',
+      'start_min': True,
+      'start_time': '',
+      'days': [],
+      'months': [],
+      'modifier': '',
+      'start_date': '',
+      'end_date': ''
+   }
+
+   _SCHEMA = Settings.compile_schema(_VALID)
+
+   # the Task fields compared to tell whether a scheduled task matches its
+   # settings. start_time and start_date are only compared when set, since
+   # schtasks takes them from the time the task was created otherwise.
+   _RECONCILED = ('task_to_run', 'schedule_type', 'start_time', 'start_date',
+                  'end_date', 'days', 'months', 'repeat_every')
+   _EVENT_SCHEDULES = ('onstart', 'onlogon', 'onidle')
+
+   # durability of the settings files and batch scripts written, one of
+   # lib.atomic.DURABILITY
+   durability = atomic.NONE
+
    @staticmethod
    def _gen_sched_settings_file(settings_filename, settings):
       """generate a settings file for this Sched class. |settings_filename| is
       the settings filename and |settings| is the dictionary of settings.
+      The file is replaced atomically and not rewritten if it hasn't
+      changed.
       """
 
-      with open(settings_filename, 'w') as sched_settings:
-         json.dump(settings, sched_settings, indent=4)
+      atomic.atomic_write(settings_filename, json.dumps(settings, indent=4),
+                          Sched.durability)
 
    @staticmethod
    def gen_sched_settings_file(settings_filename, **settings):
@@ -36,9 +96,10 @@ class Sched:
    @staticmethod
    def _try_again(
       callback, args=None, kwargs=None, max_attempts=10, interval_s=1):
-      """try integer |max_attempts| attempts at integer |interval_s| seconds
-      to do function object |callback|. And pass in list |args| and dictionary
-      |kwargs| too. Default |max_attempts| is 10. Default |interval_s| is 1.
+      """try integer |max_attempts| attempts up to integer |interval_s|
+      seconds apart to do function object |callback|. And pass in list
+      |args| and dictionary |kwargs| too. Default |max_attempts| is 10.
+      Default |interval_s| is 1.
       """
 
       dammit.keep_fkn_trying(callback, args, kwargs, max_attempts, interval_s)
@@ -51,230 +112,131 @@ class Sched:
 
       os.makedirs(batcave)
 
-   @staticmethod
-   def _schtasks(*args):
-      """run schtasks on the command line with |*args| which is a
-      variadic list of schtasks arguments. subprocess.CalledProcessError is
-      raised on any error.
-      """
-
-      return subprocess.run(
-         ' '.join([tok for tok in ['schtasks', *args] if tok]),
-         stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True,
-         universal_newlines=True)
-
-   @staticmethod
-   def _camel_to_snake(s):
-      """return string |s| converted from camel case to snake case"""
-
-      s = re.sub(r'\s+', '_', s)
-      s = re.sub(r'\W+', '', s)
-      s = s[0].lower() + re.sub(r'[A-Z]', '_\g<0>', s[1:])
-      s = re.sub(r'_+', '_', s)
-      return s.lower()
-
-   @staticmethod
-   def _filter_out_headers(headers_csv, tasks_csv):
-      """filter out all csv sublists in list |tasks_csv| of any sublist
-      that is equal to list |headers_csv|
-      """
-
-      return [t for t in tasks_csv if t != headers_csv]
-
-   @staticmethod
-   def _filter_out_non_top_lv(tasks_csv):
-      """filter out all sublists in list |tasks_csv| whose second element
-      has more than one backslash in the string. The second element in
-      schtasks context is the taskname. More than one backslash means
-      that the task file is not in the root folder. Return the new list
-      of tasks that exist in the root.
-      """
-
-      return [t for t in tasks_csv if len(t[1].split('\\')) <= 2]
-
-   @staticmethod
-   def _convert_to_task_tuples(headers_csv, tasks_csv):
-      """convert the task sublists in list |tasks_csv| to Task named
-      tuples with property names defined in |headers_csv| and return it
-      """
-
-      Task = namedtuple('Task', headers_csv)
-      return [Task(*t) for t in tasks_csv]
-
-   @staticmethod
-   def _create_task_dict_from(tasklist):
-      """return a dictionary of task names to Task named tuples based
-      on the list of Task named tuples |tasklist|
-      """
+   # the schtasks helpers live in SchtasksBackend now
+   _schtasks = staticmethod(SchtasksBackend._schtasks)
+   _camel_to_snake = staticmethod(SchtasksBackend._camel_to_snake)
+   _format_tasks_to_dict = staticmethod(SchtasksBackend._format_tasks_to_dict)
+   _query_tasks_dict = staticmethod(SchtasksBackend._query_tasks_dict)
+   _delete_task = staticmethod(SchtasksBackend._delete_task)
 
-      return {os.path.basename(t.task_name):t for t in tasklist}
+   # lookups are answered from a snapshot of all tasks taken with one
+   # schtasks query
+   _backend = TaskInventory(SchtasksBackend())
 
    @staticmethod
-   def _format_tasks_to_dict(raw_tasks, top_lv_only=True):
-      """takes csv output structured like `schtasks /fo csv ...` |raw_tasks|
-      and converts it to a dictionary of task names to Task named tuples.
-      If |top_lv_only| is True, then return only the tasks at the root,
-      otherwise return all tasks. |top_lv_only| is True by default.
+   def set_default_backend(backend):
+      """make Backend |backend| the one used by Sched objects created
+      without a backend and by the static methods called without one
       """
 
-      tasks = raw_tasks.stdout.splitlines()
-      tasks = list(csv.reader(tasks))
+      Sched._backend = backend
 
-      orig_headers = tasks[0]
-      tasks = tasks[1:]
-      headers = [Sched._camel_to_snake(name) for name in orig_headers]
-      tasks = Sched._filter_out_headers(orig_headers, tasks)
-      if top_lv_only:
-         tasks = Sched._filter_out_non_top_lv(tasks)
-
-      tasks = Sched._convert_to_task_tuples(headers, tasks)
-      return Sched._create_task_dict_from(tasks)
-
-   @staticmethod
-   def _query_tasks_dict(taskname=None, top_lv_only=True):
-      """return a dictionary of task names to Task named tuples representing
-      the content from `schtasks /fo csv /v ...`. If |taskname| is set to
-      a non-empty string, '/tn |taskname|' is added to the command invocation.
-      By default, |taskname| is None/falsy which will result in all root tasks
-      to be fetched if |top_lv_only| is True. If |top_lv_only| is False and
-      |taskname| is a non-empty string, then all tasks are fetched.
+   def _create_task(self, batpath):
+      """create a task with this Sched object's backend given the path to
+      the batch script |batpath|. |batpath| should be the absolute path.
+      subprocess.CalledProcessError is raised on error with schtasks.
+      Once the task is created, the fingerprint of its settings is noted
+      in the batcave, see is_current().
       """
 
-      tasks = Sched._schtasks(
-         '/query', '/fo csv', '/v', "/tn {}".format(taskname) if taskname else '')
-      tasks = Sched._format_tasks_to_dict(tasks, top_lv_only)
-      return tasks
+      self._backend.create(self._settings, batpath)
+      self._cave().note(self._settings['name'], self.fingerprint())
 
-   @staticmethod
-   def _delete_task(taskname):
-      """delete task whose name is |taskname|. Return true on success, false
-      if the task name is not found. Raise subprocess.CalledProcessError on
-      any other error.
+   def fingerprint(self):
+      """return a hex digest identifying the validated settings of this
+      Sched object, translations like 'quarterly' included
       """
 
-      try:
-         Sched._schtasks('/delete', "/tn {}".format(taskname), '/f')
-      except subprocess.CalledProcessError as cpe:
-         if re.search(r'cannot.*find.*file.*specified', cpe.output, re.I) and \
-            cpe.returncode == 1:
-            return False
-         else:
-            raise cpe
-      return True
+      return fingerprint(materialize(self._settings))
 
-   def _create_task(self, batpath):
-      """create a task with schtasks given the path to the batch script
-      |batpath|. |batpath| should be the absolute path.
-      subprocess.CalledProcessError is raised on error.
-      """
+   def _cave(self):
+      """return the Batcave managing this Sched object's batcave"""
 
-      Sched._schtasks(
-         '/create', '/f',
-         "/tr \"{}\"".format(batpath),
-         "/st {}".format(self._settings['start_time'])
-            if self._settings['start_time'] else '',
-         "/sc {}".format(self._settings['schedule']),
-         "/mo {}".format(self._settings['modifier'])
-            if self._settings['schedule'].lower() in
-               ['minute', 'hourly', 'daily', 'weekly', 'monthly'] and
-               self._settings['modifier'] else '',
-         "/d {}".format(','.join(self._settings['days']))
-            if self._settings['schedule'].lower() == 'weekly' and
-               self._settings['days'] else '',
-         "/m {}".format(','.join(self._settings['months']))
-            if self._settings['schedule'].lower() == 'monthly' and
-               self._settings['months'] else '',
-         "/i {}".format(self._settings['idle_time'])
-            if self._settings['schedule'].lower() == 'onidle' and
-               self._settings['idle_time'] else ''
-         "/sd {}".format(self._settings['start_date'])
-            if self._settings['schedule'].lower() in
-               ['minute', 'hourly', 'daily', 'weekly', 'monthly', 'once'] and
-               self._settings['start_date'] else '',
-         "/ed {}".format(self._settings['end_date'])
-            if self._settings['schedule'].lower() in
-               ['minute', 'hourly', 'daily', 'weekly', 'monthly'] and
-               self._settings['end_date'] else '',
-         "/tn {}".format(self._settings['name']))
+      return Batcave.open(self._batcave, Sched.durability)
 
    def _create_bat(self):
       """create a wrapper batch script from the _settings property. This
       is needed to control working directory programatically, and to
       control starting a program minimized if possible. This makes it a
       lot easier than directly invoking the desired program with /tr
-      flag of schtasks
+      flag of schtasks. The script is stored in the batcave by content, see
+      lib.batcave.Batcave, so tasks with the same working_dir, start_min and
+      run_cmd share one script. Return the absolute path of the script.
+      """
+
+      return self._cave().put(self._settings['name'], self._bat_content())
+
+   def _bat_content(self):
+      """return the content of the wrapper batch script, see
+      _create_bat()
       """
 
-      batpath = os.path.realpath(
-         "{}\\{}.bat".format(self._batcave, self._settings['name']))
-      with open(batpath, 'w') as batman:
-         batman.write("@echo off\n")
-         working_dir = '%~dp0' \
-            if self._settings['working_dir'].strip() == '.' \
-            else self._settings['working_dir']
-         batman.write("cd /d {}\n".format(working_dir))
-         start_min = 'start /min' if self._settings['start_min'] else ''
-         batman.write("{} {}".format(
-            start_min, self._settings['run_cmd']).strip() + "\n")
-      return batpath
+      # scripts live in a shard subdirectory, so '.' is its parent
+      working_dir = '%~dp0..' \
+         if self._settings['working_dir'].strip() == '.' \
+         else self._settings['working_dir']
+      start_min = 'start /min' if self._settings['start_min'] else ''
+      return ''.join([
+         "@echo off\n",
+         "cd /d {}\n".format(working_dir),
+         "{} {}".format(start_min, self._settings['run_cmd']).strip() + "\n"
+      ])
 
    @staticmethod
-   def details_for(taskname):
+   def details_for(taskname, backend=None):
       """return a Task named tuple associated to |taskname|. If not task
       with the name |taskname| exists, then return an empty tuple. If
       any other error occurs, raise subprocess.CalledProcessError.
+      |backend| is the Backend to query, the default one if None.
       """
 
-      try:
-         return Sched._query_tasks_dict(taskname)[taskname]
-      except subprocess.CalledProcessError as cpe:
-         if re.search(r'cannot.*find.*file.*specified', cpe.output, re.I) and \
-            cpe.returncode == 1:
-            return ()
-         else:
-            raise cpe
+      return (backend or Sched._backend).query(taskname)
 
    @staticmethod
-   def is_task_scheduled(taskname):
-      """return True if |taskname| is already scheduled, False otherwise"""
+   def is_task_scheduled(taskname, backend=None):
+      """return True if |taskname| is already scheduled, False otherwise.
+      |backend| is the Backend to query, the default one if None.
+      """
 
-      return bool(Sched.details_for(taskname))
+      return bool(Sched.details_for(taskname, backend))
 
    @staticmethod
-   def deschedule_task_with_taskname(taskname):
+   def deschedule_task_with_taskname(taskname, backend=None):
       """deschedule the task named |taskname|. Return True on success, False
       if no task exists with the name |taskname|. Raise
-      subprocess.CalledProcessError for any other error.
+      subprocess.CalledProcessError for any other error. |backend| is the
+      Backend to delete the task from, the default one if None.
       """
 
-      return Sched._delete_task(taskname)
+      return (backend or Sched._backend).delete(taskname)
 
    @staticmethod
-   def _inject_translation_settings(settings_file):
-      """inject any settings into the JSON configuration read from
-      |settings_file| and return the updated dictionary. Right now
-      this checks if a 'quarterly' schedule was specified and
-      translates it to every 92 days."""
-
-      with open(settings_file, 'r') as shandle:
-         settings = json.load(shandle)
-
-         if settings['schedule'] == 'quarterly':
-            settings.update({
-               'schedule': 'daily',
-               'modifier': 92
-            })
-
+   def _inject_translation_settings(settings):
+      """inject any settings into the validated Settings object |settings|
+      and return the updated Settings object. Right now this checks if a
+      'quarterly' schedule was specified and translates it to every 92
+      days."""
+
+      if settings['schedule'] == 'quarterly':
+         return settings.updated(schedule='daily', modifier=92)
       return settings
 
-   def __init__(self, settings_file, batcave='batcave'):
+   def __init__(self, settings_file, batcave='batcave', schema=None,
+                cache=None, backend=None):
       """create a Sched handle object with configuration based on the JSON
       |settings_file| which is the path to the settings file. |batcave|
       is where all the batch scripts generated by this Sched object are
-      stored. This is 'batcave' by default, but can be any path. Refer
-      to the valid dictionary in the code below to know what the required
+      stored, see lib.batcave.Batcave. This is 'batcave' by default, but
+      can be any path. |schema|
+      is an optional Schema from Settings.compile_schema() to validate
+      against instead of the one compiled from Sched._VALID. |cache| is an
+      optional ValidationCache so reloading an unchanged settings file skips
+      parsing and validating it again. |backend| is the Backend tasks are
+      scheduled with, e.g. SchtasksBackend or InProcessBackend. If None,
+      the default one is used, see Sched.set_default_backend(). Refer
+      to the valid dictionary below (Sched._VALID) to know what the required
       JSON structure should be for a valid settings file. Refer to the
-      defaults dictionary in the code below to know what the optional
+      defaults dictionary below (Sched._DEFAULTS) to know what the optional
       settings are.
 
       valid={
@@ -307,40 +269,317 @@ class Sched:
       }
       """
 
-      self._settings = Settings(
-         Sched._inject_translation_settings(settings_file),
-         valid={
-            'name': '*:str',
-            'run_cmd': '*:str',
-            'working_dir': '*:str',
-            'start_min': '*:bool',
-            'start_time': [r'\d{2}:\d{2}:re', ''],
-            'schedule': ['once', 'minute', 'hourly', 'daily', 'quarterly',
-                         'weekly', 'monthly', 'onstart', 'onlogon', 'onidle'],
-            'days': ['MON', 'TUE', 'WED', 'THU',
-                     'FRI', 'SAT', 'SUN'],
-            'months': ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN',
-                       'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC'],
-            'modifier': ['*:int',
-                         'FIRST', 'SECOND', 'THIRD', 'FOURTH',
-                         'LAST', 'LASTDAY', ''],
-            'start_date': [r'\d{2}\\\d{2}\\\d{4}:re', ''],
-            'end_date': [r'\d{2}\\\d{2}\\\d{4}:re', '']
-         },
-         defaults={
-            'working_dir': '.',
-            'start_min': True,
-            'start_time': '',
-            'days': [],
-            'months': [],
-            'modifier': '',
-            'start_date': '',
-            'end_date': ''
-         })
+      self._settings = Sched._inject_translation_settings(Settings(
+         settings_file,
+         valid=schema or Sched._SCHEMA,
+         defaults=Sched._DEFAULTS,
+         cache=cache))
 
       if not os.path.isdir(batcave):
          dammit.keep_fkn_trying(self._create_batcave, [batcave])
       self._batcave = batcave
+      self._backend = backend or Sched._backend
+
+   @staticmethod
+   def _from_settings(settings, batcave, backend):
+      """return a Sched object for the validated Settings object |settings|
+      without validating it again. |batcave| must exist already.
+      """
+
+      sched = Sched.__new__(Sched)
+      sched._settings = Sched._inject_translation_settings(settings)
+      sched._batcave = batcave
+      sched._backend = backend or Sched._backend
+      return sched
+
+   @staticmethod
+   def schedule_many(settings_files, batcave='batcave', concurrency=4,
+                     schema=None, cache=None, backend=None):
+      """schedule the tasks defined by the settings files in iterable
+      |settings_files| and return a list of ScheduleResult(source, taskname,
+      error), one per settings file and in the same order. error is None on
+      success, otherwise it is the exception that kept the task from being
+      scheduled and taskname is None if the settings file is invalid. A
+      failure doesn't stop the other tasks from being scheduled.
+
+      All settings files are validated up front against one schema, then
+      all batch scripts are written to |batcave|, then the tasks are
+      created with |backend| from a pool of |concurrency| threads.
+      |batcave|, |schema|, |cache| and |backend| have the same meaning as
+      for Sched().
+      """
+
+      results, batpaths = Sched._prepare_many(
+         settings_files, batcave, schema, cache, backend)
+      with Batcave.open(batcave, Sched.durability).batch(), \
+         ThreadPoolExecutor(max(1, concurrency)) as pool:
+         futures = {i: pool.submit(sched._create_task, batpath)
+                    for i, (sched, batpath) in batpaths.items()}
+         for i, future in futures.items():
+            error = future.exception()
+            if error is not None:
+               results[i] = results[i]._replace(error=error)
+      return results
+
+   @staticmethod
+   def _prepare_many(settings_files, batcave, schema, cache, backend):
+      """validate the settings files in iterable |settings_files| and write
+      the batch scripts of the valid ones, see schedule_many(). Return the
+      list of ScheduleResults so far and a dictionary of the indices of the
+      tasks left to create to their (Sched, batpath) pair.
+      """
+
+      backend = backend or Sched._backend
+      results = []
+      scheds = {}
+      for r in Settings.validate_many(
+         settings_files, schema or Sched._SCHEMA, Sched._DEFAULTS,
+         cache=cache):
+         if r.error is None:
+            scheds[len(results)] = Sched._from_settings(
+               r.settings, batcave, backend)
+            results.append(ScheduleResult(r.source, r.settings['name'], None))
+         else:
+            results.append(ScheduleResult(r.source, None, r.error))
+
+      if scheds and not os.path.isdir(batcave):
+         dammit.keep_fkn_trying(Sched._create_batcave, [batcave])
+
+      batpaths = {}
+      if not scheds:
+         return results, batpaths
+      with Batcave.open(batcave, Sched.durability).batch():
+         for i, sched in scheds.items():
+            try:
+               batpaths[i] = (sched, sched._create_bat())
+            except OSError as err:
+               results[i] = results[i]._replace(error=err)
+      return results, batpaths
+
+   @staticmethod
+   def deschedule_many(tasknames, concurrency=4, backend=None,
+                       batcave=None):
+      """deschedule the tasks named in iterable |tasknames| with |backend|,
+      the default one if None, from a pool of |concurrency| threads. Return
+      a list of DescheduleResult(taskname, deleted, error), one per task
+      name and in the same order, where deleted is True if the task was
+      deleted and False if it didn't exist, and error is the exception
+      raised deleting it, if any. If |batcave| is given, the scripts of the
+      tasks that are gone are dropped from it, see Sched.deschedule_task().
+      """
+
+      backend = backend or Sched._backend
+      with ThreadPoolExecutor(max(1, concurrency)) as pool:
+         futures = [(taskname, pool.submit(backend.delete, taskname))
+                    for taskname in tasknames]
+         results = []
+         for taskname, future in futures:
+            error = future.exception()
+            results.append(DescheduleResult(
+               taskname, error is None and future.result(), error))
+      Sched._drop_scripts(batcave, results)
+      return results
+
+   @staticmethod
+   def _drop_scripts(batcave, results):
+      """drop the scripts of the tasks in list of DescheduleResults
+      |results| that were descheduled without error from |batcave|, if it
+      is not None
+      """
+
+      if batcave is None or not os.path.isdir(batcave):
+         return
+      cave = Batcave.open(batcave, Sched.durability)
+      with cave.batch():
+         for r in results:
+            if r.error is None:
+               cave.remove(r.taskname)
+
+   @staticmethod
+   def _normalized(field, value):
+      """return the value |value| of the Task field named |field| in the form
+      it is compared in, so differences in case, spacing or path spelling
+      don't count as changes
+      """
+
+      value = ' '.join(str(value).split())
+      if field == 'task_to_run':
+         return os.path.normcase(os.path.normpath(value)) \
+            if os.path.isabs(value) else value.casefold()
+      return value.casefold()
+
+   def _reconciled_fields(self):
+      """return the Task fields compared by is_current()"""
+
+      fields = Sched._RECONCILED
+      if self._settings['schedule'] in Sched._EVENT_SCHEDULES:
+         return [f for f in fields
+                 if f not in ('start_time', 'start_date', 'end_date')]
+      if not self._settings['start_time']:
+         fields = [f for f in fields if f != 'start_time']
+      if not self._settings['start_date']:
+         fields = [f for f in fields if f != 'start_date']
+      return fields
+
+   def is_current(self, task, batpath):
+      """return True if the Task named tuple |task| describes the task this
+      Sched object would schedule with the batch script |batpath|, i.e.
+      scheduling it again would change nothing. An empty |task| is never
+      current. Not every setting shows in a Task, e.g. the modifier of a
+      weekly schedule doesn't, so the task must also have been created
+      through a Sched object with the same settings last, as noted in the
+      batcave. Its Task fields are compared too, to catch changes made
+      without Sched.
+      """
+
+      if not task or \
+         self._cave().fingerprint(self._settings['name']) != \
+         self.fingerprint():
+         return False
+      expected = make_task(self._settings['name'], self._settings, batpath)
+      return all(
+         Sched._normalized(f, getattr(task, f, None)) ==
+         Sched._normalized(f, getattr(expected, f))
+         for f in self._reconciled_fields())
+
+   @staticmethod
+   def _settings_files(settings_dir):
+      """return the sorted paths of the json files in |settings_dir|"""
+
+      with os.scandir(settings_dir) as entries:
+         return sorted(e.path for e in entries
+                       if e.name.endswith('.json') and e.is_file())
+
+   @staticmethod
+   def _plan(settings_dir, batcave, schema, cache, backend):
+      """return the ReconcilePlan of reconcile() and a dictionary of the
+      names of the tasks to create or update to their (source, Sched)
+      pairs
+      """
+
+      backend = backend or Sched._backend
+      scheds = {}
+      invalid = []
+      for r in Settings.validate_many(
+         Sched._settings_files(settings_dir), schema or Sched._SCHEMA,
+         Sched._DEFAULTS, cache=cache):
+         if r.error is not None:
+            invalid.append(ScheduleResult(r.source, None, r.error))
+         elif r.settings['name'] in scheds:
+            invalid.append(ScheduleResult(
+               r.source, r.settings['name'], InvalidSettingError(
+                  'name', r.settings['name'],
+                  reason='task defined by another settings file too')))
+         else:
+            scheds[r.settings['name']] = (r.source, Sched._from_settings(
+               r.settings, batcave, backend))
+
+      tasks = backend.bulk_query()
+      cave = Batcave.open(batcave, Sched.durability)
+      create, update, unchanged = [], [], []
+      for name, (source, sched) in scheds.items():
+         batpath = cave.path(Batcave.digest(sched._bat_content()))
+         if name not in tasks:
+            create.append(name)
+         elif cave.script(name) == batpath and os.path.isfile(batpath) and \
+            sched.is_current(tasks[name], batpath):
+            unchanged.append(name)
+         else:
+            update.append(name)
+
+      # only tasks with a script in the batcave are ours to delete, and
+      # none if a settings file couldn't be read, as it may define one
+      delete = [] if invalid else [
+         name for name in cave.tasknames() if name not in scheds]
+      plan = ReconcilePlan(create, update, delete, unchanged, invalid)
+      return plan, {name: scheds[name] for name in create + update}
+
+   @staticmethod
+   def plan(settings_dir, batcave='batcave', schema=None, cache=None,
+            backend=None):
+      """return the ReconcilePlan reconcile() would apply, without applying
+      it. See reconcile() for the arguments.
+      """
+
+      return Sched._plan(settings_dir, batcave, schema, cache, backend)[0]
+
+   @staticmethod
+   def reconcile(settings_dir, batcave='batcave', concurrency=4, schema=None,
+                 cache=None, backend=None):
+      """make the tasks of |backend| match the settings files in directory
+      |settings_dir|, changing only what differs. The settings files are
+      validated and compared to one bulk query of |backend|, see
+      is_current(), to make a ReconcilePlan(create, update, delete,
+      unchanged, invalid) of task names, except for invalid, which is the
+      list of ScheduleResults of the settings files that are invalid or
+      name a task another one does too. Tasks with a script in |batcave|
+      and no settings file are deleted, unless a settings file is invalid.
+      Tasks that are up to date aren't touched.
+
+      The plan is applied from a pool of |concurrency| threads and a
+      ReconcileResult(plan, scheduled, descheduled) is returned, where
+      scheduled is the list of ScheduleResults of the created and updated
+      tasks and descheduled the list of DescheduleResults of the deleted
+      ones. |batcave|, |schema|, |cache| and |backend| have the same
+      meaning as for Sched().
+      """
+
+      backend = backend or Sched._backend
+      plan, scheds = Sched._plan(settings_dir, batcave, schema, cache, backend)
+      scheduled = []
+      batpaths = {}
+      if scheds:
+         with Batcave.open(batcave, Sched.durability).batch():
+            for name, (source, sched) in scheds.items():
+               try:
+                  batpaths[len(scheduled)] = (sched, sched._create_bat())
+                  scheduled.append(ScheduleResult(source, name, None))
+               except OSError as err:
+                  scheduled.append(ScheduleResult(source, name, err))
+
+      with Batcave.open(batcave, Sched.durability).batch(), \
+         ThreadPoolExecutor(max(1, concurrency)) as pool:
+         creates = {i: pool.submit(sched._create_task, batpath)
+                    for i, (sched, batpath) in batpaths.items()}
+         deletes = [(name, pool.submit(backend.delete, name))
+                    for name in plan.delete]
+         for i, future in creates.items():
+            error = future.exception()
+            if error is not None:
+               scheduled[i] = scheduled[i]._replace(error=error)
+         descheduled = []
+         for name, future in deletes:
+            error = future.exception()
+            descheduled.append(DescheduleResult(
+               name, error is None and future.result(), error))
+      Sched._drop_scripts(batcave, descheduled)
+      return ReconcileResult(plan, scheduled, descheduled)
+
+   def next_runs(self, count=1, after=None):
+      """return a list of the next |count| datetimes at or after datetime
+      |after|, the current time if None, at which the task bound to this
+      Sched handle object fires if it is scheduled at |after|. Nothing is
+      scheduled or queried, see lib.engine.fire_times().
+      """
+
+      return list(fire_times(self._settings, after=after, count=count))
+
+   @staticmethod
+   def forecast(settings_files, after=None, until=None, schema=None,
+                cache=None):
+      """return an iterator of (datetime, taskname) pairs for the fires of
+      the tasks defined by the settings files in iterable |settings_files|,
+      in time order, from datetime |after|, the current time if None, until
+      just before datetime |until|, as if they were all scheduled at
+      |after|. Invalid settings files are left out. |schema| and |cache|
+      have the same meaning as for Sched(). See
+      lib.engine.merge_fire_times().
+      """
+
+      return merge_fire_times(
+         (r.settings for r in Settings.validate_many(
+            settings_files, schema or Sched._SCHEMA, Sched._DEFAULTS,
+            cache=cache) if r.error is None), after, until)
 
    def schedule_task(self):
       """schedule the task that is bound to this Sched handle object and
@@ -355,12 +594,15 @@ class Sched:
 
    def deschedule_task(self):
       """deschedule the task that is bound to this Sched handle object and
-      defined by the settings file. Return True on success, False
-      if the task has not been scheduled yet. Raise
-      subprocess.CalledProcessError on any other error
+      defined by the settings file, and drop its script from the batcave.
+      Return True on success, False if the task has not been scheduled yet.
+      Raise subprocess.CalledProcessError on any other error
       """
 
-      return Sched.deschedule_task_with_taskname(self._settings['name'])
+      deleted = Sched.deschedule_task_with_taskname(
+         self._settings['name'], self._backend)
+      self._cave().remove(self._settings['name'])
+      return deleted
 
    def details(self):
       """return a Task named tuple containing schedule details of
@@ -370,11 +612,11 @@ class Sched:
       subprocess.CalledProcessError on any other error
       """
 
-      return Sched.details_for(self._settings['name'])
+      return Sched.details_for(self._settings['name'], self._backend)
 
    def is_scheduled(self):
       """return True if scheduled, False otherwise.
       subprocess.CalledProcessError is raised on any error
       """
 
-      return Sched.is_task_scheduled(self._settings['name'])
+      return Sched.is_task_scheduled(self._settings['name'], self._backend)
@@ -0,0 +1,742 @@
+from lib.custom_exceptions import *
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import hashlib
+import json
+import re
+import threading
+
+
+def is_primitive(val):
+   """return True if |val| is a JSON primitive (int, float, str, bool), False
+   otherwise
+   """
+
+   return isinstance(val, (int, float, str, bool))
+
+
+def literal_key(val):
+   """return a hashable key for primitive |val| that keeps bools distinct
+   from numbers, e.g. True and 1 have different keys while 1 and 1.0 share
+   one, the same as JSON where true and 1 are different values
+   """
+
+   return (val.__class__ is bool, val)
+
+
+def _canonical(obj):
+   """return a JSON serializable stand-in for |obj|, which json.dumps()
+   doesn't know how to serialize
+   """
+
+   if isinstance(obj, (set, frozenset)):
+      return sorted(repr(e) for e in obj)
+   return repr(obj)
+
+
+def fingerprint(obj):
+   """return a hex digest identifying the contents of the JSON-like object
+   |obj|, which is the same for equal objects regardless of key order
+   """
+
+   canonical = json.dumps(obj, sort_keys=True, default=_canonical)
+   return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def format_path(path):
+   """return the list of keys and indices |path| formatted as a JSON path,
+   e.g. ['foo', 'bar', 2] is formatted as 'foo.bar[2]'
+   """
+
+   formatted = ''
+   for part in path:
+      if isinstance(part, int):
+         formatted += "[{}]".format(part)
+      else:
+         formatted += ".{}".format(part) if formatted else str(part)
+   return formatted
+
+
+class TypedWildcard:
+   """matcher for a wildcard string in the format of '*[:<type>]'"""
+
+   _PAT = re.compile(r'\*(:(?P<type>\w+))?$')
+   _TYPES = {'str': str, 'int': int, 'float': float, 'bool': bool}
+
+   def __init__(self, wildcard):
+      """create a TypedWildcard from string |wildcard|. Any leading or
+      trailing whitespace in |wildcard| is automatically removed. If
+      |wildcard| is invalid, then an InvalidWildcardError is raised
+      """
+
+      wildcard = wildcard.strip()
+      m = TypedWildcard._PAT.match(wildcard)
+      if not m:
+         raise InvalidWildcardError(wildcard)
+
+      self._type = object
+      if m.group('type'):
+         try:
+            self._type = TypedWildcard._TYPES[m.group('type')]
+         except KeyError:
+            raise InvalidWildcardError("{} is an invalid type in {}".format(
+               m.group('type'), wildcard))
+
+   @property
+   def type(self):
+      """return the type this wildcard matches, object for any type"""
+
+      return self._type
+
+   @property
+   def is_any(self):
+      """return True if this wildcard matches any value"""
+
+      return self._type is object
+
+   def matches(self, v):
+      """return True if |v| matches this wildcard, False otherwise"""
+
+      return isinstance(v, self._type)
+
+
+class RegexMatcher:
+   """matcher for a regex string in the format of
+   '<regex pat>:re[:<flag>[<flag>...]]'
+   """
+
+   SPEC = re.compile(r'(?P<pat>.*?):re(:(?P<flag>[AILMSX]+))?$')
+   _CHAR_TO_FLAG = {
+      'A':re.A, 'I':re.I, 'L':re.L, 'M':re.M, 'S':re.S, 'X':re.X}
+
+   @staticmethod
+   def _parse(spec):
+      """return a RegexMatcher for the regex string |spec|, or None if
+      |spec| is not in the regex string format. If the regex pattern itself
+      is invalid, an InvalidRegexError is raised
+      """
+
+      m = RegexMatcher.SPEC.search(spec)
+      if not m:
+         return None
+
+      flags_combined = 0
+      for flag in m.group('flag') or '':
+         flags_combined |= RegexMatcher._CHAR_TO_FLAG[flag]
+      try:
+         return RegexMatcher(re.compile(m.group('pat'), flags_combined))
+      except re.error:
+         raise InvalidRegexError(spec)
+
+   @staticmethod
+   def parse(spec):
+      """return the RegexMatcher for the regex string |spec|, or None if
+      |spec| is not in the regex string format. Results are cached in
+      REGEX_CACHE so each |spec| is only parsed and compiled once. If the
+      regex pattern itself is invalid, an InvalidRegexError is raised
+      """
+
+      return REGEX_CACHE.get(spec)
+
+   def __init__(self, compiled):
+      """create a RegexMatcher from the compiled pattern |compiled|"""
+
+      self._re = compiled
+
+   @property
+   def pattern(self):
+      """return the compiled pattern"""
+
+      return self._re
+
+   @property
+   def flags(self):
+      """return the combined re flags parsed from the regex string"""
+
+      return self._re.flags
+
+   def matches(self, v):
+      """return True if the pattern matches the string form of |v|"""
+
+      return bool(self._re.search(str(v)))
+
+
+class RegexCache:
+   """bounded LRU cache of raw regex strings to RegexMatcher objects. Only
+   strings in the regex string format are cached, so the many literal
+   strings a valid dict holds can't push the regexes out of the cache.
+   """
+
+   def __init__(self, maxsize=1024):
+      """create a RegexCache holding at most |maxsize| regex strings"""
+
+      self._maxsize = maxsize
+      self._entries = OrderedDict()
+      self._lock = threading.Lock()
+      self.hits = 0
+      self.misses = 0
+
+   def get(self, spec):
+      """return the RegexMatcher for regex string |spec|, or None if |spec|
+      is not in the regex string format. Parse and compile |spec| on a miss.
+      Strings without ':re' are turned down before the cache is looked at.
+      """
+
+      if ':re' not in spec:
+         return None
+      with self._lock:
+         try:
+            matcher = self._entries[spec]
+         except KeyError:
+            self.misses += 1
+         else:
+            self._entries.move_to_end(spec)
+            self.hits += 1
+            return matcher
+
+      matcher = RegexMatcher._parse(spec)
+      if matcher is None:
+         return None
+      with self._lock:
+         self._entries[spec] = matcher
+         if len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+      return matcher
+
+   def clear(self):
+      """drop all cached regex strings and reset the hit/miss counters"""
+
+      with self._lock:
+         self._entries.clear()
+         self.hits = 0
+         self.misses = 0
+
+   def __len__(self):
+      """return the number of cached regex strings"""
+
+      return len(self._entries)
+
+
+REGEX_CACHE = RegexCache()
+
+
+class PrimAlternatives:
+   """matcher for a primitive against a list of legal primitive, wildcard,
+   or regex values. Literal values are kept in a set keyed by literal_key()
+   so membership is O(1) regardless of how many literals there are, while
+   wildcards and regexes are kept in a short list of matchers
+   """
+
+   def __init__(self, pats):
+      """create a PrimAlternatives from the list of legal values |pats|.
+      Elements of |pats| that can never equal a primitive (lists, dicts) are
+      ignored
+      """
+
+      self._literals = set()
+      self._matchers = []
+      self._any = False
+
+      for pat in pats:
+         if isinstance(pat, str):
+            if '*' in pat:
+               wildcard = TypedWildcard(pat)
+               self._any = self._any or wildcard.is_any
+               self._matchers.append(wildcard)
+            else:
+               regex = RegexMatcher.parse(pat)
+               if regex:
+                  self._matchers.append(regex)
+         try:
+            self._literals.add(literal_key(pat))
+         except TypeError:
+            pass
+
+   @property
+   def literals(self):
+      """return the set of literal_key() keys of the literal values"""
+
+      return self._literals
+
+   @property
+   def matchers(self):
+      """return the list of wildcard and regex matchers"""
+
+      return self._matchers
+
+   def matches(self, v):
+      """return True if primitive |v| is one of the legal values, False
+      otherwise
+      """
+
+      if self._any or literal_key(v) in self._literals:
+         return True
+      for matcher in self._matchers:
+         if matcher.matches(v):
+            return True
+      return False
+
+
+class Alternatives:
+   """matcher for a value against a valid value specification, which is
+   either a single legal value or a list of legal primitives, sublists and
+   dicts
+   """
+
+   def __init__(self, spec):
+      """create an Alternatives from the valid value specification |spec|"""
+
+      self._spec = spec
+      if isinstance(spec, list):
+         self._prims = PrimAlternatives(spec)
+         self._lists = tuple(Alternatives(l) for l in spec
+                             if isinstance(l, list))
+         self._dicts = tuple(DictNode(d) for d in spec if isinstance(d, dict))
+         self._dict_value = self._dicts
+         self._index_lists()
+      else:
+         self._prims = PrimAlternatives([spec])
+         self._lists = ()
+         self._dicts = ()
+         self._dict_value = (DictNode(spec),) \
+            if isinstance(spec, dict) else None
+         self._index_lists()
+
+   def _index_lists(self):
+      """index the legal sublists by the elements they can accept so
+      match_sublist() can narrow down the candidate sublists quickly. Each
+      literal, wildcard type and regex maps to the set of sublists containing
+      it, and sublists with nested lists or dicts are kept in their own sets
+      """
+
+      literal_index = {}
+      wildcard_index = {}
+      regex_index = {}
+      list_lists = set()
+      dict_lists = set()
+
+      for i, alt in enumerate(self._lists):
+         for key in alt._prims.literals:
+            literal_index.setdefault(key, set()).add(i)
+         for matcher in alt._prims.matchers:
+            if isinstance(matcher, TypedWildcard):
+               wildcard_index.setdefault(matcher.type, set()).add(i)
+            else:
+               regex_index.setdefault(matcher, set()).add(i)
+         if alt._lists:
+            list_lists.add(i)
+         if alt._dicts:
+            dict_lists.add(i)
+
+      self._all_lists = frozenset(range(len(self._lists)))
+      self._literal_index = {
+         k: frozenset(v) for k, v in literal_index.items()}
+      self._wildcard_index = [
+         (k, frozenset(v)) for k, v in wildcard_index.items()]
+      self._regex_index = [(k, frozenset(v)) for k, v in regex_index.items()]
+      self._list_lists = frozenset(list_lists)
+      self._dict_lists = frozenset(dict_lists)
+
+   def _lists_accepting_prim(self, e):
+      """return the set of indices of legal sublists accepting primitive
+      |e|. Each distinct wildcard type and regex is only checked once no
+      matter how many sublists contain it.
+      """
+
+      accepting = self._literal_index.get(literal_key(e), frozenset())
+      for t, lists in self._wildcard_index:
+         if isinstance(e, t):
+            accepting = accepting | lists
+      for regex, lists in self._regex_index:
+         if not lists <= accepting and regex.matches(e):
+            accepting = accepting | lists
+      return accepting
+
+   @property
+   def nested_node(self):
+      """return the DictNode a dict value is checked against when there is
+      exactly one, None otherwise
+      """
+
+      if self._dict_value is not None and len(self._dict_value) == 1:
+         return self._dict_value[0]
+      return None
+
+   def match_prim(self, v):
+      """return True if primitive |v| is one of the legal primitives"""
+
+      return self._prims.matches(v)
+
+   def match_sublist(self, sublist):
+      """return True if every element in list |sublist| is in one of the
+      legal sublists, False otherwise. The set of candidate sublists starts
+      out as all of them and is narrowed down by each element, so each
+      element is only checked against the sublists still in the running.
+      Primitives are looked up in the literal index, and the candidates
+      accepting a primitive are remembered for repeated elements. If an
+      element is not a primitive, list or dict, an InvalidSettingError is
+      raised
+      """
+
+      candidates = self._all_lists
+      accepting_prims = {}
+
+      for e in sublist:
+         if not candidates:
+            return False
+
+         if is_primitive(e):
+            key = literal_key(e)
+            accepting = accepting_prims.get(key)
+            if accepting is None:
+               accepting = accepting_prims[key] = \
+                  self._lists_accepting_prim(e)
+            candidates = candidates & accepting
+         elif isinstance(e, list):
+            candidates = frozenset(
+               i for i in candidates & self._list_lists
+               if self._lists[i].match_sublist(e))
+         elif isinstance(e, Mapping):
+            candidates = frozenset(
+               i for i in candidates & self._dict_lists
+               if self._lists[i].match_one_of_dicts(e))
+         else:
+            raise InvalidSettingError()
+
+      return bool(candidates)
+
+   def match_one_of_dicts(self, d):
+      """return True if dict |d| is in one of the legal dicts"""
+
+      for node in self._dicts:
+         if node.matches(d):
+            return True
+      return False
+
+   def match_elem(self, e):
+      """return True if list element |e| is legal, False otherwise. If |e|
+      is not a primitive, list or dict, an InvalidSettingError is raised
+      """
+
+      if is_primitive(e):
+         return self.match_prim(e)
+      elif isinstance(e, list):
+         return self.match_sublist(e)
+      elif isinstance(e, Mapping):
+         return self.match_one_of_dicts(e)
+      raise InvalidSettingError()
+
+   def match_list(self, l):
+      """return True if all elements in list |l| are legal, False
+      otherwise
+      """
+
+      for e in l:
+         if not self.match_elem(e):
+            return False
+      return True
+
+   def match_dict(self, d):
+      """return True if dict |d| matches the nested dict or one of the legal
+      dicts. If the specification has no dicts, an InvalidSettingError is
+      raised
+      """
+
+      if self._dict_value is None:
+         raise InvalidSettingError()
+      for node in self._dict_value:
+         if node.matches(d):
+            return True
+      return False
+
+   def matches(self, v):
+      """return True if |v| is a legal value, False otherwise. If |v| is not
+      a primitive, list or dict, an InvalidSettingError is raised
+      """
+
+      if is_primitive(v):
+         return self.match_prim(v)
+      elif isinstance(v, list):
+         return self.match_list(v)
+      elif isinstance(v, Mapping):
+         return self.match_dict(v)
+      raise InvalidSettingError()
+
+   def _elem_ok(self, e):
+      """return True if list element |e| is legal, False if it isn't or if
+      it isn't a primitive, list or dict
+      """
+
+      try:
+         return self.match_elem(e)
+      except InvalidSettingError:
+         return False
+
+   def check(self, v, path, errors, collect_all=False):
+      """return True if |v| is a legal value. Otherwise, append an
+      InvalidSettingError for every invalid part of |v| to list |errors| and
+      return False. |path| is the list of keys and indices leading to |v|.
+      Elements of a list are reported individually, and a nested dict is
+      checked key by key when there is only one dict it can match. If
+      |collect_all| is False, stop at the first error.
+      """
+
+      if isinstance(v, list):
+         ok = True
+         for i, e in enumerate(v):
+            if not self._elem_ok(e):
+               path.append(i)
+               errors.append(
+                  InvalidSettingError(format_path(path), e, self._spec))
+               path.pop()
+               ok = False
+               if not collect_all:
+                  break
+         return ok
+      elif isinstance(v, Mapping) and self.nested_node is not None:
+         return self.nested_node.check(v, path, errors, collect_all)
+
+      try:
+         if self.matches(v):
+            return True
+      except InvalidSettingError:
+         pass
+      errors.append(InvalidSettingError(format_path(path), v, self._spec))
+      return False
+
+
+class DictNode:
+   """matcher for a dict against a valid dict where each pair is a setting
+   name associated to a valid value specification
+   """
+
+   def __init__(self, valid_d):
+      """create a DictNode from the valid dict |valid_d|"""
+
+      self._valid_d = valid_d
+      self._fields = {k: Alternatives(v) for k, v in valid_d.items()}
+
+   def matches(self, d):
+      """return True if all dict |d| keys are valid keys, values in |d| are
+      legal, and all valid keys are in |d|. False otherwise. Nested dicts
+      with a single valid dict are walked with an explicit stack instead of
+      recursion, so deeply nested settings don't hit the recursion limit.
+      """
+
+      stack = [(self._fields, d, iter(d.items()))]
+      while stack:
+         fields, d, items = stack[-1]
+         for k, v in items:
+            alt = fields.get(k)
+            if alt is None:
+               return False
+            node = alt.nested_node
+            if node is not None and isinstance(v, Mapping):
+               stack.append((node._fields, v, iter(v.items())))
+               break
+            if not alt.matches(v):
+               return False
+         else:
+            if len(d) != len(fields):
+               return False
+            stack.pop()
+      return True
+
+   @property
+   def fields(self):
+      """return the dict of valid keys to Alternatives"""
+
+      return self._fields
+
+   def check_key(self, d, k, path, errors, collect_all=False):
+      """return True if key |k| of dict |d| is legal, i.e. |k| is a valid key
+      with a legal value in |d|, or |k| is neither a valid key nor in |d|.
+      Otherwise append an InvalidSettingError to list |errors| and return
+      False. |path| is the list of keys and indices leading to |d|.
+      """
+
+      path.append(k)
+      try:
+         alt = self._fields.get(k)
+         if k in d:
+            if alt is None:
+               errors.append(InvalidSettingError(
+                  format_path(path), d[k], list(self._fields),
+                  'unknown setting'))
+               return False
+            return alt.check(d[k], path, errors, collect_all)
+         elif alt is not None:
+            errors.append(InvalidSettingError(
+               format_path(path), None, self._valid_d[k], 'missing setting'))
+            return False
+         return True
+      finally:
+         path.pop()
+
+   def check_missing(self, d, path, errors, collect_all):
+      """return True if all valid keys are in dict |d|. Otherwise append an
+      InvalidSettingError for every missing key to list |errors| and return
+      False. |path| is the list of keys and indices leading to |d|.
+      """
+
+      ok = True
+      for k in self._fields:
+         if k not in d:
+            path.append(k)
+            errors.append(InvalidSettingError(
+               format_path(path), None, self._valid_d[k], 'missing setting'))
+            path.pop()
+            ok = False
+            if not collect_all:
+               break
+      return ok
+
+   def check(self, d, path, errors, collect_all=False):
+      """return True if dict |d| is legal. Otherwise, append an
+      InvalidSettingError for every unknown key, invalid value, and missing
+      key to list |errors| and return False. |path| is the list of keys and
+      indices leading to |d|. If |collect_all| is False, stop at the first
+      error. Nested dicts with a single valid dict are walked with an
+      explicit stack instead of recursion.
+      """
+
+      base = len(path)
+      ok = True
+      # each frame is [node, dict, items iterator, has unknown keys]
+      stack = [[self, d, iter(d.items()), False]]
+      while stack:
+         frame = stack[-1]
+         node, d, items = frame[0], frame[1], frame[2]
+         for k, v in items:
+            path.append(k)
+            alt = node._fields.get(k)
+            if alt is None:
+               errors.append(InvalidSettingError(
+                  format_path(path), v, list(node._fields), 'unknown setting'))
+               frame[3] = True
+               valid = False
+            elif alt.nested_node is not None and isinstance(v, Mapping):
+               stack.append([alt.nested_node, v, iter(v.items()), False])
+               break
+            else:
+               valid = alt.check(v, path, errors, collect_all)
+            path.pop()
+            if not valid:
+               ok = False
+               if not collect_all:
+                  del path[base:]
+                  return False
+         else:
+            if frame[3] or len(d) != len(node._fields):
+               if not node.check_missing(d, path, errors, collect_all):
+                  ok = False
+                  if not collect_all:
+                     del path[base:]
+                     return False
+            stack.pop()
+            if stack:
+               path.pop()
+      return ok
+
+
+class Schema:
+   """compiled form of a valid settings dictionary"""
+
+   def __init__(self, valid):
+      """create a Schema by compiling the valid dict |valid| once into a tree
+      of matchers
+      """
+
+      self._valid = valid
+      self._root = DictNode(valid)
+      self._fingerprint = None
+
+   @property
+   def valid(self):
+      """return the valid dict this Schema was compiled from"""
+
+      return self._valid
+
+   @property
+   def root(self):
+      """return the DictNode the settings dict is checked against"""
+
+      return self._root
+
+   @property
+   def fingerprint(self):
+      """return a hex digest identifying the valid dict this Schema was
+      compiled from
+      """
+
+      if self._fingerprint is None:
+         self._fingerprint = fingerprint(self._valid)
+      return self._fingerprint
+
+   def is_valid(self, settings):
+      """return True if dict |settings| is valid, False otherwise"""
+
+      return self._root.matches(settings)
+
+   def check(self, settings, collect_all=False):
+      """raise InvalidSettingError if dict |settings| is not valid. The error
+      carries the path, value and valid value specification of the first
+      invalid setting found. If |collect_all| is True, keep going after the
+      first invalid setting and raise an InvalidSettingError whose errors
+      attribute lists every invalid setting.
+      """
+
+      errors = []
+      if not self._root.check(settings, [], errors, collect_all):
+         Schema.raise_errors(errors, collect_all)
+
+   @staticmethod
+   def raise_errors(errors, collect_all=False):
+      """raise the InvalidSettingError for the non-empty list |errors|. If
+      |collect_all| is True, the raised error collects all of |errors|,
+      otherwise it is the first one.
+      """
+
+      if collect_all:
+         raise InvalidSettingError(errors=errors)
+      raise errors[0]
+
+   def check_paths(self, settings, paths, collect_all=False):
+      """raise InvalidSettingError if any of the |paths| in dict |settings|
+      is not valid, where each path is a list of keys and indices. Only the
+      parts of |settings| touched by |paths| are checked, which are the
+      values at the deepest valid key along each path. A path through a list
+      or through a dict that can match more than one valid dict checks the
+      whole value where the path enters it. A path to a key that is not in
+      |settings| checks that the key isn't a missing valid key. The rest of
+      |settings| is assumed to be valid already. |collect_all| has the same
+      meaning as for check().
+      """
+
+      errors = []
+      checked = set()
+      for path in paths:
+         node, d, prefix = self._root, settings, []
+         for k in path[:-1]:
+            alt = node.fields.get(k)
+            if alt is None or alt.nested_node is None or \
+               not isinstance(d.get(k), Mapping):
+               break
+            node, d = alt.nested_node, d[k]
+            prefix.append(k)
+         k = path[len(prefix)] if len(path) > len(prefix) else None
+
+         if k is None:
+            valid = node.check(d, prefix, errors, collect_all)
+         elif (id(d), k) in checked:
+            continue
+         else:
+            checked.add((id(d), k))
+            valid = node.check_key(d, k, prefix, errors, collect_all)
+
+         if not valid and not collect_all:
+            break
+
+      if errors:
+         Schema.raise_errors(errors, collect_all)
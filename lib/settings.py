@@ -1,34 +1,181 @@
 from lib.custom_exceptions import *
+from lib.schema import Schema, DictNode, Alternatives, PrimAlternatives, \
+                       TypedWildcard, RegexMatcher, is_primitive
+from lib.jsonstream import ObjectStream
 from collections.abc import Mapping
+from collections import namedtuple, deque
+from concurrent.futures import ProcessPoolExecutor
 
+import copy
+import itertools
 import json
-import re
 
 
-class Settings(Mapping):
-   """class for accessing settings"""
+ValidationResult = namedtuple('ValidationResult',
+                              ['source', 'settings', 'error'])
+
+
+class DefaultsOverlay(Mapping):
+   """read-only view of a settings dict with defaults filled in lazily.
+   A key takes its value from the settings dict unless it is missing there
+   or its value is None or an empty dict, in which case it falls back to
+   the defaults. When both are dicts, the value is an overlay of the nested
+   settings over the nested defaults, so every level has its own fallback.
+   Neither dict is ever modified by the overlay. Default dicts are handed
+   out as overlays and default lists as copies, made on first access, so
+   the defaults can't be modified through the overlay either. Values from
+   the settings dict are handed out as is. Use materialize() to get a plain
+   dict.
+   """
+
+   __slots__ = ('_settings', '_defaults', '_len', '_nested', '_plain')
+
+   def __init__(self, settings, defaults):
+      """create a DefaultsOverlay of dict |settings| over dict |defaults|.
+      Neither dict should be modified while the overlay is in use.
+      """
+
+      self._settings = settings
+      self._defaults = defaults
+      self._len = None
+      self._nested = None
+      self._plain = None
+
+   def _overlay(self, k, settings, defaults):
+      """return the nested overlay of dict |settings| over dict |defaults|
+      for key |k|. Nested overlays are created on first access and then
+      reused, so the same key always gives the same object.
+      """
+
+      if self._nested is None:
+         self._nested = {}
+      nested = self._nested.get(k)
+      if nested is None:
+         nested = self._nested[k] = DefaultsOverlay(settings, defaults)
+      return nested
+
+   def _default(self, k, default):
+      """return the default value |default| for key |k|, wrapping a dict and
+      copying a list so the defaults can't be modified through the overlay.
+      The copy is made on first access and then reused like an overlay.
+      """
+
+      if isinstance(default, dict):
+         return self._overlay(k, {}, default)
+      elif isinstance(default, list):
+         if self._nested is None:
+            self._nested = {}
+         copied = self._nested.get(k)
+         if copied is None:
+            copied = self._nested[k] = copy.deepcopy(default)
+         return copied
+      return default
+
+   def __getitem__(self, k):
+      """return the value for |k|, falling back to the defaults. Raise
+      KeyError if |k| is in neither the settings nor the defaults.
+      """
+
+      if k in self._settings:
+         v = self._settings[k]
+         if v is None or isinstance(v, dict):
+            default = self._defaults.get(k)
+            if default is not None:
+               if not v:
+                  return self._default(k, default)
+               elif isinstance(default, dict):
+                  return self._overlay(k, v, default)
+         return v
+      return self._default(k, self._defaults[k])
+
+   def __contains__(self, k):
+      """return True if |k| is in the settings or the defaults"""
+
+      return k in self._settings or k in self._defaults
+
+   def __iter__(self):
+      """return an iterator over the keys of the settings followed by the
+      keys only found in the defaults
+      """
 
-   _REPAT = r'(?P<pat>.*?):re(:(?P<flag>[AILMSX]+))?$'
+      yield from self._settings
+      for k in self._defaults:
+         if k not in self._settings:
+            yield k
+
+   def __len__(self):
+      """return the number of keys in the settings or the defaults"""
+
+      if self._len is None:
+         self._len = len(self._settings) + sum(
+            1 for k in self._defaults if k not in self._settings)
+      return self._len
+
+   def __repr__(self):
+      return "DefaultsOverlay({!r}, {!r})".format(
+         self._settings, self._defaults)
+
+   def materialize(self):
+      """return the overlay as a plain dict where every nested overlay is a
+      plain dict too. Nested dicts are built with an explicit stack instead
+      of recursion. Values that aren't overlays are not copied.
+      """
+
+      return materialize(self)
+
+   def _plain_dict(self):
+      """return the overlay as a plain dict like materialize(), made on first
+      call and then reused, so the same overlay always gives the same dict
+      """
+
+      if self._plain is None:
+         self._plain = materialize(self)
+      return self._plain
+
+
+def materialize(settings):
+   """return |settings| with every DefaultsOverlay in it, at any nesting
+   level, replaced by a plain dict. Plain dicts containing overlays are
+   copied, anything else is returned as is.
+   """
+
+   if not isinstance(settings, Mapping):
+      return settings
+
+   root = {}
+   stack = [(root, settings)]
+   while stack:
+      new_d, d = stack.pop()
+      for k, v in d.items():
+         if isinstance(v, Mapping):
+            new_d[k] = {}
+            stack.append((new_d[k], v))
+         else:
+            new_d[k] = v
+   return root
+
+
+class Settings(Mapping):
+   """class for accessing settings. A setting whose value is a dict is
+   handed out as a plain dict, with defaults injected at every level, even
+   though it is kept as a DefaultsOverlay internally.
+   """
 
    @staticmethod
-   def _get_type_to_one_of():
-      """return a dict of string types to one of method"""
+   def compile_schema(valid):
+      """return a Schema compiled from the valid dict |valid|. The Schema can
+      be passed as |valid| to any number of Settings objects so the valid
+      dict is only walked once. If |valid| is already a Schema, it is
+      returned as is.
+      """
 
-      return {
-         'primitive': Settings._is_in_prim,
-         'list': Settings._is_sublist_in_one_of_lists,
-         'dict': Settings._is_dict_in_one_of_dicts
-      }
+      return valid if isinstance(valid, Schema) else Schema(valid)
 
    @staticmethod
    def _is_primitive(val):
       """return True if |val| is a JSON primitive, False otherwise"""
 
-      prims = [int, float, str, bool]
-      for prim in prims:
-         if isinstance(val, prim):
-            return True
-      return False
+      return is_primitive(val)
 
    @staticmethod
    def _is_list(val):
@@ -51,21 +198,7 @@ class Settings(Mapping):
       InvalidWildcardError is raised
       """
 
-      wildcard = wildcard.strip()
-      glob_pat = re.compile(r'\*(:(?P<type>\w+))?$')
-      m = glob_pat.match(wildcard)
-      if m:
-         if m.group('type'):
-            type_to_meth = globals()['__builtins__']
-            type_to_meth = {k:v for k,v in type_to_meth.items()
-                        if k in ['str','int','float','bool']}
-            try:
-               return isinstance(s, type_to_meth[m.group('type')])
-            except KeyError:
-               raise InvalidWildcardError("{} is an invalid type in {}".format(
-                  m.group('type'), wildcard))
-         return True
-      raise InvalidWildcardError(wildcard)
+      return TypedWildcard(wildcard).matches(s)
 
    @staticmethod
    def _is_regex_match(s, pat):
@@ -79,15 +212,9 @@ class Settings(Mapping):
       """
 
       pat = pat.rstrip()
-      m = re.search(Settings._REPAT, pat)
-      if m:
-         flags_combined = 0
-         if m.group('flag'):
-            char_to_flag = {
-               'A':re.A, 'I':re.I, 'L':re.L, 'M':re.M, 'S':re.S, 'X':re.X}
-            for flag in list(m.group('flag')):
-               flags_combined |= char_to_flag[flag]
-         return bool(re.search(m.group('pat'), s, flags_combined))
+      regex = RegexMatcher.parse(pat)
+      if regex:
+         return regex.matches(s)
       raise InvalidRegexError(pat)
 
    @staticmethod
@@ -101,52 +228,18 @@ class Settings(Mapping):
 
       if not isinstance(valid_v, list):
          valid_v = [valid_v]
-
-      for pat in valid_v:
-         if isinstance(pat, str):
-            if '*' in pat:
-               if Settings._is_wildcard_match(v, pat):
-                  return True
-            elif re.search(Settings._REPAT, pat):
-               if Settings._is_regex_match(str(v), pat):
-                  return True
-         if v == pat:
-            return True
-      return False
+      return PrimAlternatives(valid_v).matches(v)
 
    @staticmethod
    def _is_sublist_in_one_of_lists(sublist, lists):
-      """return True if every element in list |sublist| is in one of the lists
-      contained in |lists|, False otherwise. Legal elements in |sublist| or the
-      lists in |lists| are any primitive (int, float, str, bool), list, or
-      dict. If an illegal element exists in |sublist|, an InvalidSettingError
-      is raised
-      """
-
-      type_to_one_of = Settings._get_type_to_one_of()
-
-      for vl in lists:
-         next_vl = False
-         for e in sublist:
-            if Settings._is_primitive(e):
-               t = 'primitive'
-            elif Settings._is_list(e):
-               vl = [l for l in vl if isinstance(l, list)]
-               t = 'list'
-            elif Settings._is_dict(e):
-               vl = [d for d in vl if isinstance(d, dict)]
-               t = 'dict'
-            else:
-               raise InvalidSettingError()
-
-            if not type_to_one_of[t](e, vl):
-               next_vl = True
-               break
+      """return True if every element in list |sublist| is in one of the
+      lists contained in |lists|, False otherwise. Legal elements in |sublist|
+      or the lists in |lists| are any primitive (int, float, str, bool), list,
+      or dict. If an illegal element exists in |sublist|, an
+      InvalidSettingError is raised
+      """
 
-         if next_vl:
-            continue
-         return True
-      return False
+      return Alternatives(lists).match_sublist(sublist)
 
    @staticmethod
    def _is_dict_in_one_of_dicts(d, dicts):
@@ -156,10 +249,7 @@ class Settings(Mapping):
       bool, str), lists, and dicts.
       """
 
-      for vd in dicts:
-         if Settings._is_in_dict(d, vd):
-            return True
-      return False
+      return Alternatives(dicts).match_one_of_dicts(d)
 
    @staticmethod
    def _is_in_list(l, valid_l):
@@ -168,21 +258,7 @@ class Settings(Mapping):
       the typical primitives (int, float, bool, str), lists, and dicts.
       """
 
-      for elem in l:
-         if Settings._is_primitive(elem):
-            if not Settings._is_in_prim(elem, valid_l):
-               return False
-         elif Settings._is_list(elem):
-            valid_lists = [l for l in valid_l if isinstance(l, list)]
-            if not Settings._is_sublist_in_one_of_lists(elem, valid_lists):
-               return False
-         elif Settings._is_dict(elem):
-            valid_dicts = [d for d in valid_l if isinstance(d, dict)]
-            if not Settings._is_dict_in_one_of_dicts(elem, valid_dicts):
-               return False
-         else:
-            raise InvalidSettingError()
-      return True
+      return Alternatives(valid_l).match_list(l)
 
    @staticmethod
    def _has_all_keys_from(d, valid_d):
@@ -204,28 +280,7 @@ class Settings(Mapping):
       recursively Settings._is_in_dict(). False otherwise.
       """
 
-      for k, v in d.items():
-         if k not in valid_d:
-            return False
-         else:
-            if Settings._is_primitive(v):
-               if not Settings._is_in_prim(v, valid_d[k]):
-                  return False
-            elif Settings._is_list(v):
-               if not Settings._is_in_list(v, valid_d[k]):
-                  return False
-            elif Settings._is_dict(v):
-               if isinstance(valid_d[k], dict):
-                  if not Settings._is_in_dict(v, valid_d[k]):
-                     return False
-               elif isinstance(valid_d[k], list):
-                  if not Settings._is_dict_in_one_of_dicts(v, valid_d[k]):
-                     return False
-               else:
-                  raise InvalidSettingError()
-            else:
-               raise InvalidSettingError()
-      return Settings._has_all_keys_from(d, valid_d)
+      return DictNode(valid_d).matches(d)
 
    @staticmethod
    def _primitive_validity_check(v, valid_v):
@@ -262,37 +317,31 @@ class Settings(Mapping):
       represents the user settings where each pair is a setting name associated
       to a chosen setting value. |valid| represents all valid user settings
       where each pair is a setting name associated to legal valid
-      setting values.
+      setting values. |valid| can also be a Schema from
+      Settings.compile_schema().
       """
 
-      Settings._dict_validity_check(settings, valid)
+      Settings.compile_schema(valid).check(settings)
 
    @staticmethod
    def _inject_defaults(settings, defaults):
       """inject any defaults specified in |defaults| into settings. Default
       values will only be applied if a key exists in |defaults| and doesn't
       exist in |settings|, or if a key in |settings| has an associating value
-      of None. If |defaults| is None, |settings| is returned as is.
+      of None. If |defaults| is None, |settings| is returned as is. Otherwise
+      a DefaultsOverlay is returned, so nothing is copied and |defaults| is
+      never returned or shared itself.
       """
-      new_settings = {}
 
       if defaults is None:
          return settings
-      elif settings is None or len(settings) == 0:
-         new_settings = defaults
-      else:
-         for k, v in settings.items():
-            if isinstance(v, dict) or v is None:
-               new_settings[k] = Settings._inject_defaults(v, defaults[k])
-            else:
-               new_settings[k] = settings[k]
+      elif not isinstance(defaults, dict):
+         return defaults if settings is None or len(settings) == 0 \
+            else settings
+      return DefaultsOverlay({} if settings is None else settings, defaults)
 
-         for k, v in defaults.items():
-            if k not in settings:
-               new_settings[k] = defaults[k]
-      return new_settings
-
-   def __init__(self, settings, valid, defaults=None):
+   def __init__(self, settings, valid, defaults=None, collect_errors=False,
+                cache=None):
       """create a Settings object. |settings| can be a dict or path to json
       file. If a dict, then values in |settings| must be a primitive
       (int, float, bool, str), list, or dict. |valid| must be a dict.
@@ -335,22 +384,445 @@ class Settings(Mapping):
       default values for any key in the user settings that's nonexistent
       or has an associating value of None. The entries in |defaults| are
       injected into |settings| before the validity check is done. If the
-      validity check fails, an InvalidSettingError is raised.
+      validity check fails, an InvalidSettingError is raised. Its path, value
+      and alternatives attributes describe the first invalid setting found,
+      e.g. path 'foo.bar[2]'. If |collect_errors| is True, validation keeps
+      going after the first invalid setting and the errors attribute of the
+      raised InvalidSettingError lists every invalid setting.
+
+      |valid| can also be a Schema returned by Settings.compile_schema(). When
+      many Settings objects are created against the same valid dict, compile
+      it once and pass the Schema to avoid walking the valid dict each time.
+
+      |cache| is an optional ValidationCache. If given and |settings| is a
+      path to a json file, the validated settings are looked up by the file
+      content, |valid| and |defaults|, so a file that hasn't changed is not
+      parsed or validated again.
       """
 
+      self._schema = Settings.compile_schema(valid)
+      self._defaults = defaults
+      if cache is not None and not isinstance(settings, Mapping):
+         self._settings = Settings._load_cached(
+            settings, self._schema, defaults, collect_errors, cache)
+         return
+
       try:
          with open(settings, 'r') as settings_file:
-            self._settings = json.load(settings_file)
+            self._settings = Settings._check_object(json.load(settings_file))
       except TypeError:
          self._settings = dict(settings)
       self._settings = Settings._inject_defaults(self._settings, defaults)
-      Settings._validity_check(self._settings, valid)
+      self._schema.check(self._settings, collect_errors)
+
+   @staticmethod
+   def stream(path, valid, defaults=None, collect_errors=False,
+              chunk_size=65536):
+      """return a Settings object for the json file at |path|, which is read
+      |chunk_size| characters at a time and validated one top level setting
+      at a time as it is parsed. |valid|, |defaults| and |collect_errors|
+      have the same meaning as for Settings(). Unless |collect_errors| is
+      True, reading stops at the first invalid setting and the rest of the
+      file is never parsed. A json.JSONDecodeError is raised if the file
+      isn't a JSON object.
+      """
+
+      schema = Settings.compile_schema(valid)
+      root = schema.root
+      parsed = {}
+      settings = Settings._inject_defaults(parsed, defaults)
+      errors = []
+
+      with open(path, 'r') as settings_file:
+         for k, v in ObjectStream(settings_file, chunk_size):
+            parsed[k] = v
+            if not root.check_key(settings, k, [], errors, collect_errors) \
+               and not collect_errors:
+               break
+
+      if not errors or collect_errors:
+         # the keys only found in the defaults are checked the same way
+         for k in settings:
+            if k not in parsed and not root.check_key(
+               settings, k, [], errors, collect_errors) and \
+               not collect_errors:
+               break
+      if not errors or collect_errors:
+         root.check_missing(settings, [], errors, collect_errors)
+      if errors:
+         Schema.raise_errors(errors, collect_errors)
+      return Settings._from_validated(settings, schema, defaults)
+
+   @staticmethod
+   def _check_object(doc):
+      """return the json document |doc| read from a settings file if it is
+      an object. Otherwise raise an InvalidSettingError for the whole file.
+      """
+
+      if not isinstance(doc, dict):
+         raise InvalidSettingError(
+            '', doc, reason='settings must be a JSON object, not {}'.format(
+               type(doc).__name__))
+      return doc
+
+   @staticmethod
+   def _load_cached(path, schema, defaults, collect_errors, cache):
+      """return the settings from the json file at |path| with |defaults|
+      injected and validated against Schema |schema|, using ValidationCache
+      |cache| to skip parsing and validating unchanged files
+      """
+
+      with open(path, 'rb') as settings_file:
+         content = settings_file.read()
+      key = cache.key(content, schema, defaults)
+      settings = cache.get(key)
+      if settings is None:
+         settings = Settings._inject_defaults(
+            Settings._check_object(json.loads(content)), defaults)
+         schema.check(settings, collect_errors)
+         settings = materialize(settings)
+         cache.put(key, settings)
+      return settings
+
+   @staticmethod
+   def _from_validated(settings, schema, defaults=None):
+      """return a Settings object wrapping dict |settings| which has already
+      been validated against Schema |schema| with |defaults| injected,
+      without validating it again
+      """
+
+      obj = Settings.__new__(Settings)
+      obj._schema = schema
+      obj._defaults = defaults
+      obj._settings = settings
+      return obj
+
+   @staticmethod
+   def _validate_source(source, schema, defaults, collect_errors, cache):
+      """return a (Settings, error) pair for |source|, a dict or path to json
+      file, validated against Schema |schema| with |defaults| injected.
+      Exactly one of the pair is None. |collect_errors| and |cache| have the
+      same meaning as for Settings().
+      """
+
+      try:
+         return Settings(
+            source, schema, defaults, collect_errors, cache), None
+      except (InvalidSettingError, OSError, ValueError) as err:
+         return None, err
+
+   @staticmethod
+   def _validate_chunk(chunk, schema, defaults, collect_errors, cache):
+      """validate every source in list |chunk| and return a list of
+      (settings, error) pairs, where settings is the validated settings
+      mapping, a DefaultsOverlay if defaults were injected. This runs in a
+      worker process, so the settings are returned instead of Settings
+      objects to keep |schema| from being pickled back with every result.
+      """
+
+      results = []
+      for source in chunk:
+         settings, error = Settings._validate_source(
+            source, schema, defaults, collect_errors, cache)
+         results.append(
+            (None if settings is None else settings._settings, error))
+      return results
+
+   @staticmethod
+   def _chunks(iterable, size):
+      """yield lists of at most |size| consecutive items from |iterable|"""
+
+      it = iter(iterable)
+      chunk = list(itertools.islice(it, size))
+      while chunk:
+         yield chunk
+         chunk = list(itertools.islice(it, size))
+
+   @staticmethod
+   def _chunk_results(job, schema, defaults):
+      """yield a ValidationResult for each source in a (chunk, future) |job|
+      submitted with Settings._validate_chunk(). |schema| and |defaults| are
+      what the chunk was validated against.
+      """
+
+      chunk, future = job
+      for source, (settings, error) in zip(chunk, future.result()):
+         if settings is not None:
+            settings = Settings._from_validated(settings, schema, defaults)
+         yield ValidationResult(source, settings, error)
+
+   @staticmethod
+   def validate_many(sources, valid, defaults=None, workers=None,
+                     chunksize=256, collect_errors=False, cache=None):
+      """validate every source in iterable |sources| against |valid| and
+      yield a ValidationResult(source, settings, error) for each one, in
+      order. A source can be a dict or a path to a json file, the same as the
+      |settings| argument of Settings(). |valid| and |defaults| have the same
+      meaning as for Settings(), and |valid| is compiled only once for all
+      sources. On success, settings is the Settings object and error is None.
+      On failure, settings is None and error is the InvalidSettingError,
+      OSError or ValueError (bad json) that was raised; a failure doesn't stop
+      the remaining sources from being validated. |collect_errors| and
+      |cache| have the same meaning as for Settings().
+
+      If |workers| is greater than 1, sources are validated in a pool of
+      |workers| processes, |chunksize| sources per job. |sources| is consumed
+      lazily, so at most a few chunks per worker are in flight at a time.
+      """
+
+      schema = Settings.compile_schema(valid)
+
+      if not workers or workers <= 1:
+         for source in sources:
+            settings, error = Settings._validate_source(
+               source, schema, defaults, collect_errors, cache)
+            yield ValidationResult(source, settings, error)
+         return
+
+      with ProcessPoolExecutor(workers) as pool:
+         pending = deque()
+         for chunk in Settings._chunks(sources, chunksize):
+            pending.append((chunk, pool.submit(
+               Settings._validate_chunk, chunk, schema, defaults,
+               collect_errors, cache)))
+            if len(pending) >= 2 * workers:
+               yield from Settings._chunk_results(pending.popleft(), schema,
+                                                  defaults)
+         while pending:
+            yield from Settings._chunk_results(pending.popleft(), schema,
+                                               defaults)
+
+   @staticmethod
+   def _parse_pointer(pointer):
+      """return the JSON pointer string |pointer|, e.g. '/foo/bar/0', as a
+      list of unescaped reference tokens
+      """
+
+      if pointer == '':
+         return []
+      if not isinstance(pointer, str) or not pointer.startswith('/'):
+         raise InvalidPatchError("invalid path {!r}".format(pointer))
+      return [t.replace('~1', '/').replace('~0', '~')
+              for t in pointer[1:].split('/')]
+
+   @staticmethod
+   def _container_key(container, token, appending=False):
+      """return reference token |token| as a key into |container|, which is
+      an int index for a list. If |appending| is True, '-' and the length of
+      the list are allowed as the index past the last element.
+      """
+
+      if isinstance(container, Mapping):
+         return token
+      elif isinstance(container, list):
+         if appending and token == '-':
+            return len(container)
+         if not token.isdigit() or (token != '0' and token.startswith('0')):
+            raise InvalidPatchError("invalid list index {!r}".format(token))
+         index = int(token)
+         if index > len(container) or (index == len(container) and
+                                        not appending):
+            raise InvalidPatchError("list index {} out of range".format(index))
+         return index
+      raise InvalidPatchError("{!r} is not a container".format(container))
+
+   @staticmethod
+   def _resolve(root, tokens):
+      """return the value at the list of reference tokens |tokens| in
+      |root|
+      """
+
+      value = root
+      for token in tokens:
+         key = Settings._container_key(value, token)
+         try:
+            value = value[key]
+         except KeyError:
+            raise InvalidPatchError("no such key {!r}".format(token))
+      return value
+
+   @staticmethod
+   def _copy_parent(root, tokens, copies):
+      """return the parent container of the value at the list of reference
+      tokens |tokens| in dict |root|, copying each container on the way down
+      that isn't a copy already, so the original containers are never
+      modified. |copies| maps the ids of the copies made so far to the
+      copies.
+      """
+
+      parent = root
+      for token in tokens[:-1]:
+         key = Settings._container_key(parent, token)
+         try:
+            child = parent[key]
+         except KeyError:
+            raise InvalidPatchError("no such key {!r}".format(token))
+         if id(child) not in copies:
+            if isinstance(child, Mapping):
+               child = dict(child)
+            elif isinstance(child, list):
+               child = list(child)
+            else:
+               raise InvalidPatchError(
+                  "{!r} is not a container".format(token))
+            copies[id(child)] = child
+            parent[key] = child
+         parent = child
+      return parent
+
+   @staticmethod
+   def _patch_add(root, tokens, value, copies):
+      """add |value| at the list of reference tokens |tokens| in dict
+      |root|
+      """
+
+      parent = Settings._copy_parent(root, tokens, copies)
+      key = Settings._container_key(parent, tokens[-1], appending=True)
+      if isinstance(parent, list):
+         parent.insert(key, value)
+      else:
+         parent[key] = value
+
+   @staticmethod
+   def _patch_remove(root, tokens, copies):
+      """remove and return the value at the list of reference tokens
+      |tokens| in dict |root|
+      """
+
+      parent = Settings._copy_parent(root, tokens, copies)
+      key = Settings._container_key(parent, tokens[-1])
+      try:
+         return parent.pop(key)
+      except KeyError:
+         raise InvalidPatchError("no such key {!r}".format(tokens[-1]))
+
+   @staticmethod
+   def _patch_replace(root, tokens, value, copies):
+      """replace the value at the list of reference tokens |tokens| in dict
+      |root| with |value| in place, so an object member keeps its position
+      """
+
+      parent = Settings._copy_parent(root, tokens, copies)
+      key = Settings._container_key(parent, tokens[-1])
+      if isinstance(parent, Mapping) and key not in parent:
+         raise InvalidPatchError("no such key {!r}".format(tokens[-1]))
+      parent[key] = value
+
+   @staticmethod
+   def _apply_patch(settings, patch):
+      """return a (new settings, touched paths) pair from applying the JSON
+      patch (RFC 6902) list of operations |patch| to dict |settings|. Only
+      the containers along the patched paths are copied, the rest are shared
+      with |settings|. The touched paths are lists of reference tokens.
+      """
+
+      root = dict(settings)
+      copies = {id(root): root}
+      touched = []
+
+      for op in patch:
+         try:
+            name = op['op']
+            tokens = Settings._parse_pointer(op['path'])
+         except (KeyError, TypeError):
+            raise InvalidPatchError("malformed operation {!r}".format(op))
+
+         if name == 'test':
+            if Settings._resolve(root, tokens) != op.get('value'):
+               raise InvalidPatchError(
+                  "test failed at {!r}".format(op['path']))
+            continue
+
+         if not tokens:
+            if name not in ['add', 'replace'] or \
+               not isinstance(op.get('value'), dict):
+               raise InvalidPatchError("can only replace the whole settings "
+                                       "with a dict")
+            root = copy.deepcopy(op['value'])
+            copies = {id(root): root}
+            touched.append([])
+            continue
+
+         if name == 'add':
+            Settings._patch_add(
+               root, tokens, copy.deepcopy(op.get('value')), copies)
+         elif name == 'remove':
+            Settings._patch_remove(root, tokens, copies)
+         elif name == 'replace':
+            Settings._patch_replace(
+               root, tokens, copy.deepcopy(op.get('value')), copies)
+         elif name in ['move', 'copy']:
+            from_tokens = Settings._parse_pointer(op.get('from'))
+            if name == 'move':
+               if tokens == from_tokens:
+                  # moving a value onto itself leaves it where it is
+                  Settings._resolve(root, from_tokens)
+                  continue
+               if tokens[:len(from_tokens)] == from_tokens:
+                  raise InvalidPatchError(
+                     "can't move {!r} into itself".format(op['from']))
+               value = Settings._patch_remove(root, from_tokens, copies)
+               touched.append(from_tokens)
+            else:
+               value = copy.deepcopy(Settings._resolve(root, from_tokens))
+            Settings._patch_add(root, tokens, value, copies)
+         else:
+            raise InvalidPatchError("unknown operation {!r}".format(name))
+         touched.append(tokens)
+
+      return root, touched
+
+   def updated(self, **changes):
+      """return a new Settings object with the settings named in |**changes|
+      set to the associated values. A value of None or a dict gets defaults
+      injected the same way Settings() does. Only the changed settings are
+      validated again, and all other settings are shared with this Settings
+      object. If a changed setting is invalid, an InvalidSettingError is
+      raised.
+      """
+
+      settings = dict(self._settings)
+      for k, v in changes.items():
+         if self._defaults is not None and k in self._defaults and \
+            (v is None or isinstance(v, dict)):
+            v = Settings._inject_defaults(v, self._defaults[k])
+         settings[k] = v
+
+      self._schema.check_paths(settings, [[k] for k in changes])
+      return Settings._from_validated(settings, self._schema, self._defaults)
+
+   def with_patch(self, json_patch):
+      """return a new Settings object with the JSON patch (RFC 6902) list of
+      operations |json_patch| applied, e.g.
+
+      s.with_patch([{'op': 'replace', 'path': '/foo/bar/0', 'value': 'a'}])
+
+      The containers along each patched path are copied and everything else
+      is shared with this Settings object. Only the patched paths are
+      validated again, and values are used as is without injecting defaults.
+      If the patch can't be applied, an InvalidPatchError is raised. If the
+      patched settings are invalid, an InvalidSettingError is raised.
+      """
+
+      settings, touched = Settings._apply_patch(self._settings, json_patch)
+      self._schema.check_paths(settings, touched)
+      return Settings._from_validated(settings, self._schema, self._defaults)
+
+   def materialize(self):
+      """return the settings as a plain dict, with any nested dicts that
+      defaults were injected into as plain dicts too
+      """
+
+      return materialize(self._settings)
 
    def __getitem__(self, name):
       """return the value associated to setting name |name|. Raise KeyError
       if not in Settings"""
 
-      return self._settings[name]
+      value = self._settings[name]
+      if isinstance(value, DefaultsOverlay):
+         return value._plain_dict()
+      return value
 
    def __iter__(self):
       """return an iterator over the names of the Settings"""
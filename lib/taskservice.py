@@ -0,0 +1,378 @@
+from lib.backends import Backend, make_task
+from lib.engine import EVENT_SCHEDULES, start_datetime, end_datetime
+from datetime import datetime, timedelta
+from xml.etree import ElementTree
+
+import re
+
+
+_NS = 'http://schemas.microsoft.com/windows/2004/02/mit/task'
+_ISO = '%Y-%m-%dT%H:%M:%S'
+
+# the Sched names of the days, months and weeks of the month to the ones
+# of the task xml
+_DAYS = {'MON': 'Monday', 'TUE': 'Tuesday', 'WED': 'Wednesday',
+         'THU': 'Thursday', 'FRI': 'Friday', 'SAT': 'Saturday',
+         'SUN': 'Sunday'}
+_MONTHS = {'JAN': 'January', 'FEB': 'February', 'MAR': 'March',
+           'APR': 'April', 'MAY': 'May', 'JUN': 'June', 'JUL': 'July',
+           'AUG': 'August', 'SEP': 'September', 'OCT': 'October',
+           'NOV': 'November', 'DEC': 'December'}
+_WEEKS = {'FIRST': '1', 'SECOND': '2', 'THIRD': '3', 'FOURTH': '4',
+          'LAST': 'Last'}
+
+# the triggers of the event schedules
+_EVENT_TRIGGERS = {'onstart': 'BootTrigger', 'onlogon': 'LogonTrigger',
+                   'onidle': 'IdleTrigger'}
+
+# the Task Scheduler constants used, see taskschd.h
+TASK_CREATE_OR_UPDATE = 6
+TASK_LOGON_INTERACTIVE_TOKEN = 3
+TASK_ENUM_HIDDEN = 1
+SCHED_S_TASK_HAS_NOT_RUN = 0x41303
+_STATES = {0: 'Unknown', 1: 'Disabled', 2: 'Queued', 3: 'Ready',
+           4: 'Running'}
+# the HRESULTs of ERROR_FILE_NOT_FOUND and ERROR_PATH_NOT_FOUND
+_NOT_FOUND = (-2147024894, -2147024893)
+
+
+def _sub(parent, tag, text=None, **attrib):
+   """return a new element |tag| with the attributes |**attrib| appended to
+   element |parent|, holding |text| if given
+   """
+
+   element = ElementTree.SubElement(parent, tag, attrib)
+   if text is not None:
+      element.text = str(text)
+   return element
+
+
+def _names(parent, tag, names, values):
+   """append to element |parent| the element |tag| holding an empty element
+   for each Sched name in |names|, named after it in the dictionary
+   |values|
+   """
+
+   element = _sub(parent, tag)
+   for name in names:
+      _sub(element, values[name])
+
+
+def _every_months(start, every):
+   """return the Sched names of the months a schedule firing every |every|
+   months from the month of datetime |start| fires in
+   """
+
+   names = list(_MONTHS)
+   return [names[i] for i in sorted(
+      {(start.month - 1 + i * every) % 12 for i in range(12)})]
+
+
+def task_xml(settings, batpath, start=None):
+   """return the Task Scheduler xml of the task described by the validated
+   Sched settings |settings| running the wrapper script |batpath|, with
+   the trigger `schtasks /create` would give it. |start| is the datetime
+   its schedule starts at, taken from the settings and the current time if
+   None.
+   """
+
+   schedule = settings['schedule'].lower()
+   modifier = settings.get('modifier') or ''
+   if schedule == 'quarterly':
+      schedule, modifier = 'daily', 92
+   start = start or start_datetime(settings, datetime.now())
+   end = end_datetime(settings)
+   days = settings.get('days') or [list(_DAYS)[start.weekday()]]
+   months = settings.get('months') or list(_MONTHS)
+
+   task = ElementTree.Element('Task', version='1.2', xmlns=_NS)
+   triggers = _sub(task, 'Triggers')
+   if schedule in EVENT_SCHEDULES:
+      _sub(triggers, _EVENT_TRIGGERS[schedule])
+   elif schedule in ('once', 'minute', 'hourly'):
+      trigger = _sub(triggers, 'TimeTrigger')
+      if schedule != 'once':
+         repetition = _sub(trigger, 'Repetition')
+         _sub(repetition, 'Interval', "PT{}{}".format(
+            modifier or 1, 'M' if schedule == 'minute' else 'H'))
+         _sub(repetition, 'StopAtDurationEnd', 'false')
+   else:
+      trigger = _sub(triggers, 'CalendarTrigger')
+
+   if schedule not in EVENT_SCHEDULES:
+      _sub(trigger, 'StartBoundary', start.strftime(_ISO))
+      if end is not None:
+         _sub(trigger, 'EndBoundary', end.strftime(_ISO))
+   if schedule == 'daily':
+      _sub(_sub(trigger, 'ScheduleByDay'), 'DaysInterval', modifier or 1)
+   elif schedule == 'weekly':
+      by_week = _sub(trigger, 'ScheduleByWeek')
+      _names(by_week, 'DaysOfWeek', days, _DAYS)
+      _sub(by_week, 'WeeksInterval', modifier or 1)
+   elif schedule == 'monthly' and modifier in _WEEKS:
+      by_weekday = _sub(trigger, 'ScheduleByMonthDayOfWeek')
+      _sub(_sub(by_weekday, 'Weeks'), 'Week', _WEEKS[modifier])
+      _names(by_weekday, 'DaysOfWeek', days, _DAYS)
+      _names(by_weekday, 'Months', months, _MONTHS)
+   elif schedule == 'monthly':
+      by_month = _sub(trigger, 'ScheduleByMonth')
+      _sub(_sub(by_month, 'DaysOfMonth'), 'Day',
+           'Last' if modifier == 'LASTDAY' else 1)
+      if not settings.get('months') and isinstance(modifier, int):
+         months = _every_months(start, modifier)
+      _names(by_month, 'Months', months, _MONTHS)
+
+   principal = _sub(_sub(task, 'Principals'), 'Principal', id='Author')
+   _sub(principal, 'LogonType', 'InteractiveToken')
+   task_settings = _sub(task, 'Settings')
+   _sub(task_settings, 'DisallowStartIfOnBatteries', 'false')
+   _sub(task_settings, 'StopIfGoingOnBatteries', 'false')
+   _sub(task_settings, 'ExecutionTimeLimit', 'PT72H')
+   if schedule == 'onidle' and settings.get('idle_time'):
+      _sub(_sub(task_settings, 'IdleSettings'), 'Duration',
+           "PT{}M".format(settings['idle_time']))
+   actions = _sub(task, 'Actions', Context='Author')
+   _sub(_sub(actions, 'Exec'), 'Command', batpath)
+   return ElementTree.tostring(task, encoding='unicode')
+
+
+def _local(tag):
+   """return element tag |tag| without its namespace"""
+
+   return tag.rsplit('}', 1)[-1]
+
+
+def _child(element, tag):
+   """return the first child of |element| named |tag| in any namespace, or
+   None
+   """
+
+   if element is not None:
+      for child in element:
+         if _local(child.tag) == tag:
+            return child
+   return None
+
+
+def _path(element, *tags):
+   """return the descendant of |element| found by following the children
+   named |*tags|, or None
+   """
+
+   for tag in tags:
+      element = _child(element, tag)
+   return element
+
+
+def _text(element, *tags):
+   """return the stripped text of the descendant of |element| found by
+   following the children named |*tags|, or None
+   """
+
+   element = _path(element, *tags)
+   return None if element is None or element.text is None else \
+      element.text.strip()
+
+
+def _sched_names(element, values):
+   """return the Sched names of the children of |element|, named after them
+   in the dictionary |values|, in the order of |values|
+   """
+
+   tags = set() if element is None else {_local(c.tag) for c in element}
+   return [name for name, tag in values.items() if tag in tags]
+
+
+def _parse_iso(value):
+   """return the datetime of the xml date and time |value|, ignoring any
+   fraction of a second or time zone, or None if |value| is empty
+   """
+
+   return datetime.strptime(value[:19], _ISO) if value else None
+
+
+def parse_task_xml(xml):
+   """return a (settings, batpath, start) triple read from the Task
+   Scheduler xml |xml|: Sched settings holding the schedule the xml shows,
+   the command it runs and the datetime its schedule starts at, or None.
+   The schedule is the one task_xml() gives the settings, except that the
+   months of a monthly schedule are always listed and a schedule the xml
+   has no Sched name for is 'N/A'.
+   """
+
+   task = ElementTree.fromstring(xml)
+   triggers = _child(task, 'Triggers')
+   trigger = triggers[0] if triggers is not None and len(triggers) else None
+   tag = None if trigger is None else _local(trigger.tag)
+   settings = {'schedule': 'N/A', 'modifier': '', 'days': [], 'months': [],
+               'start_time': '', 'start_date': '', 'end_date': ''}
+
+   if tag in _EVENT_TRIGGERS.values():
+      settings['schedule'] = next(
+         s for s, t in _EVENT_TRIGGERS.items() if t == tag)
+      idle = _text(task, 'Settings', 'IdleSettings', 'Duration') or ''
+      match = re.match(r'PT(\d+)M$', idle)
+      if settings['schedule'] == 'onidle' and match:
+         settings['idle_time'] = int(match.group(1))
+   elif tag == 'TimeTrigger':
+      interval = _text(trigger, 'Repetition', 'Interval') or ''
+      match = re.match(r'PT(?:(\d+)H)?(?:(\d+)M)?$', interval)
+      if not interval:
+         settings['schedule'] = 'once'
+      elif match and match.group(1) and not match.group(2):
+         settings.update(schedule='hourly', modifier=int(match.group(1)))
+      elif match:
+         settings.update(schedule='minute', modifier=int(
+            match.group(1) or 0) * 60 + int(match.group(2) or 0))
+   elif tag == 'CalendarTrigger':
+      by_day = _child(trigger, 'ScheduleByDay')
+      by_week = _child(trigger, 'ScheduleByWeek')
+      by_weekday = _child(trigger, 'ScheduleByMonthDayOfWeek')
+      by_month = _child(trigger, 'ScheduleByMonth')
+      if by_day is not None:
+         settings.update(schedule='daily', modifier=int(
+            _text(by_day, 'DaysInterval') or 1))
+      elif by_week is not None:
+         settings.update(
+            schedule='weekly',
+            modifier=int(_text(by_week, 'WeeksInterval') or 1),
+            days=_sched_names(_child(by_week, 'DaysOfWeek'), _DAYS))
+      elif by_weekday is not None:
+         week = _text(by_weekday, 'Weeks', 'Week')
+         settings.update(
+            schedule='monthly',
+            modifier=next((m for m, w in _WEEKS.items() if w == week), ''),
+            days=_sched_names(_child(by_weekday, 'DaysOfWeek'), _DAYS),
+            months=_sched_names(_child(by_weekday, 'Months'), _MONTHS))
+      elif by_month is not None:
+         settings.update(
+            schedule='monthly',
+            modifier='LASTDAY'
+            if _text(by_month, 'DaysOfMonth', 'Day') == 'Last' else '',
+            months=_sched_names(_child(by_month, 'Months'), _MONTHS))
+   if len(settings['months']) == len(_MONTHS):
+      settings['months'] = []
+
+   start = _parse_iso(_text(trigger, 'StartBoundary'))
+   end = _parse_iso(_text(trigger, 'EndBoundary'))
+   if end is not None:
+      # task_xml() ends a schedule at the midnight after its end date, and
+      # schtasks at the last second of it
+      settings['end_date'] = (end - timedelta(seconds=1)).strftime(
+         '%m\\%d\\%Y')
+   return settings, _text(task, 'Actions', 'Exec', 'Command'), start
+
+
+class TaskServiceBackend(Backend):
+   """backend driving the Windows task scheduler from this process through
+   its Schedule.Service COM object, so nothing is spawned to create, delete
+   or query a task. It needs pywin32. COM objects belong to the thread that
+   made them, so a TaskServiceBackend must only be used from the thread it
+   was created in; the worker of lib.worker.taskservice_worker_argv() runs
+   one and serves the requests of any number of threads with it.
+   """
+
+   def __init__(self, service=None):
+      """create a TaskServiceBackend using the connected Schedule.Service
+      object |service|, a new one if None
+      """
+
+      if service is None:
+         # pywin32 is only needed, and only installed, on Windows
+         import win32com.client
+         service = win32com.client.Dispatch('Schedule.Service')
+         service.Connect()
+      self._service = service
+
+   @staticmethod
+   def _is_not_found(err):
+      """return True if the COM error |err| says that the task or folder
+      doesn't exist
+      """
+
+      hresult = getattr(err, 'hresult', None)
+      if hresult is None and err.args:
+         hresult = err.args[0]
+      return hresult in _NOT_FOUND
+
+   @staticmethod
+   def _datetime(value):
+      """return the COM date |value| as a naive datetime, or None if it is
+      missing or the zero date the task scheduler uses for never
+      """
+
+      if value is None or value.year < 1900:
+         return None
+      return datetime(*value.timetuple()[:6])
+
+   @staticmethod
+   def _task(registered):
+      """return the Task named tuple of the registered task |registered|"""
+
+      settings, batpath, start = parse_task_xml(registered.Xml)
+      result = registered.LastTaskResult
+      return make_task(
+         registered.Path.lstrip('\\'), settings, batpath or 'N/A',
+         start=start,
+         next_run=TaskServiceBackend._datetime(registered.NextRunTime),
+         last_run=TaskServiceBackend._datetime(registered.LastRunTime),
+         last_result=None if result == SCHED_S_TASK_HAS_NOT_RUN else result,
+         status=_STATES.get(registered.State, 'Unknown'))
+
+   def _root(self):
+      """return the root task folder"""
+
+      return self._service.GetFolder('\\')
+
+   def create(self, settings, batpath):
+      """create or replace the task described by the validated Sched
+      settings |settings| running the batch script |batpath|. The COM error
+      is raised on error.
+      """
+
+      self._root().RegisterTask(
+         settings['name'], task_xml(settings, batpath),
+         TASK_CREATE_OR_UPDATE, '', '', TASK_LOGON_INTERACTIVE_TOKEN)
+
+   def delete(self, taskname):
+      """delete the task named |taskname|. Return True on success, False if
+      the task doesn't exist. The COM error is raised on any other error.
+      """
+
+      try:
+         self._root().DeleteTask(taskname, 0)
+      except Exception as err:
+         if TaskServiceBackend._is_not_found(err):
+            return False
+         raise
+      return True
+
+   def query(self, taskname):
+      """return the Task named tuple for the task named |taskname|, or an
+      empty tuple if the task doesn't exist. The COM error is raised on any
+      other error.
+      """
+
+      try:
+         registered = self._root().GetTask(taskname)
+      except Exception as err:
+         if TaskServiceBackend._is_not_found(err):
+            return ()
+         raise
+      return TaskServiceBackend._task(registered)
+
+   def bulk_query(self, top_lv_only=True):
+      """return a dictionary of task names to Task named tuples for all
+      tasks, hidden ones included. If |top_lv_only| is True, only the tasks
+      in the root folder are returned.
+      """
+
+      tasks = {}
+      folders = [self._root()]
+      while folders:
+         folder = folders.pop()
+         for registered in folder.GetTasks(TASK_ENUM_HIDDEN):
+            tasks[registered.Name] = TaskServiceBackend._task(registered)
+         if not top_lv_only:
+            folders.extend(folder.GetFolders(0))
+      return tasks
@@ -0,0 +1,136 @@
+from lib.schema import fingerprint
+from collections import OrderedDict
+
+import copy
+import hashlib
+import json
+import os
+import os.path
+import threading
+import lib.atomic as atomic
+
+
+class ValidationCache:
+   """cache of validated, defaults injected settings files keyed by the file
+   content, the schema and the defaults. Entries are kept in memory and,
+   optionally, in a directory on disk that can be shared by several
+   processes. Every hit returns a copy of the cached settings, so changing
+   the settings of one Settings object doesn't change the cache or any
+   other Settings object loaded from it.
+   """
+
+   def __init__(self, directory=None, maxsize=1024):
+      """create a ValidationCache holding at most |maxsize| entries in
+      memory. If |directory| is given, entries are also stored there as json
+      files, one per entry, and are picked up by any process using the same
+      |directory|. The directory is created if it doesn't exist.
+      """
+
+      self._directory = directory
+      self._maxsize = maxsize
+      self._entries = OrderedDict()
+      self._lock = threading.Lock()
+      self.hits = 0
+      self.misses = 0
+
+      if directory is not None:
+         os.makedirs(directory, exist_ok=True)
+
+   def __getstate__(self):
+      """return the picklable state, which leaves out the in memory entries
+      and the lock, e.g. for handing the cache to worker processes
+      """
+
+      return {'directory': self._directory, 'maxsize': self._maxsize}
+
+   def __setstate__(self, state):
+      """restore the state returned by __getstate__()"""
+
+      self.__init__(state['directory'], state['maxsize'])
+
+   @staticmethod
+   def key(content, schema, defaults):
+      """return the cache key for the settings file contents |content| as
+      bytes, validated against Schema |schema| with |defaults| injected
+      """
+
+      digest = hashlib.sha256()
+      digest.update(hashlib.sha256(content).digest())
+      digest.update(schema.fingerprint.encode('ascii'))
+      digest.update(fingerprint(defaults).encode('ascii'))
+      return digest.hexdigest()
+
+   def _path(self, key):
+      """return the path of the on disk entry for |key|"""
+
+      return os.path.join(self._directory, "{}.json".format(key))
+
+   def _remember(self, key, settings):
+      """keep |settings| in memory under |key|, dropping the least recently
+      used entry if there are too many
+      """
+
+      with self._lock:
+         self._entries[key] = settings
+         self._entries.move_to_end(key)
+         if len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+   def get(self, key):
+      """return a copy of the validated settings dict cached under |key|, or
+      None if there is none
+      """
+
+      with self._lock:
+         settings = self._entries.get(key)
+         if settings is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(settings)
+
+      if self._directory is not None:
+         try:
+            with open(self._path(key), 'r') as entry:
+               settings = json.load(entry)
+         except (OSError, ValueError):
+            settings = None
+         if isinstance(settings, dict):
+            self._remember(key, settings)
+            with self._lock:
+               self.hits += 1
+            return copy.deepcopy(settings)
+
+      with self._lock:
+         self.misses += 1
+      return None
+
+   def put(self, key, settings):
+      """cache a copy of the validated settings dict |settings| under |key|.
+      The on disk entry is written to a temporary file first and then
+      renamed, so other processes never see a partially written entry.
+      """
+
+      self._remember(key, copy.deepcopy(settings))
+      if self._directory is None:
+         return
+
+      atomic.atomic_write(self._path(key), json.dumps(settings))
+
+   def clear(self):
+      """drop all entries, in memory and on disk, and reset the hit/miss
+      counters
+      """
+
+      with self._lock:
+         self._entries.clear()
+         self.hits = 0
+         self.misses = 0
+
+      if self._directory is not None:
+         with os.scandir(self._directory) as entries:
+            for f in entries:
+               if f.name.endswith('.json'):
+                  try:
+                     os.remove(f.path)
+                  except FileNotFoundError:
+                     pass
@@ -0,0 +1,431 @@
+from lib.custom_exceptions import *
+from lib.settings import materialize
+from lib.backends import Backend, InProcessBackend, TASK_FIELDS, task_type
+from lib.taskservice import TaskServiceBackend
+from concurrent.futures import Future
+
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import lib
+
+
+# The line protocol spoken with a worker process. Every request and reply is
+# one line of json. A request is {"id": n, "op": op, "args": {...}} and its
+# reply is {"id": n, "result": result} or {"id": n, "error": error}, where
+# error is {"type": name, "message": str} plus "returncode", "cmd" and
+# "output" for a CalledProcessError. Requests can be sent without waiting
+# for the replies to the previous ones, and replies are matched by id.
+#
+# ops and their args:
+#    ping                       -> pid of the worker
+#    create settings, batpath   -> None
+#    delete taskname            -> bool
+#    query taskname             -> {"fields": [...], "values": [...]} or None
+#    bulk_query top_lv_only     -> {"fields": [...], "tasks": [[...], ...]}
+
+
+def _encode_error(err):
+   """return the protocol error of exception |err|"""
+
+   error = {'type': type(err).__name__, 'message': str(err)}
+   if isinstance(err, subprocess.CalledProcessError):
+      error.update(returncode=err.returncode, cmd=err.cmd, output=err.output)
+   return error
+
+
+def _decode_error(error):
+   """return the exception of the protocol error |error|"""
+
+   if error['type'] == 'CalledProcessError':
+      return subprocess.CalledProcessError(
+         error['returncode'], error['cmd'], error['output'])
+   return WorkerError(error['type'], error['message'])
+
+
+def handle(backend, request):
+   """return the reply of Backend |backend| to the protocol request
+   dictionary |request|
+   """
+
+   reply = {'id': request.get('id')}
+   op, args = request.get('op'), request.get('args') or {}
+   try:
+      if op == 'ping':
+         result = os.getpid()
+      elif op == 'create':
+         result = backend.create(args['settings'], args['batpath'])
+      elif op == 'delete':
+         result = backend.delete(args['taskname'])
+      elif op == 'query':
+         task = backend.query(args['taskname'])
+         result = {'fields': task._fields, 'values': task} if task else None
+      elif op == 'bulk_query':
+         tasks = list(backend.bulk_query(args.get('top_lv_only', True))
+                      .values())
+         result = {'fields': tasks[0]._fields if tasks else TASK_FIELDS,
+                   'tasks': tasks}
+      else:
+         raise ValueError("unknown op {!r}".format(op))
+      reply['result'] = result
+   except Exception as err:
+      reply['error'] = _encode_error(err)
+   return reply
+
+
+def serve(backend, stdin=None, stdout=None):
+   """answer the requests read line by line from file |stdin| with Backend
+   |backend|, writing each reply as a line to file |stdout|, until |stdin|
+   is closed. They default to the standard input and output.
+   """
+
+   stdin = stdin or sys.stdin
+   stdout = stdout or sys.stdout
+   for line in stdin:
+      if not line.strip():
+         continue
+      try:
+         reply = handle(backend, json.loads(line))
+      except ValueError as err:
+         reply = {'id': None, 'error': _encode_error(err)}
+      stdout.write(json.dumps(reply) + '\n')
+      stdout.flush()
+
+
+def local_worker_argv(path=None):
+   """return the command of a local stand-in worker process, which keeps
+   tasks in an InProcessBackend saved to the json file |path|, if any,
+   instead of in the Windows task scheduler
+   """
+
+   argv = [sys.executable, '-m', 'lib.worker', 'inprocess']
+   return argv + [os.path.realpath(path)] if path else argv
+
+
+def taskservice_worker_argv():
+   """return the command of a worker process serving the requests with a
+   TaskServiceBackend, which drives the Windows task scheduler through COM
+   from inside the worker, so no process is spawned per operation. It needs
+   pywin32 on the host.
+   """
+
+   return [sys.executable, '-m', 'lib.worker', 'taskservice']
+
+
+class WorkerClient:
+   """client of one long-lived worker process speaking the line protocol
+   above over its standard input and output. Any number of requests can be
+   in flight at once; a reader thread resolves their futures as the
+   replies come in. If the worker exits, the requests in flight fail with
+   WorkerCrashedError and the worker is started again on the next request.
+   """
+
+   def __init__(self, argv, env=None):
+      """create a WorkerClient of the worker started with the command list
+      |argv| and the environment variables |env|, those of this process if
+      None. The worker is started on the first request.
+      """
+
+      self._argv = list(argv)
+      self._env = env
+      self._ids = itertools.count()
+      self._lock = threading.Lock()
+      self._proc = None
+      self._pending = {}
+      self._starts = 0
+
+   def _start(self):
+      """start the worker process and its reader thread. Called with the
+      lock held.
+      """
+
+      env = dict(os.environ if self._env is None else self._env)
+      env['PYTHONPATH'] = os.pathsep.join(
+         p for p in [lib.ROOT_PATH, env.get('PYTHONPATH')] if p)
+      self._proc = subprocess.Popen(
+         self._argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+         env=env, universal_newlines=True, bufsize=1)
+      self._pending = {}
+      self._starts += 1
+      threading.Thread(target=self._read, args=[self._proc, self._pending],
+                       daemon=True).start()
+
+   def _read(self, proc, pending):
+      """resolve the futures in dictionary |pending| with the replies of
+      worker process |proc| until it exits, then fail the rest
+      """
+
+      for line in proc.stdout:
+         try:
+            reply = json.loads(line)
+         except ValueError:
+            continue
+         with self._lock:
+            future = pending.pop(reply.get('id'), None)
+         if future is None:
+            continue
+         if 'error' in reply:
+            future.set_exception(_decode_error(reply['error']))
+         else:
+            future.set_result(reply.get('result'))
+
+      proc.stdout.close()
+      proc.wait()
+      with self._lock:
+         if self._proc is proc:
+            self._proc = None
+         failed = list(pending.values())
+         pending.clear()
+      for future in failed:
+         future.set_exception(WorkerCrashedError(
+            message="worker process exited with {}".format(proc.returncode)))
+
+   @property
+   def restarts(self):
+      """return the number of times the worker was started again after it
+      exited
+      """
+
+      return max(0, self._starts - 1)
+
+   @property
+   def pid(self):
+      """return the process id of the worker, or None if it isn't running"""
+
+      proc = self._proc
+      return None if proc is None else proc.pid
+
+   def __len__(self):
+      """return the number of requests in flight"""
+
+      return len(self._pending)
+
+   def submit(self, op, **args):
+      """send the request |op| with the arguments |**args| and return a
+      concurrent.futures.Future of its result
+      """
+
+      future = Future()
+      with self._lock:
+         if self._proc is None or self._proc.poll() is not None:
+            self._start()
+         rid = next(self._ids)
+         self._pending[rid] = future
+         try:
+            self._proc.stdin.write(json.dumps(
+               {'id': rid, 'op': op, 'args': args}) + '\n')
+            self._proc.stdin.flush()
+         except OSError:
+            # the worker died, its reader thread fails the future
+            pass
+      return future
+
+   def call(self, op, **args):
+      """send the request |op| with the arguments |**args| and return its
+      result, raising its error
+      """
+
+      return self.submit(op, **args).result()
+
+   def kill(self):
+      """kill the worker process, e.g. to test recovering from a crash"""
+
+      proc = self._proc
+      if proc is not None:
+         proc.kill()
+         proc.wait()
+
+   def close(self):
+      """stop the worker process after it has answered the requests in
+      flight
+      """
+
+      with self._lock:
+         proc, self._proc = self._proc, None
+      if proc is not None:
+         proc.stdin.close()
+         proc.wait()
+
+
+class WorkerPool:
+   """a fixed number of WorkerClients of the same worker command. Each
+   request goes to the worker with the fewest requests in flight.
+   """
+
+   def __init__(self, argv, size=2, env=None):
+      """create a WorkerPool of |size| workers started with the command list
+      |argv| and the environment variables |env|
+      """
+
+      self._clients = [WorkerClient(argv, env) for i in range(max(1, size))]
+
+   @property
+   def clients(self):
+      """return the list of WorkerClients"""
+
+      return list(self._clients)
+
+   def submit(self, op, **args):
+      """send the request |op| with the arguments |**args| to the least busy
+      worker and return a concurrent.futures.Future of its result
+      """
+
+      return min(self._clients, key=len).submit(op, **args)
+
+   def call(self, op, **args):
+      """send the request |op| with the arguments |**args| and return its
+      result, raising its error
+      """
+
+      return self.submit(op, **args).result()
+
+   def close(self):
+      """stop all workers"""
+
+      for client in self._clients:
+         client.close()
+
+
+class WorkerBackend(Backend):
+   """backend sending every operation to a pool of long-lived worker
+   processes, so nothing is spawned per operation once the workers are up.
+   Operations from many threads or coroutines are pipelined over the same
+   workers. An operation that fails because its worker crashed is sent
+   again, to a restarted worker, up to |retries| times; all operations are
+   safe to repeat.
+   """
+
+   def __init__(self, argv=None, size=1, retries=1, env=None):
+      """create a WorkerBackend of |size| workers started with the command
+      list |argv|, the local stand-in worker if None, e.g.
+      taskservice_worker_argv() on Windows. See the class doc for
+      |retries|.
+      """
+
+      self._pool = WorkerPool(argv or local_worker_argv(), size, env)
+      self._retries = retries
+
+   @property
+   def pool(self):
+      """return the WorkerPool"""
+
+      return self._pool
+
+   def close(self):
+      """stop the workers"""
+
+      self._pool.close()
+
+   def _call(self, op, **args):
+      """return the result of the request |op| with the arguments |**args|,
+      retrying it if its worker crashed
+      """
+
+      for attempt in itertools.count():
+         try:
+            return self._pool.call(op, **args)
+         except WorkerCrashedError:
+            if attempt >= self._retries:
+               raise
+
+   async def _acall(self, op, **args):
+      """coroutine version of _call()"""
+
+      for attempt in itertools.count():
+         try:
+            return await asyncio.wrap_future(self._pool.submit(op, **args))
+         except WorkerCrashedError:
+            if attempt >= self._retries:
+               raise
+
+   @staticmethod
+   def _task(result):
+      """return the Task named tuple of the query result |result|"""
+
+      return task_type(result['fields'])(*result['values']) if result else ()
+
+   @staticmethod
+   def _tasks(result):
+      """return the dictionary of task names to Task named tuples of the
+      bulk_query result |result|
+      """
+
+      Task = task_type(result['fields'])
+      tasks = [Task(*values) for values in result['tasks']]
+      return {t.task_name.rsplit('\\', 1)[-1]: t for t in tasks}
+
+   def create(self, settings, batpath):
+      """create or replace the task described by the validated Sched
+      settings |settings| in the worker
+      """
+
+      self._call('create', settings=materialize(settings), batpath=batpath)
+
+   def delete(self, taskname):
+      """delete the task named |taskname| in the worker. Return True on
+      success, False if the task doesn't exist.
+      """
+
+      return self._call('delete', taskname=taskname)
+
+   def query(self, taskname):
+      """return the Task named tuple for the task named |taskname| from the
+      worker, or an empty tuple if the task doesn't exist
+      """
+
+      return WorkerBackend._task(self._call('query', taskname=taskname))
+
+   def bulk_query(self, top_lv_only=True):
+      """return a dictionary of task names to Task named tuples for all
+      tasks from the worker
+      """
+
+      return WorkerBackend._tasks(
+         self._call('bulk_query', top_lv_only=top_lv_only))
+
+   async def acreate(self, settings, batpath):
+      """coroutine version of create()"""
+
+      await self._acall('create', settings=materialize(settings),
+                        batpath=batpath)
+
+   async def adelete(self, taskname):
+      """coroutine version of delete()"""
+
+      return await self._acall('delete', taskname=taskname)
+
+   async def aquery(self, taskname):
+      """coroutine version of query()"""
+
+      return WorkerBackend._task(await self._acall('query', taskname=taskname))
+
+   async def abulk_query(self, top_lv_only=True):
+      """coroutine version of bulk_query()"""
+
+      return WorkerBackend._tasks(
+         await self._acall('bulk_query', top_lv_only=top_lv_only))
+
+
+def main(argv):
+   """serve the line protocol on the standard input and output with the
+   backend named by |argv|: 'inprocess [path]' for an InProcessBackend,
+   saved to the json file path if given, or 'taskservice' for a
+   TaskServiceBackend
+   """
+
+   if argv and argv[0] == 'taskservice':
+      backend = TaskServiceBackend()
+   elif argv and argv[0] == 'inprocess':
+      backend = InProcessBackend(argv[1] if len(argv) > 1 else None)
+   else:
+      sys.stderr.write("usage: worker.py taskservice | inprocess [path]\n")
+      return 2
+   serve(backend)
+   return 0
+
+if __name__ == '__main__':
+   sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,179 @@
+from lib.asyncsched import AsyncSched
+from lib.sched import Sched, DescheduleResult
+from lib.backends import RecordingBackend, SchtasksBackend
+from lib.inventory import TaskInventory
+from lib.helpers import RetryPolicy
+from lib.custom_exceptions import *
+from tests.test_helpers import MockRestore
+from unittest.mock import MagicMock
+
+import unittest
+import asyncio
+import os
+import shutil
+import subprocess
+import tests.test_helpers as dammit
+
+
+class SlowBackend(RecordingBackend):
+   """RecordingBackend taking a while to create tasks, keeping track of how
+   many are being created at once
+   """
+
+   def __init__(self, errors=None):
+      super().__init__(errors)
+      self.active = 0
+      self.max_active = 0
+
+   async def acreate(self, settings, batpath):
+      self.active += 1
+      self.max_active = max(self.max_active, self.active)
+      try:
+         await asyncio.sleep(0.01)
+         self.create(settings, batpath)
+      finally:
+         self.active -= 1
+
+
+class AsyncSchedTest(unittest.TestCase):
+   """unit tests for AsyncSched, against fake backends so they don't need
+   schtasks
+   """
+
+   def remove_files(self):
+      with os.scandir() as files:
+         for f in files:
+            if f.name.startswith('_async') or \
+               f.name.startswith('batcave\\_async'):
+               os.remove(f.name)
+      if os.path.isdir('batcave'):
+         shutil.rmtree('batcave')
+
+   def setUp(self):
+      for i in range(20):
+         Sched.gen_sched_settings_file(
+            "_async{}.json".format(i),
+            name="_async{}".format(i),
+            run_cmd='python _foo.py',
+            schedule='daily')
+
+   def test_schedule_task(self):
+      backend = RecordingBackend()
+      s = AsyncSched('_async0.json', backend=backend)
+
+      async def run():
+         self.assertFalse(await s.is_scheduled())
+         await s.schedule_task()
+         self.assertTrue(await s.is_scheduled())
+         self.assertEqual((await s.details()).task_name, '\\_async0')
+         self.assertTrue(await AsyncSched.is_task_scheduled(
+            '_async0', backend))
+         self.assertTrue(await s.deschedule_task())
+         self.assertFalse(await AsyncSched.deschedule_task_with_taskname(
+            '_async0', backend))
+
+      asyncio.run(run())
+      self.assertEqual(s.sched.details(), ())
+
+   def test_schedule_many(self):
+      files = ["_async{}.json".format(i) for i in range(20)]
+      files.append('_async_missing.json')
+      backend = SlowBackend()
+      with MockRestore(AsyncSched, 'concurrency', 4):
+         results = asyncio.run(AsyncSched.schedule_many(
+            files, backend=backend))
+      self.assertEqual(backend.max_active, 4)
+      self.assertEqual([r.taskname for r in results[:-1]],
+                       ["_async{}".format(i) for i in range(20)])
+      self.assertIsInstance(results[-1].error, FileNotFoundError)
+      self.assertEqual(len(backend.tasks), 20)
+
+      results = asyncio.run(AsyncSched.deschedule_many(
+         ['_async0', '_async0'], backend=backend))
+      self.assertEqual(results, [DescheduleResult('_async0', True, None),
+                                 DescheduleResult('_async0', False, None)])
+
+   def test_retry(self):
+      # schtasks failing fails the same way again, so it isn't retried
+      error = subprocess.CalledProcessError(1, 'schtasks')
+      backend = RecordingBackend({'create': error})
+      results = asyncio.run(AsyncSched.schedule_many(
+         ['_async0.json'], backend=backend))
+      self.assertIs(results[0].error, error)
+      self.assertEqual(len(backend.calls), 1)
+
+      error = PermissionError('task scheduler busy')
+      backend = RecordingBackend({'create': error})
+      policy = RetryPolicy(max_attempts=3, base_sec=0)
+      with MockRestore(AsyncSched, 'retry_policy', policy):
+         results = asyncio.run(AsyncSched.schedule_many(
+            ['_async0.json'], backend=backend))
+         self.assertIs(results[0].error, error)
+         self.assertEqual(len(backend.calls), 3)
+
+         attempts = []
+
+         def create(settings, batpath):
+            attempts.append(settings['name'])
+            if len(attempts) < 3:
+               raise error
+
+         backend = RecordingBackend()
+         with MockRestore(backend, 'create', create):
+            asyncio.run(AsyncSched('_async0.json', backend=backend)
+                        .schedule_task())
+         self.assertEqual(len(attempts), 3)
+         self.assertEqual((policy.metrics.calls, policy.metrics.attempts,
+                           policy.metrics.failures), (2, 6, 1))
+
+   def test_inventory(self):
+      backend = RecordingBackend()
+      inventory = TaskInventory(backend)
+
+      async def run():
+         await AsyncSched('_async0.json', backend=inventory).schedule_task()
+         found = await asyncio.gather(
+            *[AsyncSched.is_task_scheduled("_async{}".format(i % 2),
+                                           inventory)
+              for i in range(100)])
+         self.assertEqual(found, [True, False] * 50)
+
+      asyncio.run(run())
+      self.assertEqual(
+         sum(1 for c in backend.calls if c[0] == 'bulk_query'), 1)
+
+   def test_schtasks(self):
+      header = '"HostName","TaskName","Status"'
+      stdout = '\n'.join([header, '"HOST","\\_async0","Ready"'])
+
+      async def schtasks(*args):
+         calls.append(list(args))
+         return subprocess.CompletedProcess([], 0, stdout)
+
+      calls = []
+      backend = SchtasksBackend()
+      with MockRestore(SchtasksBackend, '_aschtasks', schtasks):
+         task = asyncio.run(AsyncSched.details_for('_async0', backend))
+         self.assertEqual(task.status, 'Ready')
+         self.assertEqual(
+            asyncio.run(AsyncSched.details_for('_async1', backend)), ())
+         self.assertTrue(asyncio.run(
+            AsyncSched.deschedule_task_with_taskname('_async0', backend)))
+      self.assertEqual(calls[0],
+                       ['/query', '/v', '/fo', 'csv', '/tn', '_async0'])
+      self.assertEqual(calls[-1], ['/delete', '/f', '/tn', '_async0'])
+
+      err = subprocess.CalledProcessError(
+         1, 'schtasks', 'ERROR: The system cannot find the file specified.')
+      with MockRestore(SchtasksBackend, '_aschtasks',
+                       MagicMock(side_effect=err)):
+         self.assertEqual(
+            asyncio.run(AsyncSched.details_for('_async0', backend)), ())
+         self.assertFalse(asyncio.run(
+            AsyncSched.deschedule_task_with_taskname('_async0', backend)))
+
+   def tearDown(self):
+      dammit.keep_fkn_trying(self.remove_files)
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,87 @@
+from lib.atomic import *
+from tests.test_helpers import MockRestore
+
+import unittest
+import os
+import os.path
+import shutil
+import tests.test_helpers as dammit
+
+
+class AtomicTest(unittest.TestCase):
+   """unit tests for atomic_write"""
+
+   def remove_files(self):
+      if os.path.isdir('_atomic'):
+         shutil.rmtree('_atomic')
+
+   def setUp(self):
+      os.makedirs('_atomic')
+      self.path = os.path.join('_atomic', 'foo.bat')
+
+   def test_write(self):
+      self.assertTrue(atomic_write(self.path, "@echo off\nfoo\n"))
+      with open(self.path) as written:
+         self.assertEqual(written.read(), "@echo off\nfoo\n")
+      with open(self.path, 'rb') as written:
+         self.assertEqual(written.read(),
+                          "@echo off{0}foo{0}".format(os.linesep).encode())
+      self.assertTrue(atomic_write(self.path, b'\x00\x01'))
+      with open(self.path, 'rb') as written:
+         self.assertEqual(written.read(), b'\x00\x01')
+      self.assertEqual(os.listdir('_atomic'), ['foo.bat'])
+
+   def test_skip_identical(self):
+      atomic_write(self.path, "foo\n")
+      inode = os.stat(self.path).st_ino
+      self.assertFalse(atomic_write(self.path, "foo\n"))
+      self.assertEqual(os.stat(self.path).st_ino, inode)
+      self.assertTrue(atomic_write(self.path, "foo\n", skip_identical=False))
+      self.assertTrue(atomic_write(self.path, "bar\n"))
+      self.assertTrue(atomic_write(self.path, "bar!\n"))
+
+   def test_mode(self):
+      atomic_write(self.path, "foo\n")
+      os.chmod(self.path, 0o640)
+      atomic_write(self.path, "bar\n")
+      self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o640)
+
+   def test_durability(self):
+      synced = []
+
+      def fsync(fd):
+         synced.append(fd)
+
+      with MockRestore(os, 'fsync', fsync):
+         atomic_write(self.path, "a", NONE)
+         self.assertEqual(len(synced), 0)
+         atomic_write(self.path, "b", FSYNC_FILE)
+         self.assertEqual(len(synced), 1)
+         atomic_write(self.path, "c", FSYNC_DIR)
+         self.assertIn(len(synced), [2, 3])
+         self.assertFalse(atomic_write(self.path, "c", FSYNC_DIR))
+      with self.assertRaises(ValueError):
+         atomic_write(self.path, "d", 'always')
+
+   def test_failure(self):
+      atomic_write(self.path, "foo\n")
+      with self.assertRaises(TypeError):
+         atomic_write(self.path, 42)
+      with self.assertRaises(FileNotFoundError):
+         atomic_write(os.path.join('_atomic', 'missing', 'foo.bat'), "foo")
+
+      def replace(src, dst):
+         raise PermissionError('sharing violation')
+
+      with MockRestore(os, 'replace', replace):
+         with self.assertRaises(PermissionError):
+            atomic_write(self.path, "bar\n")
+      self.assertEqual(os.listdir('_atomic'), ['foo.bat'])
+      with open(self.path) as written:
+         self.assertEqual(written.read(), "foo\n")
+
+   def tearDown(self):
+      dammit.keep_fkn_trying(self.remove_files)
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,339 @@
+from lib.backends import *
+from lib.sched import Sched
+from lib.custom_exceptions import *
+from tests.test_helpers import MockRestore, FakeClock, task_settings
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import unittest
+import asyncio
+import os
+import os.path
+import json
+import shutil
+import subprocess
+import sys
+import tests.test_helpers as dammit
+
+
+class BackendsTest(unittest.TestCase):
+   """unit tests for the scheduler backends"""
+
+   def settings(self, **settings):
+      return task_settings(**settings)
+
+   def remove_files(self):
+      for f in ['backend_tasks.json', 'backend_tasks.json.log', 'foo.json',
+                'fake_schtasks.json']:
+         if os.path.isfile(f):
+            os.remove(f)
+      if os.path.isfile(os.path.realpath("batcave\\_foo.bat")):
+         os.remove(os.path.realpath("batcave\\_foo.bat"))
+      if os.path.isdir('batcave'):
+         shutil.rmtree('batcave')
+
+   def test_schtasks_create(self):
+      mock = MagicMock()
+      with MockRestore(SchtasksBackend, '_schtasks', mock):
+         SchtasksBackend().create(
+            self.settings(start_time='00:00', schedule='weekly',
+                          days=['MON', 'TUE']), 'C:\\batcave\\_foo.bat')
+      self.assertEqual(list(mock.call_args[0]), [
+         '/create', '/f', '/tr', 'C:\\batcave\\_foo.bat', '/st', '00:00',
+         '/sc', 'weekly', '/d', 'MON,TUE', '/tn', '_foo'])
+
+   def test_schtasks_argv(self):
+      argv = SchtasksArgv.create(self.settings(
+         schedule='onidle', idle_time=10, start_date='01\\31\\2018',
+         end_date='02\\28\\2018', days=['MON']), 'C:\\bat cave\\_foo.bat')
+      self.assertEqual(argv, [
+         '/create', '/f', '/tr', 'C:\\bat cave\\_foo.bat', '/sc', 'onidle',
+         '/i', '10', '/tn', '_foo'])
+      argv = SchtasksArgv.create(self.settings(
+         schedule='daily', modifier=92, start_date='01\\31\\2018',
+         end_date='02\\28\\2018'), 'C:\\batcave\\_foo.bat')
+      self.assertEqual(argv[4:], [
+         '/sc', 'daily', '/mo', '92', '/sd', '01\\31\\2018',
+         '/ed', '02\\28\\2018', '/tn', '_foo'])
+      argv = SchtasksArgv.create(self.settings(
+         schedule='monthly', modifier='LAST', days=['FRI'], months=['JAN']),
+         'C:\\batcave\\_foo.bat')
+      self.assertEqual(argv[4:], [
+         '/sc', 'monthly', '/mo', 'LAST', '/d', 'FRI', '/m', 'JAN',
+         '/tn', '_foo'])
+      self.assertEqual(SchtasksArgv.query(),
+                       ['/query', '/v', '/fo', 'csv'])
+      self.assertEqual(SchtasksArgv.delete('_foo'),
+                       ['/delete', '/f', '/tn', '_foo'])
+      with self.assertRaises(TypeError):
+         SchtasksArgv('/create').opt('/mo', True)
+      with self.assertRaises(TypeError):
+         SchtasksArgv('/create').opt('/mo', 1.5)
+
+   def test_schtasks_standin(self):
+      standin = [sys.executable, os.path.join(
+         os.path.dirname(os.path.realpath(__file__)), 'fake_schtasks.py')]
+      batpath = os.path.realpath(os.path.join('bat cave', '_foo.bat'))
+      with MockRestore(SchtasksBackend, 'command', standin):
+         backend = SchtasksBackend()
+         backend.create(self.settings(schedule='monthly', months=['JAN'],
+                                      modifier='LASTDAY'), batpath)
+         with open('fake_schtasks.json') as fp:
+            self.assertEqual(json.load(fp)['_foo'], [
+               '/create', '/f', '/tr', batpath, '/sc', 'monthly',
+               '/mo', 'LASTDAY', '/m', 'JAN', '/tn', '_foo'])
+         self.assertEqual(backend.query('_foo').task_to_run, batpath)
+         self.assertEqual(list(backend.bulk_query()), ['_foo'])
+         self.assertEqual(asyncio.run(backend.aquery('_foo')).status, 'Ready')
+         self.assertTrue(backend.delete('_foo'))
+         self.assertFalse(backend.delete('_foo'))
+         self.assertFalse(asyncio.run(backend.adelete('_foo')))
+         self.assertEqual(backend.query('_foo'), ())
+         with self.assertRaises(subprocess.CalledProcessError):
+            SchtasksBackend._schtasks('/bogus')
+
+   def test_schtasks_query(self):
+      header = ','.join('"{}"'.format(h) for h in [
+         'HostName', 'TaskName', 'Next Run Time', 'Status'])
+      stdout = '\n'.join([
+         header, '"HOST","\\_foo","N/A","Ready"',
+         header, '"HOST","\\sub\\_bar","N/A","Ready"'])
+      mock = MagicMock(side_effect=lambda *args: iter(stdout.splitlines()))
+      with MockRestore(SchtasksBackend, '_schtasks_lines', mock):
+         tasks = SchtasksBackend().bulk_query()
+         self.assertEqual(list(tasks), ['_foo'])
+         self.assertEqual(tasks['_foo'].next_run_time, 'N/A')
+         self.assertEqual(
+            sorted(SchtasksBackend().bulk_query(top_lv_only=False)),
+            ['_bar', '_foo'])
+         self.assertEqual(SchtasksBackend().query('_foo').status, 'Ready')
+
+      err = subprocess.CalledProcessError(
+         1, 'schtasks', 'ERROR: The system cannot find the file specified.')
+      with MockRestore(SchtasksBackend, '_schtasks', MagicMock(side_effect=err)):
+         self.assertFalse(SchtasksBackend().delete('_foo'))
+      with MockRestore(SchtasksBackend, '_schtasks_lines',
+                       MagicMock(side_effect=err)):
+         self.assertEqual(SchtasksBackend().query('_foo'), ())
+
+   def test_schtasks_stream(self):
+      header = '"HostName","TaskName","Status"'
+      read = []
+
+      def lines():
+         for i in range(1000):
+            if i % 100 == 0:
+               read.append(header)
+               yield header
+            row = '"HOST","{}\\_foo{}","Ready"'.format(
+               '\\sub' if i % 2 else '', i)
+            read.append(row)
+            yield row
+
+      tasks = SchtasksBackend._iter_tasks(lines())
+      first = next(tasks)
+      self.assertEqual(first.task_name, '\\_foo0')
+      self.assertEqual(first._fields, ('host_name', 'task_name', 'status'))
+      self.assertEqual(len(read), 2)
+      self.assertEqual(len(list(tasks)), 499)
+      self.assertEqual(len(list(SchtasksBackend._iter_tasks(lines(), False))),
+                       1000)
+      self.assertEqual(list(SchtasksBackend._iter_tasks(iter([]))), [])
+
+   def test_task_type(self):
+      headers = ['HostName', 'TaskName', 'Status']
+      cls = task_type(headers)
+      self.assertIs(task_type(list(headers)), cls)
+      self.assertIs(task_type(['host_name', 'task_name', 'status']), cls)
+      self.assertEqual(cls._fields, ('host_name', 'task_name', 'status'))
+      self.assertEqual(cls.__slots__, ())
+      self.assertIsNot(task_type(['HostName', 'TaskName']), cls)
+      self.assertIs(task_type(TASK_FIELDS), Task)
+
+      lines = ['"HostName","TaskName","Status"', '"HOST","\\_foo","Ready"']
+      self.assertIs(type(next(SchtasksBackend._iter_tasks(lines))), cls)
+      self.assertEqual(snake_case('Repeat: Until: Time'), 'repeat_until_time')
+      self.assertEqual(snake_case('HostName'), 'host_name')
+
+   def test_task_table(self):
+      lines = ['"HostName","TaskName","Status","Author"']
+      for i in range(10000):
+         lines.append('"HOST","{}\\_foo{}","{}","me"'.format(
+            '\\sub' if i % 5 == 0 else '', i,
+            'Ready' if i % 2 else 'Running'))
+      table = TaskTable.from_rows(*SchtasksBackend._iter_rows(lines))
+      self.assertEqual(len(table), 8000)
+      self.assertEqual(table.fields,
+                       ('host_name', 'task_name', 'status', 'author'))
+      self.assertEqual(table[0], task_type(table.fields)(
+         'HOST', '\\_foo1', 'Ready', 'me'))
+      self.assertIs(table.column('status')[0], table.column('status')[2])
+      self.assertIs(table.column('author')[0], table.column('author')[1])
+
+      ready = table.where(status='Ready')
+      self.assertEqual(len(ready), 4000)
+      self.assertEqual(len(table.where(status='Ready', task_name='\\_foo1')),
+                       1)
+      self.assertEqual(
+         len(ready.where(task_name=lambda name: name.endswith('3'))), 1000)
+      self.assertEqual(ready.get('_foo2'), ())
+      self.assertEqual(ready.get('_foo3').status, 'Ready')
+      self.assertIn('_foo2', table)
+      self.assertEqual(list(ready.to_dict())[:2], ['_foo1', '_foo3'])
+
+      table = TaskTable.from_rows(*SchtasksBackend._iter_rows(lines),
+                                  fields=['status'])
+      self.assertEqual(table.fields, ('task_name', 'status'))
+      self.assertEqual(len(table.where(status='Running')), 4000)
+      with self.assertRaises(ValueError):
+         TaskTable.from_rows(*SchtasksBackend._iter_rows(lines),
+                             fields=['bogus'])
+
+      mock = MagicMock(side_effect=lambda *args: iter(lines))
+      with MockRestore(SchtasksBackend, '_schtasks_lines', mock):
+         self.assertEqual(len(SchtasksBackend().table(top_lv_only=False)),
+                          10000)
+      table = RecordingBackend().table()
+      self.assertEqual((len(table), table.fields), (0, TASK_FIELDS))
+
+   def test_in_process(self):
+      clock = FakeClock(datetime(2018, 1, 31, 9, 0, 30))
+      runs = []
+      backend = InProcessBackend(
+         runner=lambda cmd, cwd: runs.append((cmd, cwd)), clock=clock)
+      batpath = os.path.realpath(os.path.join('batcave', '_foo.bat'))
+      backend.create(self.settings(schedule='minute', modifier=2,
+                                   start_time='09:01'), batpath)
+
+      task = backend.query('_foo')
+      self.assertEqual(task.task_name, '\\_foo')
+      self.assertEqual(task.schedule_type, 'One Time Only, Minute ')
+      self.assertEqual(task.repeat_every, '0 Hour(s), 2 Minute(s)')
+      self.assertEqual(task.next_run_time, '01/31/2018 09:01:00 AM')
+      self.assertEqual(task.task_to_run, batpath)
+      self.assertEqual(list(backend.bulk_query()), ['_foo'])
+      self.assertEqual(backend.query('_bar'), ())
+
+      self.assertEqual(backend.run_pending(), [])
+      clock.advance(seconds=30)
+      self.assertEqual(backend.run_pending(), ['_foo'])
+      self.assertEqual(runs, [('python _foo.py', os.path.dirname(batpath))])
+      self.assertEqual(backend.run_pending(), [])
+      task = backend.query('_foo')
+      self.assertEqual(task.next_run_time, '01/31/2018 09:03:00 AM')
+      self.assertEqual(task.last_run_time, '01/31/2018 09:01:00 AM')
+      self.assertEqual(task.last_result, '0')
+
+      clock.advance(minutes=10)
+      self.assertEqual(backend.run_pending(), ['_foo'])
+      self.assertEqual(backend.query('_foo').next_run_time,
+                       '01/31/2018 09:13:00 AM')
+
+      backend.create(self.settings(name='_bar', schedule='onlogon',
+                                   working_dir='C:\\'), batpath)
+      self.assertEqual(backend.trigger('onlogon'), ['_bar'])
+      self.assertEqual(runs[-1], ('python _foo.py', 'C:\\'))
+
+      self.assertTrue(backend.delete('_foo'))
+      self.assertFalse(backend.delete('_foo'))
+      self.assertEqual(backend.query('_foo'), ())
+
+   def test_in_process_persistence(self):
+      clock = FakeClock(datetime(2018, 1, 31, 9, 0))
+      backend = InProcessBackend(
+         'backend_tasks.json', runner=lambda cmd, cwd: None, clock=clock)
+      backend.create(self.settings(schedule='daily', start_time='10:00'),
+                     None)
+      self.assertTrue(os.path.isfile('backend_tasks.json.log'))
+
+      loaded = InProcessBackend(
+         'backend_tasks.json', runner=lambda cmd, cwd: None, clock=clock)
+      self.assertEqual(loaded.bulk_query(), backend.bulk_query())
+      clock.advance(hours=1)
+      self.assertEqual(loaded.run_pending(), ['_foo'])
+      self.assertEqual(
+         InProcessBackend('backend_tasks.json', clock=clock).query(
+            '_foo').last_run_time,
+         '01/31/2018 10:00:00 AM')
+
+   def test_in_process_journal(self):
+      clock = FakeClock(datetime(2018, 1, 31, 9, 0))
+      backend = InProcessBackend(
+         'backend_tasks.json', runner=lambda cmd, cwd: None, clock=clock)
+      for i in range(50):
+         backend.create(self.settings(name="_foo{}".format(i)), None)
+      for i in range(0, 50, 2):
+         backend.delete("_foo{}".format(i))
+      self.assertFalse(os.path.isfile('backend_tasks.json'))
+      with open('backend_tasks.json.log', 'rb') as journal:
+         self.assertEqual(len(journal.read().splitlines()), 75)
+
+      with MockRestore(InProcessBackend, 'COMPACT_BYTES', 0):
+         backend.create(self.settings(name='_bar'), None)
+      self.assertTrue(os.path.isfile('backend_tasks.json'))
+      self.assertEqual(os.path.getsize('backend_tasks.json.log'), 0)
+      backend.delete('_foo1')
+      with open('backend_tasks.json.log', 'ab') as journal:
+         journal.write(b'["del", "_foo3')
+
+      loaded = InProcessBackend(
+         'backend_tasks.json', runner=lambda cmd, cwd: None, clock=clock)
+      self.assertEqual(sorted(loaded.bulk_query()),
+                       sorted(backend.bulk_query()))
+      self.assertEqual(len(loaded.bulk_query()), 25)
+      self.assertEqual(os.path.getsize('backend_tasks.json.log'), 0)
+      loaded.delete('_foo3')
+      self.assertNotIn('_foo3', InProcessBackend(
+         'backend_tasks.json', clock=clock).bulk_query())
+
+   def test_recording(self):
+      backend = RecordingBackend()
+      backend.create(self.settings(), 'C:\\batcave\\_foo.bat')
+      self.assertEqual(backend.query('_foo').task_name, '\\_foo')
+      self.assertEqual(list(backend.bulk_query()), ['_foo'])
+      self.assertTrue(backend.delete('_foo'))
+      self.assertFalse(backend.delete('_foo'))
+      self.assertEqual(backend.calls, [
+         ('create', '_foo'), ('query', '_foo'), ('bulk_query', True),
+         ('delete', '_foo'), ('delete', '_foo')])
+
+      backend = RecordingBackend({'create': OSError('boom')})
+      with self.assertRaises(OSError):
+         backend.create(self.settings(), None)
+
+   def test_in_process_weekly(self):
+      clock = FakeClock(datetime(2018, 1, 31, 9, 0))
+      backend = InProcessBackend(runner=lambda cmd, cwd: None, clock=clock)
+      backend.create(self.settings(schedule='weekly', start_time='10:00',
+                                   days=['MON', 'FRI']), None)
+      self.assertEqual(backend.query('_foo').next_run_time,
+                       '02/02/2018 10:00:00 AM')
+
+   def test_sched_backend(self):
+      Sched.gen_sched_settings_file(
+         'foo.json', name='_foo', run_cmd='python _foo.py',
+         schedule='quarterly')
+      backend = RecordingBackend()
+      s = Sched('foo.json', backend=backend)
+      self.assertFalse(s.is_scheduled())
+      s.schedule_task()
+      self.assertTrue(s.is_scheduled())
+      self.assertEqual(s.details().days, 'Every 92 day(s)')
+      self.assertEqual(backend.tasks['_foo'][0]['modifier'], 92)
+      self.assertTrue(Sched.is_task_scheduled('_foo', backend))
+      self.assertTrue(s.deschedule_task())
+      self.assertFalse(Sched.deschedule_task_with_taskname('_foo', backend))
+
+      saved = Sched._backend
+      try:
+         Sched.set_default_backend(backend)
+         Sched('foo.json').schedule_task()
+         self.assertTrue(Sched.is_task_scheduled('_foo'))
+      finally:
+         Sched.set_default_backend(saved)
+
+   def tearDown(self):
+      dammit.keep_fkn_trying(self.remove_files)
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,203 @@
+from lib.batcave import *
+from tests.test_helpers import MockRestore
+from glob import glob
+
+import unittest
+import json
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import time
+import lib
+import tests.test_helpers as dammit
+
+
+class BatcaveTest(unittest.TestCase):
+   """unit tests for Batcave"""
+
+   def remove_files(self):
+      if os.path.isdir('_batcave'):
+         shutil.rmtree('_batcave')
+
+   def setUp(self):
+      self.cave = Batcave('_batcave')
+
+   def test_put(self):
+      cave = self.cave
+      foo = cave.put('_foo', "@echo off\nfoo\n")
+      self.assertEqual(cave.put('_bar', "@echo off\nfoo\n"), foo)
+      self.assertEqual(os.path.dirname(os.path.dirname(foo)), cave.root)
+      self.assertEqual(os.path.basename(foo),
+                       Batcave.digest("@echo off\nfoo\n") + '.bat')
+      with open(foo) as script:
+         self.assertEqual(script.read(), "@echo off\nfoo\n")
+      self.assertEqual(cave.script('_foo'), foo)
+      self.assertIsNone(cave.script('_baz'))
+      self.assertIn('_bar', cave)
+      self.assertEqual(len(cave), 2)
+
+      bar = cave.put('_bar', "@echo off\nbar\n")
+      self.assertNotEqual(bar, foo)
+      self.assertTrue(os.path.isfile(foo))
+      cave.put('_foo', "@echo off\nbar\n")
+      self.assertFalse(os.path.isfile(foo))
+
+      other = Batcave('_batcave')
+      self.assertEqual(other.tasknames(), ['_foo', '_bar'])
+      self.assertEqual(other.script('_foo'), bar)
+
+   def test_journal(self):
+      cave = self.cave
+      journal = os.path.join('_batcave', Batcave.JOURNAL)
+      cave.put('_foo', "foo\n")
+      size = os.path.getsize(journal)
+      cave.put('_foo', "foo\n")
+      self.assertEqual(os.path.getsize(journal), size)
+      cave.put('_bar', "foo\n")
+      self.assertEqual(os.path.getsize(journal), 2 * size)
+      self.assertFalse(os.path.exists(
+         os.path.join('_batcave', Batcave.MANIFEST)))
+
+      cave.note('_foo', 'abc')
+      self.assertEqual(cave.fingerprint('_foo'), 'abc')
+      self.assertIsNone(cave.fingerprint('_bar'))
+      cave.note('_baz', 'abc')
+      self.assertNotIn('_baz', cave)
+      cave.put('_foo', "foo\n")
+      self.assertEqual(cave.fingerprint('_foo'), 'abc')
+      # a new script forgets the fingerprint noted for the old one
+      cave.put('_foo', "foo2\n")
+      self.assertIsNone(cave.fingerprint('_foo'))
+      self.assertIsNone(Batcave('_batcave').fingerprint('_foo'))
+      cave.note('_foo', 'def')
+      self.assertEqual(Batcave('_batcave').fingerprint('_foo'), 'def')
+
+      with MockRestore(Batcave, 'COMPACT_BYTES', 0):
+         cave.put('_baz', "baz\n")
+      self.assertEqual(os.path.getsize(journal), 0)
+      with open(os.path.join('_batcave', Batcave.MANIFEST)) as fp:
+         self.assertEqual(sorted(json.load(fp)['tasks']),
+                          ['_bar', '_baz', '_foo'])
+      other = Batcave('_batcave')
+      self.assertEqual(other.tasknames(), cave.tasknames())
+      self.assertEqual(other.fingerprint('_foo'), 'def')
+      cave.remove('_bar')
+      self.assertEqual(sorted(other.tasknames()), ['_baz', '_foo'])
+
+   def test_concurrent_batches(self):
+      # two Batcaves on one directory stand in for two processes
+      cave, other = self.cave, Batcave('_batcave')
+      shared = cave.put('_shared', "shared\n")
+      with cave.batch():
+         cave.put('_foo', "foo\n")
+         cave.remove('_shared')
+         with other.batch():
+            other.put('_bar', "shared\n")
+            other.put('_baz', "baz\n")
+      self.assertTrue(os.path.isfile(shared))
+      for c in [cave, other, Batcave('_batcave')]:
+         self.assertEqual(sorted(c.tasknames()), ['_bar', '_baz', '_foo'])
+         self.assertEqual(c.script('_bar'), shared)
+      self.assertEqual(cave.gc(), 0)
+      self.assertTrue(os.path.isfile(shared))
+
+      other.remove('_bar')
+      self.assertFalse(os.path.isfile(shared))
+      self.assertEqual(cave.script('_bar'), None)
+
+   def test_remove(self):
+      cave = self.cave
+      foo = cave.put('_foo', "foo\n")
+      cave.put('_bar', "foo\n")
+      self.assertTrue(cave.remove('_foo'))
+      self.assertFalse(cave.remove('_foo'))
+      self.assertTrue(os.path.isfile(foo))
+      self.assertTrue(cave.remove('_bar'))
+      self.assertFalse(os.path.isfile(foo))
+      self.assertEqual(len(Batcave('_batcave')), 0)
+
+   def test_gc(self):
+      cave = self.cave
+      foo = cave.put('_foo', "foo\n")
+      orphan = cave.path(Batcave.digest("orphan\n"))
+      os.makedirs(os.path.dirname(orphan), exist_ok=True)
+      with open(orphan, 'w') as script:
+         script.write("orphan\n")
+      legacy = os.path.join('_batcave', '_legacy.bat')
+      with open(legacy, 'w') as script:
+         script.write("legacy\n")
+
+      self.assertEqual(cave.gc(), 1)
+      self.assertFalse(os.path.exists(orphan))
+      self.assertTrue(os.path.isfile(foo))
+      self.assertTrue(os.path.isfile(legacy))
+      if os.path.dirname(orphan) != os.path.dirname(foo):
+         self.assertFalse(os.path.exists(os.path.dirname(orphan)))
+      self.assertEqual(cave.gc(), 0)
+
+   def test_other_process(self):
+      cave = self.cave
+      cave.put('_foo', "foo\n")
+      other = Batcave('_batcave')
+      other.put('_bar', "bar\n")
+      time.sleep(0.01)
+      other.remove('_foo')
+      self.assertEqual(cave.tasknames(), ['_bar'])
+
+      shutil.rmtree('_batcave')
+      path = cave.put('_bar', "bar\n")
+      self.assertTrue(os.path.isfile(path))
+      self.assertEqual(cave.tasknames(), ['_bar'])
+
+   def test_processes(self):
+      script = ("from lib.batcave import Batcave\n"
+                "import sys\n"
+                "cave = Batcave('_batcave')\n"
+                "for i in range(100):\n"
+                "   cave.put('_{0}{1}'.format(sys.argv[1], i),\n"
+                "            'run {0}'.format(i % 7))\n"
+                "   if i % 2:\n"
+                "      cave.remove('_{0}{1}'.format(sys.argv[1], i - 1))\n")
+      env = dict(os.environ, PYTHONPATH=lib.ROOT_PATH)
+      procs = [subprocess.Popen([sys.executable, '-c', script, str(n)],
+                                env=env)
+               for n in range(4)]
+      for proc in procs:
+         self.assertEqual(proc.wait(), 0)
+      self.assertEqual(len(self.cave), 200)
+      self.assertEqual(self.cave.gc(), 0)
+      self.assertEqual(len(glob(os.path.join('_batcave', '*', '*.bat'))), 7)
+
+   def test_open_and_home(self):
+      self.assertIs(Batcave.open('_batcave'), Batcave.open(
+         os.path.join('.', '_batcave')))
+      path = self.cave.put('_foo', "foo\n")
+      self.assertEqual(Batcave.home(path), self.cave.root)
+      self.assertEqual(Batcave.home(os.path.join('C:', 'bat', '_foo.bat')),
+                       os.path.join('C:', 'bat'))
+
+   def test_many(self):
+      cave = self.cave
+      with cave.batch():
+         paths = set(cave.put("_task{}".format(i),
+                              "@echo off\nrun {}\n".format(i % 500))
+                     for i in range(20000))
+      self.assertEqual(len(paths), 500)
+      self.assertEqual(len(Batcave('_batcave')), 20000)
+      shards = [d for d in os.listdir('_batcave')
+                if os.path.isdir(os.path.join('_batcave', d))]
+      self.assertTrue(all(len(os.listdir(os.path.join('_batcave', d))) < 20
+                          for d in shards))
+      with cave.batch():
+         for i in range(0, 20000, 2):
+            cave.remove("_task{}".format(i))
+      self.assertEqual(len(Batcave('_batcave')), 10000)
+      self.assertEqual(cave.gc(), 0)
+
+   def tearDown(self):
+      dammit.keep_fkn_trying(self.remove_files)
+
+if __name__ == '__main__':
+   unittest.main()
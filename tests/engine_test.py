@@ -0,0 +1,278 @@
+from lib.engine import *
+from lib.custom_exceptions import *
+from tests.test_helpers import FakeClock, task_settings
+from datetime import datetime, timedelta
+
+import unittest
+import time
+
+
+class FakeProc:
+   """stand-in for the subprocess.Popen object of a fired command"""
+
+   def __init__(self):
+      self.returncode = None
+
+   def poll(self):
+      return self.returncode
+
+
+class EngineTest(unittest.TestCase):
+   """unit tests for Engine and the recurrence helpers"""
+
+   def settings(self, **settings):
+      return task_settings(**settings)
+
+   def test_start_datetime(self):
+      created = datetime(2018, 3, 4, 5, 6, 7)
+      self.assertEqual(start_datetime(self.settings(), created),
+                       datetime(2018, 3, 4, 5, 7))
+      self.assertEqual(
+         start_datetime(self.settings(), datetime(2018, 3, 4, 5, 6)),
+         datetime(2018, 3, 4, 5, 6))
+      self.assertEqual(
+         start_datetime(self.settings(), datetime(2018, 3, 4, 23, 59, 1)),
+         datetime(2018, 3, 5, 0, 0))
+      self.assertEqual(list(fire_times(self.settings(), after=created)),
+                       [datetime(2018, 3, 4, 5, 7)])
+      self.assertEqual(
+         start_datetime(self.settings(start_time='23:59',
+                                      start_date='01\\31\\2018'), created),
+         datetime(2018, 1, 31, 23, 59))
+
+   def test_next_fire(self):
+      start = datetime(2018, 1, 31, 9, 30)
+      s = self.settings(schedule='once')
+      self.assertEqual(next_fire(s, start, start), start)
+      self.assertIsNone(next_fire(s, start, start + timedelta(seconds=1)))
+
+      s = self.settings(schedule='minute', modifier=15)
+      self.assertEqual(next_fire(s, start, datetime(2018, 1, 1)), start)
+      self.assertEqual(next_fire(s, start, datetime(2018, 1, 31, 9, 31)),
+                       datetime(2018, 1, 31, 9, 45))
+      self.assertEqual(next_fire(s, start, datetime(2018, 1, 31, 9, 45)),
+                       datetime(2018, 1, 31, 9, 45))
+
+      s = self.settings(schedule='hourly', modifier=5)
+      self.assertEqual(next_fire(s, start, datetime(2018, 2, 1)),
+                       datetime(2018, 2, 1, 0, 30))
+
+      s = self.settings(schedule='daily', modifier=92,
+                        end_date='05\\03\\2018')
+      self.assertEqual(next_fire(s, start, start + timedelta(minutes=1)),
+                       start + timedelta(days=92))
+      self.assertIsNone(next_fire(s, start, start + timedelta(days=93)))
+      self.assertEqual(
+         next_fire(self.settings(schedule='quarterly'), start,
+                   start + timedelta(minutes=1)),
+         start + timedelta(days=92))
+
+      self.assertIsNone(next_fire(self.settings(schedule='onlogon'),
+                                  start, start))
+      with self.assertRaises(ValueError):
+         next_fire(self.settings(schedule='daily', modifier='LAST'),
+                   start, start)
+
+   def test_next_fire_weekly(self):
+      # a Wednesday
+      start = datetime(2018, 1, 31, 9, 30)
+      s = self.settings(schedule='weekly')
+      self.assertEqual(next_fire(s, start, start), start)
+      self.assertEqual(next_fire(s, start, start + timedelta(minutes=1)),
+                       datetime(2018, 2, 7, 9, 30))
+
+      s = self.settings(schedule='weekly', days=['FRI', 'MON'], modifier=2)
+      after = start
+      fires = []
+      for i in range(5):
+         after = next_fire(s, start, after)
+         fires.append(after.date())
+         after += timedelta(seconds=1)
+      self.assertEqual(fires, [
+         datetime(2018, 2, 2).date(), datetime(2018, 2, 12).date(),
+         datetime(2018, 2, 16).date(), datetime(2018, 2, 26).date(),
+         datetime(2018, 3, 2).date()])
+
+   def test_next_fire_monthly(self):
+      start = datetime(2018, 1, 15, 8, 0)
+      s = self.settings(schedule='monthly')
+      self.assertEqual(next_fire(s, start, start), datetime(2018, 2, 1, 8, 0))
+      s = self.settings(schedule='monthly', modifier=5)
+      self.assertEqual(next_fire(s, start, start), datetime(2018, 6, 1, 8, 0))
+      self.assertEqual(next_fire(s, start, datetime(2018, 6, 1, 8, 1)),
+                       datetime(2018, 11, 1, 8, 0))
+      s = self.settings(schedule='monthly', months=['MAR', 'JAN'])
+      self.assertEqual(next_fire(s, start, start), datetime(2018, 3, 1, 8, 0))
+      self.assertEqual(next_fire(s, start, datetime(2018, 3, 2)),
+                       datetime(2019, 1, 1, 8, 0))
+
+      s = self.settings(schedule='monthly', modifier='LASTDAY',
+                        months=['FEB', 'APR'])
+      self.assertEqual(next_fire(s, start, start),
+                       datetime(2018, 2, 28, 8, 0))
+      self.assertEqual(next_fire(s, start, datetime(2018, 3, 1)),
+                       datetime(2018, 4, 30, 8, 0))
+      self.assertEqual(next_fire(s, start, datetime(2019, 5, 1)),
+                       datetime(2020, 2, 29, 8, 0))
+      s = self.settings(schedule='monthly', modifier='LASTDAY')
+      self.assertEqual(next_fire(s, start, datetime(2018, 2, 28, 9, 0)),
+                       datetime(2018, 3, 31, 8, 0))
+
+      # the 15th of January 2018 is its third Monday
+      s = self.settings(schedule='monthly', modifier='THIRD')
+      self.assertEqual(next_fire(s, start, start), start)
+      s = self.settings(schedule='monthly', modifier='FIRST')
+      self.assertEqual(next_fire(s, start, start),
+                       datetime(2018, 2, 5, 8, 0))
+      s = self.settings(schedule='monthly', modifier='SECOND',
+                        days=['SUN', 'FRI'])
+      self.assertEqual(next_fire(s, start, start),
+                       datetime(2018, 2, 9, 8, 0))
+      self.assertEqual(next_fire(s, start, datetime(2018, 2, 10)),
+                       datetime(2018, 2, 11, 8, 0))
+      s = self.settings(schedule='monthly', modifier='FOURTH', days=['THU'],
+                        months=['MAR'])
+      self.assertEqual(next_fire(s, start, start),
+                       datetime(2018, 3, 22, 8, 0))
+      s = self.settings(schedule='monthly', modifier='LAST', days=['WED'],
+                        end_date='05\\31\\2018')
+      self.assertEqual(next_fire(s, start, start),
+                       datetime(2018, 1, 31, 8, 0))
+      self.assertEqual(next_fire(s, start, datetime(2018, 2, 1)),
+                       datetime(2018, 2, 28, 8, 0))
+      self.assertEqual(next_fire(s, start, datetime(2018, 5, 1)),
+                       datetime(2018, 5, 30, 8, 0))
+      self.assertIsNone(next_fire(s, start, datetime(2018, 5, 31)))
+      with self.assertRaises(ValueError):
+         next_fire(self.settings(schedule='monthly', modifier='FIFTH'),
+                   start, start)
+
+   def test_fire_times(self):
+      start = datetime(2018, 1, 31, 9, 30)
+      s = self.settings(schedule='hourly', modifier=6)
+      self.assertEqual(list(fire_times(s, start, start, 3)), [
+         start, datetime(2018, 1, 31, 15, 30), datetime(2018, 1, 31, 21, 30)])
+      self.assertEqual(
+         list(fire_times(self.settings(schedule='quarterly'), start, start,
+                         count=3)),
+         [start, start + timedelta(days=92), start + timedelta(days=184)])
+      self.assertEqual(list(fire_times(self.settings(), start, start)),
+                       [start])
+      self.assertEqual(list(fire_times(self.settings(schedule='onidle'),
+                                       start, start, 3)), [])
+      self.assertEqual(
+         list(fire_times(self.settings(schedule='daily', start_time='10:00'),
+                         after=start, count=2)),
+         [datetime(2018, 1, 31, 10, 0), datetime(2018, 2, 1, 10, 0)])
+
+   def test_merge_fire_times(self):
+      after = datetime(2018, 1, 31, 0, 0)
+      tasks = [self.settings(name='daily', schedule='daily',
+                             start_time='12:00'),
+               (self.settings(name='hourly', schedule='hourly', modifier=8),
+                after),
+               self.settings(name='once', start_time='12:00'),
+               self.settings(name='logon', schedule='onlogon')]
+      self.assertEqual(
+         list(merge_fire_times(tasks, after, after + timedelta(days=1))), [
+            (datetime(2018, 1, 31, 0, 0), 'hourly'),
+            (datetime(2018, 1, 31, 8, 0), 'hourly'),
+            (datetime(2018, 1, 31, 12, 0), 'daily'),
+            (datetime(2018, 1, 31, 12, 0), 'once'),
+            (datetime(2018, 1, 31, 16, 0), 'hourly')])
+
+      tasks = [self.settings(name=str(i), schedule='minute', modifier=60,
+                             start_time="00:{:02}".format(i % 60))
+               for i in range(3000)]
+      fires = list(merge_fire_times(tasks, after, after + timedelta(days=1)))
+      self.assertEqual(len(fires), 3000 * 24)
+      self.assertEqual(fires, sorted(fires, key=lambda f: f[0]))
+      self.assertEqual(fires[:2], [(after, '0'), (after, '60')])
+
+   def test_engine(self):
+      clock = FakeClock(datetime(2018, 1, 31, 9, 0))
+      procs = {}
+
+      def runner(cmd, cwd):
+         procs[cmd] = FakeProc()
+         return procs[cmd]
+
+      engine = Engine(runner, clock)
+      engine.add(self.settings(name='a', run_cmd='a', schedule='minute',
+                               modifier=10, start_time='09:05'))
+      engine.add(self.settings(name='b', run_cmd='b', schedule='once',
+                               start_time='09:02'))
+      engine.add(self.settings(name='c', run_cmd='c', schedule='onidle'))
+      self.assertEqual(len(engine), 3)
+      self.assertEqual(engine.due(), datetime(2018, 1, 31, 9, 2).timestamp())
+      self.assertEqual(engine.run_pending(), [])
+
+      clock.advance(minutes=5)
+      self.assertEqual(engine.run_pending(), ['b', 'a'])
+      self.assertTrue(engine.get('a').running)
+      self.assertIsNone(engine.get('b').next_run)
+      self.assertEqual(engine.get('a').next_run, datetime(2018, 1, 31, 9, 15))
+
+      procs['a'].returncode = 3
+      engine.reap()
+      self.assertFalse(engine.get('a').running)
+      self.assertEqual(engine.get('a').last_result, 3)
+
+      engine.add(self.settings(name='a', run_cmd='a', schedule='once',
+                               start_time='09:20'))
+      clock.advance(minutes=10)
+      self.assertEqual(engine.run_pending(), [])
+      clock.advance(minutes=5)
+      self.assertEqual(engine.run_pending(), ['a'])
+      self.assertIsNone(engine.due())
+
+      self.assertEqual(engine.trigger('onidle'), ['c'])
+      self.assertTrue(engine.remove('c'))
+      self.assertFalse(engine.remove('c'))
+      self.assertEqual(engine.trigger('onidle'), [])
+
+   def test_forecast(self):
+      clock = FakeClock(datetime(2018, 1, 31, 9, 0))
+      engine = Engine(lambda cmd, cwd: None, clock)
+      engine.add(self.settings(name='a', schedule='daily', start_time='08:00'))
+      engine.add(self.settings(name='b', schedule='monthly',
+                               modifier='LASTDAY', start_time='10:00'))
+      self.assertEqual(
+         list(engine.forecast(datetime(2018, 2, 2))), [
+            (datetime(2018, 1, 31, 10, 0), 'b'),
+            (datetime(2018, 2, 1, 8, 0), 'a')])
+      clock.advance(hours=2)
+      self.assertEqual(engine.run_pending(), ['b'])
+      self.assertEqual(engine.get('b').next_run, datetime(2018, 2, 28, 10, 0))
+
+   def test_engine_many(self):
+      clock = FakeClock(datetime(2018, 1, 31, 0, 0))
+      fired = []
+      engine = Engine(lambda cmd, cwd: None, clock, on_fire=fired.extend)
+      for i in range(100000):
+         engine.add(self.settings(
+            name=str(i), schedule='daily', start_time="{:02}:{:02}".format(
+               i // 60 % 24, i % 60)))
+      for i in range(0, 100000, 2):
+         engine.remove(str(i))
+      self.assertEqual(len(engine), 50000)
+
+      clock.advance(hours=1)
+      self.assertEqual(len(engine.run_pending()), 30 * 70)
+      clock.advance(days=1)
+      self.assertEqual(len(engine.run_pending()), 50000)
+      self.assertEqual(len(fired), 50000 + 30 * 70)
+
+   def test_engine_thread(self):
+      engine = Engine(lambda cmd, cwd: None)
+      engine.start(poll_s=0.01)
+      try:
+         engine.add(self.settings(schedule='onstart'))
+         engine.add(self.settings(
+            name='_bar', schedule='once',
+            start_time=time.strftime('%H:%M')))
+      finally:
+         engine.stop()
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,67 @@
+"""stand-in for schtasks so SchtasksBackend can be tested where schtasks
+doesn't exist. It understands /create, /delete and /query the way
+SchtasksBackend calls them and keeps the tasks in the json file named by
+the FAKE_SCHTASKS environment variable, fake_schtasks.json by default,
+along with the argument list each task was created with.
+"""
+
+import csv
+import json
+import os
+import sys
+
+NOT_FOUND = 'ERROR: The system cannot find the file specified.'
+HEADERS = ['HostName', 'TaskName', 'Next Run Time', 'Status', 'Task To Run']
+VALUED = ['/tr', '/st', '/sc', '/mo', '/d', '/m', '/i', '/sd', '/ed', '/tn',
+          '/fo']
+
+
+def options(argv):
+   """return a dictionary of the options in argument list |argv| to their
+   value, or True for a flag without one
+   """
+
+   opts = {}
+   args = iter(argv)
+   for arg in args:
+      opts[arg] = next(args) if arg in VALUED else True
+   return opts
+
+
+def main(argv):
+   path = os.environ.get('FAKE_SCHTASKS', 'fake_schtasks.json')
+   tasks = {}
+   if os.path.isfile(path):
+      with open(path) as fp:
+         tasks = json.load(fp)
+   opts = options(argv)
+   name = opts.get('/tn')
+
+   if argv[0] == '/create':
+      tasks[name] = argv
+   elif argv[0] == '/delete':
+      if tasks.pop(name, None) is None:
+         print(NOT_FOUND)
+         return 1
+   elif argv[0] == '/query':
+      if name is not None and name not in tasks:
+         print(NOT_FOUND)
+         return 1
+      writer = csv.writer(sys.stdout, quoting=csv.QUOTE_ALL)
+      writer.writerow(HEADERS)
+      for taskname, task in tasks.items():
+         if name is None or taskname == name:
+            writer.writerow(['HOST', '\\' + taskname, 'N/A', 'Ready',
+                             options(task)['/tr']])
+      return 0
+   else:
+      print('ERROR: Invalid argument/option - {}'.format(argv[0]))
+      return 1
+
+   with open(path, 'w') as fp:
+      json.dump(tasks, fp)
+   print('SUCCESS')
+   return 0
+
+if __name__ == '__main__':
+   sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,128 @@
+from lib.helpers import *
+
+import unittest
+import asyncio
+
+
+class FakeTime:
+   """clock and sleep of a RetryPolicy that only pretend to wait"""
+
+   def __init__(self):
+      self.now = 0
+      self.sleeps = []
+
+   def clock(self):
+      return self.now
+
+   def sleep(self, sec):
+      self.sleeps.append(sec)
+      self.now += sec
+
+
+class Flaky:
+   """callable raising |error| the first |failures| times it's called"""
+
+   def __init__(self, failures, error=OSError('busy')):
+      self.failures = failures
+      self.error = error
+      self.calls = 0
+
+   def __call__(self, *args, **kwargs):
+      self.calls += 1
+      if self.calls <= self.failures:
+         raise self.error
+      return args, kwargs
+
+
+class HelpersTest(unittest.TestCase):
+   """unit tests for RetryPolicy and keep_fkn_trying"""
+
+   def policy(self, **kwargs):
+      self.time = FakeTime()
+      return RetryPolicy(clock=self.time.clock, sleep=self.time.sleep,
+                         **kwargs)
+
+   def test_backoff(self):
+      policy = self.policy(max_attempts=6, base_sec=1, max_sec=10,
+                           jitter=False)
+      self.assertEqual(policy.call(Flaky(5), 1, b=2), ((1,), {'b': 2}))
+      self.assertEqual(self.time.sleeps, [1, 2, 4, 8, 10])
+
+      policy = self.policy(max_attempts=3, base_sec=1, rand=lambda: 0.5)
+      self.assertEqual([policy.delay(n) for n in range(3)], [0.5, 1, 2])
+
+   def test_no_sleep_after_last_attempt(self):
+      policy = self.policy(max_attempts=3, base_sec=1, jitter=False)
+      flaky = Flaky(5)
+      with self.assertRaises(OSError):
+         policy.call(flaky)
+      self.assertEqual(flaky.calls, 3)
+      self.assertEqual(self.time.sleeps, [1, 2])
+
+   def test_retryable(self):
+      policy = self.policy()
+      flaky = Flaky(5, FileNotFoundError('no such dir'))
+      with self.assertRaises(FileNotFoundError):
+         policy.call(flaky)
+      self.assertEqual((flaky.calls, self.time.sleeps), (1, []))
+
+      policy = self.policy(retryable=lambda err: isinstance(err, KeyError),
+                           jitter=False)
+      self.assertTrue(policy.call(Flaky(2, KeyError('x'))))
+      self.assertEqual(len(self.time.sleeps), 2)
+      self.assertFalse(is_transient(ValueError()))
+      self.assertTrue(is_transient(PermissionError()))
+
+   def test_deadline(self):
+      policy = self.policy(max_attempts=100, base_sec=1, jitter=False,
+                           deadline_sec=10)
+      flaky = Flaky(100)
+      with self.assertRaises(OSError):
+         policy.call(flaky)
+      self.assertEqual(self.time.sleeps, [1, 2, 4])
+      self.assertEqual(flaky.calls, 4)
+
+   def test_metrics(self):
+      policy = self.policy(max_attempts=3, jitter=False)
+      policy.call(Flaky(0))
+      policy.call(Flaky(2))
+      with self.assertRaises(OSError):
+         policy.call(Flaky(3))
+      m = policy.metrics
+      self.assertEqual((m.calls, m.attempts, m.retries, m.failures),
+                       (3, 7, 4, 1))
+      self.assertEqual(m.sleep_sec, 6)
+      self.assertEqual(m.elapsed_sec, 6)
+      policy.reset_metrics()
+      self.assertEqual(policy.metrics.calls, 0)
+
+   def test_async(self):
+      policy = RetryPolicy(max_attempts=3, base_sec=0)
+      calls = []
+
+      async def flaky(x):
+         calls.append(x)
+         if len(calls) < 3:
+            raise OSError('busy')
+         return x
+
+      self.assertEqual(asyncio.run(policy.acall(flaky, 7)), 7)
+      self.assertEqual(calls, [7, 7, 7])
+      policy.max_attempts = 2
+      calls.clear()
+      with self.assertRaises(OSError):
+         asyncio.run(policy.acall(flaky, 8))
+      self.assertEqual((policy.metrics.calls, policy.metrics.failures),
+                       (2, 1))
+
+   def test_keep_fkn_trying(self):
+      flaky = Flaky(2, PermissionError('locked'))
+      keep_fkn_trying(flaky, [1], {'b': 2}, interval_sec=0)
+      self.assertEqual(flaky.calls, 3)
+      flaky = Flaky(5, FileNotFoundError('no such dir'))
+      with self.assertRaises(FileNotFoundError):
+         keep_fkn_trying(flaky)
+      self.assertEqual(flaky.calls, 1)
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,91 @@
+from lib.inventory import TaskInventory
+from lib.backends import RecordingBackend
+from lib.sched import Sched
+from tests.test_helpers import task_settings
+
+import unittest
+import os
+import shutil
+
+
+class TaskInventoryTest(unittest.TestCase):
+   """unit tests for TaskInventory"""
+
+   def settings(self, name):
+      return task_settings(name=name, schedule='daily')
+
+   def setUp(self):
+      self.now = 0
+      self.backend = RecordingBackend()
+      for i in range(3):
+         self.backend.create(self.settings("_foo{}".format(i)), None)
+      self.backend.calls.clear()
+      self.inventory = TaskInventory(
+         self.backend, ttl=10, clock=lambda: self.now)
+
+   def bulk_queries(self):
+      return sum(1 for c in self.backend.calls if c[0] == 'bulk_query')
+
+   def test_lookups(self):
+      for i in range(1000):
+         self.assertTrue(self.inventory.get("_foo{}".format(i % 3)))
+         self.assertIn("_foo{}".format(i % 3), self.inventory)
+      self.assertEqual(self.inventory.get('_bar'), ())
+      self.assertEqual(self.inventory.query('_foo0').task_name, '\\_foo0')
+      self.assertEqual(sorted(self.inventory.bulk_query()),
+                       ['_foo0', '_foo1', '_foo2'])
+      self.assertEqual(self.bulk_queries(), 1)
+      self.assertEqual([c for c in self.backend.calls if c[0] == 'query'], [])
+
+   def test_ttl_and_refresh(self):
+      self.inventory.get('_foo0')
+      self.backend.create(self.settings('_bar'), None)
+      self.now = 9
+      self.assertEqual(self.inventory.get('_bar'), ())
+      self.now = 10
+      self.assertTrue(self.inventory.get('_bar'))
+      self.assertEqual(self.bulk_queries(), 2)
+
+      self.backend.delete('_bar')
+      self.assertTrue(self.inventory.get('_bar'))
+      self.inventory.refresh()
+      self.assertEqual(self.inventory.get('_bar'), ())
+      self.assertEqual(self.bulk_queries(), 3)
+
+   def test_invalidation(self):
+      self.assertEqual(self.inventory.get('_bar'), ())
+      self.inventory.create(self.settings('_bar'), None)
+      self.assertTrue(self.inventory.get('_bar'))
+      self.assertEqual(self.bulk_queries(), 2)
+
+      self.assertTrue(self.inventory.delete('_bar'))
+      self.assertEqual(self.inventory.get('_bar'), ())
+      self.assertFalse(self.inventory.delete('_bar'))
+      self.assertEqual(self.bulk_queries(), 2)
+
+      self.backend.errors['create'] = OSError()
+      with self.assertRaises(OSError):
+         self.inventory.create(self.settings('_bar'), None)
+      self.inventory.get('_bar')
+      self.assertEqual(self.bulk_queries(), 3)
+
+   def test_sched(self):
+      Sched.gen_sched_settings_file(
+         '_foo.json', name='_foo', run_cmd='python _foo.py',
+         schedule='daily')
+      try:
+         scheds = [Sched('_foo.json', backend=self.inventory)
+                   for i in range(100)]
+         self.assertFalse(any(s.is_scheduled() for s in scheds))
+         scheds[0].schedule_task()
+         self.assertTrue(all(s.is_scheduled() for s in scheds))
+         self.assertEqual(self.bulk_queries(), 2)
+      finally:
+         os.remove('_foo.json')
+         if os.path.isdir('batcave'):
+            shutil.rmtree('batcave')
+         if os.path.isfile("batcave\\_foo.bat"):
+            os.remove("batcave\\_foo.bat")
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,51 @@
+from lib.jsonstream import ObjectStream
+
+import unittest
+import io
+import json
+
+
+class ObjectStreamTest(unittest.TestCase):
+   """unit tests for ObjectStream"""
+
+   def items(self, text, chunk_size=4):
+      return list(ObjectStream(io.StringIO(text), chunk_size))
+
+   def test_items(self):
+      doc = {'foo': 12345, 'bar': 'a "quoted" é string', 'baz': None,
+             'mu': [1.5, True, False, {'nu': [[], {}]}], 'xi': {'a': -1e10},
+             '': 0}
+      text = json.dumps(doc, indent=3)
+      for chunk_size in [1, 2, 3, 7, 64, 65536]:
+         self.assertEqual(self.items(text, chunk_size), list(doc.items()))
+      self.assertEqual(self.items(json.dumps(doc, separators=(',', ':')), 1),
+                       list(doc.items()))
+      self.assertEqual(self.items(' { } \n'), [])
+      self.assertEqual(self.items('{"a": 1, "a": 2}'), [('a', 1), ('a', 2)])
+
+   def test_numbers(self):
+      doc = {'a': 1.25, 'b': -12.5e-3, 'c': 12e5, 'd': -7, 'e': 1E+2,
+             'f': [0.5, -0.25, 3e1], 'g': 123456789}
+      for separators in [(', ', ': '), (',', ':')]:
+         text = json.dumps(doc, separators=separators)
+         for chunk_size in [1, 2, 3, 4, 5, 8, 13]:
+            self.assertEqual(self.items(text, chunk_size), list(doc.items()))
+      for text, value in [('{"a":1.25}', 1.25), ('{"a":12e3}', 12e3),
+                          ('{"a":-1}', -1), ('{"a": 1.5e-2 }', 1.5e-2)]:
+         for chunk_size in range(1, len(text) + 1):
+            self.assertEqual(self.items(text, chunk_size), [('a', value)])
+
+   def test_errors(self):
+      for text in ['', '[]', '{"a" 1}', '{"a": 1,}', '{"a": 1} x', '{a: 1}',
+                   '{"a": [1, 2}', '{"a": "b', '{"a": 1']:
+         with self.assertRaises(json.JSONDecodeError):
+            self.items(text)
+
+   def test_lazy(self):
+      stream = iter(ObjectStream(io.StringIO('{"a": 1, "b": [1, 2'), 2))
+      self.assertEqual(next(stream), ('a', 1))
+      with self.assertRaises(json.JSONDecodeError):
+         next(stream)
+
+if __name__ == '__main__':
+   unittest.main()
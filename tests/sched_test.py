@@ -1,4 +1,6 @@
-from lib.sched import Sched
+from lib.sched import Sched, DescheduleResult, ScheduleResult
+from lib.backends import RecordingBackend, InProcessBackend
+from lib.batcave import Batcave
 from lib.custom_exceptions import *
 from datetime import datetime, timedelta
 from glob import glob
@@ -156,13 +158,14 @@ class SchedTest(unittest.TestCase):
       s = Sched('foo.json', 'batcave')
       batpath = s._create_bat()
       self.assertEqual(
-         batpath,
-         os.path.realpath(os.path.join(os.getcwd(), 'batcave', '_foo.bat')))
+         os.path.dirname(os.path.dirname(batpath)),
+         os.path.realpath(os.path.join(os.getcwd(), 'batcave')))
+      self.assertEqual(s._cave().script('_foo'), batpath)
 
-      with open("batcave\\_foo.bat", 'r') as foobat:
+      with open(batpath, 'r') as foobat:
          buf = [l.rstrip() for l in foobat.readlines()]
          self.assertEqual(buf[0], '@echo off')
-         self.assertEqual(buf[1], 'cd /d %~dp0')
+         self.assertEqual(buf[1], 'cd /d %~dp0..')
          self.assertEqual(buf[2], 'start /min python _foo.py')
          self.assertEqual(len(buf), 3)
 
@@ -175,9 +178,11 @@ class SchedTest(unittest.TestCase):
          start_time='00:00',
          schedule='once')
       s = Sched('foo.json', 'batcave')
-      s._create_bat()
+      old_batpath, batpath = batpath, s._create_bat()
+      self.assertNotEqual(batpath, old_batpath)
+      self.assertFalse(os.path.isfile(old_batpath))
 
-      with open("batcave/_foo.bat", 'r') as foobat:
+      with open(batpath, 'r') as foobat:
          buf = [l.rstrip() for l in foobat.readlines()]
          self.assertEqual(buf[0], '@echo off')
          self.assertEqual(buf[1], "cd /d {}".format(os.environ['USERPROFILE']))
@@ -510,3 +515,274 @@ class SchedTest(unittest.TestCase):
       except subprocess.CalledProcessError as cpe:
          if cpe.returncode == 1:
             pass
+
+
+class SchedBatchTest(unittest.TestCase):
+   """unit tests for scheduling many tasks at once, against a
+   RecordingBackend so they don't need schtasks
+   """
+
+   def remove_files(self):
+      with os.scandir() as files:
+         for f in files:
+            if f.name.startswith('_batch') or \
+               f.name.startswith('batcave\\_batch'):
+               os.remove(f.name)
+      if os.path.isdir('batcave'):
+         shutil.rmtree('batcave')
+
+   def setUp(self):
+      for i in range(5):
+         Sched.gen_sched_settings_file(
+            "_batch{}.json".format(i),
+            name="_batch{}".format(i),
+            run_cmd='python _foo.py',
+            schedule='daily')
+      Sched.gen_sched_settings_file(
+         '_batch_bad.json', name='_batch_bad', run_cmd='python _foo.py',
+         schedule='dailyy')
+
+   def test_schedule_many(self):
+      files = ["_batch{}.json".format(i) for i in range(5)]
+      files.insert(2, '_batch_bad.json')
+      files.append('_batch_missing.json')
+      backend = RecordingBackend()
+      results = Sched.schedule_many(files, concurrency=3, backend=backend)
+
+      self.assertEqual([r.source for r in results], files)
+      self.assertEqual(
+         [r.taskname for r in results if r.error is None],
+         ["_batch{}".format(i) for i in range(5)])
+      self.assertIsInstance(results[2].error, InvalidSettingError)
+      self.assertIsInstance(results[-1].error, FileNotFoundError)
+      self.assertEqual(sorted(backend.tasks),
+                       ["_batch{}".format(i) for i in range(5)])
+      self.assertTrue(os.path.isdir('batcave'))
+      batpaths = set(batpath for settings, batpath in backend.tasks.values())
+      self.assertEqual(len(batpaths), 1)
+      self.assertEqual(len(glob(os.path.join('batcave', '*', '*.bat'))), 1)
+
+      with open('_batch_str.json', 'w') as f:
+         json.dump('str', f)
+      with open('_batch_list.json', 'w') as f:
+         json.dump([], f)
+      malformed = ['_batch0.json', '_batch_str.json', '_batch_list.json',
+                   '_batch1.json']
+      results = Sched.schedule_many(malformed, backend=backend)
+      self.assertEqual([r.source for r in results], malformed)
+      self.assertEqual([r.error for r in results[::3]], [None, None])
+      for r in results[1:3]:
+         self.assertIsNone(r.taskname)
+         self.assertIsInstance(r.error, InvalidSettingError)
+
+      backend.errors['create'] = subprocess.CalledProcessError(1, 'schtasks')
+      results = Sched.schedule_many(files[:2], backend=backend)
+      self.assertTrue(all(isinstance(r.error, subprocess.CalledProcessError)
+                          for r in results))
+
+   def test_deschedule_many(self):
+      backend = RecordingBackend()
+      Sched.schedule_many(["_batch{}.json".format(i) for i in range(3)],
+                          backend=backend)
+      results = Sched.deschedule_many(
+         ['_batch0', '_batch9', '_batch2'], concurrency=2, backend=backend)
+      self.assertEqual(results, [
+         DescheduleResult('_batch0', True, None),
+         DescheduleResult('_batch9', False, None),
+         DescheduleResult('_batch2', True, None)])
+      self.assertEqual(list(backend.tasks), ['_batch1'])
+      self.assertEqual(len(Batcave.open('batcave')), 3)
+
+      Sched.deschedule_many(['_batch0'], backend=backend, batcave='batcave')
+      self.assertEqual(Batcave.open('batcave').tasknames(),
+                       ['_batch1', '_batch2'])
+
+      error = subprocess.CalledProcessError(1, 'schtasks')
+      backend.errors['delete'] = error
+      self.assertEqual(Sched.deschedule_many(['_batch1'], backend=backend),
+                       [DescheduleResult('_batch1', False, error)])
+
+   def tearDown(self):
+      dammit.keep_fkn_trying(self.remove_files)
+
+
+class SchedReconcileTest(unittest.TestCase):
+   """unit tests for Sched.reconcile(), against a RecordingBackend so they
+   don't need schtasks
+   """
+
+   def remove_files(self):
+      for d in ['_reconcile', 'batcave']:
+         if os.path.isdir(d):
+            shutil.rmtree(d)
+
+   def gen(self, name, **settings):
+      settings.setdefault('run_cmd', 'python _foo.py')
+      settings.setdefault('schedule', 'daily')
+      Sched.gen_sched_settings_file(
+         os.path.join('_reconcile', "{}.json".format(name)),
+         name=name, **settings)
+
+   def setUp(self):
+      os.makedirs('_reconcile')
+      self.gen('_a')
+      self.gen('_b', start_time='10:00', start_date='01\\31\\2018')
+      self.gen('_c', schedule='weekly', days=['MON'])
+      self.backend = RecordingBackend()
+      self.backend.tasks['_foreign'] = ({'name': '_foreign',
+                                         'schedule': 'onlogon'}, None)
+
+   def test_reconcile(self):
+      backend = self.backend
+      plan = Sched.plan('_reconcile', backend=backend)
+      self.assertEqual(plan.create, ['_a', '_b', '_c'])
+      self.assertEqual(plan.update + plan.delete + plan.unchanged, [])
+
+      result = Sched.reconcile('_reconcile', backend=backend)
+      self.assertEqual(result.scheduled, [ScheduleResult(
+         os.path.join('_reconcile', "{}.json".format(name)), name, None)
+         for name in ['_a', '_b', '_c']])
+      self.assertEqual(result.descheduled, [])
+      self.assertEqual(sorted(backend.tasks), ['_a', '_b', '_c', '_foreign'])
+
+      backend.calls.clear()
+      result = Sched.reconcile('_reconcile', backend=backend)
+      self.assertEqual(result.plan.unchanged, ['_a', '_b', '_c'])
+      self.assertEqual(result.scheduled + result.descheduled, [])
+      self.assertEqual(backend.calls, [('bulk_query', True)])
+
+      os.remove(os.path.join('_reconcile', '_a.json'))
+      self.gen('_b', start_time='11:00', start_date='01\\31\\2018')
+      self.gen('_c', schedule='weekly', days=['MON'], run_cmd='python c.py')
+      self.gen('_d', schedule='hourly', modifier=2)
+      backend.calls.clear()
+      result = Sched.reconcile('_reconcile', backend=backend)
+      self.assertEqual(result.plan, (['_d'], ['_b', '_c'], ['_a'], [], []))
+      self.assertEqual(result.descheduled, [
+         DescheduleResult('_a', True, None)])
+      self.assertEqual(sorted(backend.tasks), ['_b', '_c', '_d', '_foreign'])
+      self.assertEqual(backend.tasks['_b'][0]['start_time'], '11:00')
+      self.assertEqual(sorted(Batcave.open('batcave').tasknames()),
+                       ['_b', '_c', '_d'])
+      self.assertEqual(Sched.plan('_reconcile', backend=backend).unchanged,
+                       ['_b', '_c', '_d'])
+
+   def test_invalid(self):
+      backend = self.backend
+      Sched.reconcile('_reconcile', backend=backend)
+      os.remove(os.path.join('_reconcile', '_a.json'))
+      self.gen('_bad', schedule='dailyy')
+      Sched.gen_sched_settings_file(
+         os.path.join('_reconcile', '_c2.json'), name='_c',
+         run_cmd='python c2.py', schedule='daily')
+      result = Sched.reconcile('_reconcile', backend=backend)
+      self.assertEqual([(r.taskname, type(r.error)) for r in
+                        result.plan.invalid],
+                       [(None, InvalidSettingError),
+                        ('_c', InvalidSettingError)])
+      self.assertEqual(result.plan.delete, [])
+      self.assertIn('_a', backend.tasks)
+
+      backend.errors['create'] = subprocess.CalledProcessError(1, 'schtasks')
+      os.remove(os.path.join('_reconcile', '_bad.json'))
+      os.remove(os.path.join('_reconcile', '_c2.json'))
+      self.gen('_b', run_cmd='python b.py')
+      result = Sched.reconcile('_reconcile', backend=backend)
+      self.assertIsInstance(result.scheduled[0].error,
+                            subprocess.CalledProcessError)
+      self.assertEqual(result.descheduled, [
+         DescheduleResult('_a', True, None)])
+
+   def test_forecast(self):
+      after = datetime(2018, 1, 31, 0, 0)
+      s = Sched(os.path.join('_reconcile', '_b.json'), 'batcave')
+      self.assertEqual(s.next_runs(2, after), [
+         datetime(2018, 1, 31, 10, 0), datetime(2018, 2, 1, 10, 0)])
+      self.gen('_once', schedule='once')
+      s = Sched(os.path.join('_reconcile', '_once.json'), 'batcave')
+      self.assertEqual(s.next_runs(2, datetime(2018, 1, 31, 9, 30, 15)),
+                       [datetime(2018, 1, 31, 9, 31)])
+      os.remove(os.path.join('_reconcile', '_once.json'))
+      self.gen('_q', schedule='quarterly', start_time='06:00')
+      self.gen('_bad', schedule='dailyy')
+      self.assertEqual(
+         list(Sched.forecast(
+            Sched._settings_files('_reconcile'), after,
+            datetime(2018, 2, 6))), [
+               (datetime(2018, 1, 31, 0, 0), '_a'),
+               (datetime(2018, 1, 31, 6, 0), '_q'),
+               (datetime(2018, 1, 31, 10, 0), '_b'),
+               (datetime(2018, 2, 1, 0, 0), '_a'),
+               (datetime(2018, 2, 1, 10, 0), '_b'),
+               (datetime(2018, 2, 2, 0, 0), '_a'),
+               (datetime(2018, 2, 2, 10, 0), '_b'),
+               (datetime(2018, 2, 3, 0, 0), '_a'),
+               (datetime(2018, 2, 3, 10, 0), '_b'),
+               (datetime(2018, 2, 4, 0, 0), '_a'),
+               (datetime(2018, 2, 4, 10, 0), '_b'),
+               (datetime(2018, 2, 5, 0, 0), '_a'),
+               (datetime(2018, 2, 5, 0, 0), '_c'),
+               (datetime(2018, 2, 5, 10, 0), '_b')])
+
+   def test_schedule_changes(self):
+      changes = [
+         ({'schedule': 'once', 'start_time': '10:00'},
+          {'start_time': '11:00'}),
+         ({'schedule': 'minute', 'modifier': 5}, {'modifier': 10}),
+         ({'schedule': 'hourly', 'modifier': 1}, {'modifier': 2}),
+         ({'schedule': 'daily', 'modifier': 1}, {'modifier': 3}),
+         ({'schedule': 'daily'}, {'end_date': '12\\31\\2030'}),
+         ({'schedule': 'quarterly'}, {'schedule': 'daily'}),
+         ({'schedule': 'weekly', 'modifier': 1}, {'modifier': 3}),
+         ({'schedule': 'weekly', 'days': ['MON']}, {'days': ['MON', 'FRI']}),
+         ({'schedule': 'monthly', 'modifier': 'LASTDAY'},
+          {'modifier': 'FIRST', 'days': ['MON']}),
+         ({'schedule': 'monthly', 'modifier': 'FIRST', 'days': ['MON']},
+          {'days': ['TUE']}),
+         ({'schedule': 'monthly', 'modifier': 'FIRST', 'days': ['MON']},
+          {'modifier': 'LAST'}),
+         ({'schedule': 'monthly', 'months': ['JAN']}, {'months': ['FEB']}),
+         ({'schedule': 'monthly', 'modifier': 2}, {'modifier': 4}),
+         ({'schedule': 'onstart'}, {'schedule': 'onlogon'}),
+         ({'schedule': 'onidle'}, {'start_min': False})]
+      for backend in [RecordingBackend(), InProcessBackend()]:
+         shutil.rmtree('_reconcile')
+         os.makedirs('_reconcile')
+         for i, (before, after) in enumerate(changes):
+            self.gen("_t{:02}".format(i), **before)
+         result = Sched.reconcile('_reconcile', backend=backend)
+         self.assertTrue(all(r.error is None for r in result.scheduled))
+         self.assertEqual(len(Sched.plan('_reconcile', backend=backend)
+                              .unchanged), len(changes))
+
+         for i, (before, after) in enumerate(changes):
+            settings = dict(before)
+            settings.update(after)
+            self.gen("_t{:02}".format(i), **settings)
+         plan = Sched.plan('_reconcile', backend=backend)
+         self.assertEqual(plan.update,
+                          ["_t{:02}".format(i) for i in range(len(changes))])
+         Sched.reconcile('_reconcile', backend=backend)
+         self.assertEqual(len(Sched.plan('_reconcile', backend=backend)
+                              .unchanged), len(changes))
+
+   def test_in_process(self):
+      backend = InProcessBackend()
+      Sched.reconcile('_reconcile', backend=backend)
+      self.assertEqual(
+         Sched.plan('_reconcile', backend=backend).unchanged,
+         ['_a', '_b', '_c'])
+
+   def test_many(self):
+      for i in range(3000):
+         self.gen("_task{}".format(i))
+      backend = RecordingBackend()
+      result = Sched.reconcile('_reconcile', backend=backend)
+      self.assertEqual(len(result.plan.create), 3003)
+      backend.calls.clear()
+      result = Sched.reconcile('_reconcile', backend=backend)
+      self.assertEqual(len(result.plan.unchanged), 3003)
+      self.assertEqual(backend.calls, [('bulk_query', True)])
+
+   def tearDown(self):
+      dammit.keep_fkn_trying(self.remove_files)
@@ -1,9 +1,12 @@
 from lib.settings import Settings
+from lib.schema import RegexCache, REGEX_CACHE
+from lib.validation_cache import ValidationCache
 from lib.custom_exceptions import *
 
 import unittest
 import json
 import os
+import re
 import tests.test_helpers as dammit
 
 
@@ -32,6 +35,23 @@ class SettingsTest(unittest.TestCase):
       self.assertTrue(Settings._is_in_prim('y', ['x', 'y', 'z']))
       self.assertFalse(Settings._is_in_prim('a', ['x', 'y', 'z']))
 
+   def test_is_in_prim_literals(self):
+      hosts = ['host{}'.format(i) for i in range(5000)]
+      self.assertTrue(Settings._is_in_prim('host4999', hosts))
+      self.assertFalse(Settings._is_in_prim('host5000', hosts))
+      self.assertTrue(Settings._is_in_prim('host5000', hosts + [r'host\d+:re']))
+
+      self.assertTrue(Settings._is_in_prim(1, [1]))
+      self.assertTrue(Settings._is_in_prim(1.0, [1]))
+      self.assertTrue(Settings._is_in_prim(1, [1.0]))
+      self.assertFalse(Settings._is_in_prim(True, [1]))
+      self.assertFalse(Settings._is_in_prim(1, [True]))
+      self.assertFalse(Settings._is_in_prim(0.0, [False]))
+      self.assertTrue(Settings._is_in_prim(True, [True]))
+      self.assertFalse(Settings._is_in_prim('1', [1]))
+      self.assertTrue(Settings._is_in_prim(True, [1, '*:bool']))
+      self.assertTrue(Settings._is_in_prim('*:int', ['*:int']))
+
    def test_is_in_list(self):
       self.assertTrue(Settings._is_in_list(['x','y'], ['a','y','c','x']))
       self.assertTrue(Settings._is_in_list([['x']], [['z'], ['x','y']]))
@@ -78,6 +98,27 @@ class SettingsTest(unittest.TestCase):
          {'a': [{'b':'c'}]}
       ))
 
+   def test_is_in_list_mixed_sublist(self):
+      self.assertTrue(Settings._is_in_list(
+         [[['a'], 'b', {'c': 'd'}]], [[['a', 'z'], 'b', {'c': ['d']}], ['b']]))
+      self.assertFalse(Settings._is_in_list(
+         [[['a'], 'b', {'c': 'd'}]], [[['a', 'z'], 'b'], ['b', {'c': ['d']}]]))
+      self.assertTrue(Settings._is_in_list(
+         [['b', 'x1']], [['a'], [r'x\d:re', 'b']]))
+      self.assertFalse(Settings._is_in_list(
+         [['a', 'x1']], [['a'], [r'x\d:re', 'b']]))
+      with self.assertRaises(InvalidSettingError):
+         Settings._is_in_list([['a', None]], [['a', 'b']])
+
+   def test_is_in_list_large(self):
+      valid = [['job{}'.format(i), 'job{}'.format(i + 1), '*:int']
+               for i in range(0, 2000, 2)]
+      user = [['job{}'.format(i), 'job{}'.format(i + 1), i]
+              for i in range(0, 2000, 2)] * 10
+      self.assertTrue(Settings._is_in_list(user, valid))
+      self.assertFalse(Settings._is_in_list(user + [['job0', 'job2']], valid))
+      self.assertFalse(Settings._is_in_list(user + [['job0', 1.5]], valid))
+
    def test_list_with_dict(self):
       self.assertTrue(Settings._is_in_list(
          [{'a':'d'}],
@@ -145,6 +186,49 @@ class SettingsTest(unittest.TestCase):
          Settings({}, {'foo': [1, 0], 'bar': ['barval', 'barval2']}, {'bar': 'barval'})
       s = Settings({'bar': 'barval', 'foo': 1}, {'foo': [1, 0], 'bar': ['barval', 'barval2']}, {'bar': 2})
 
+   def test_defaults_overlay(self):
+      defaults = {'foo': 0, 'bar': {'baz': 'a', 'mu': {'nu': 1}}}
+      valid = {'foo': [0, 1], 'bar': {'baz': ['a', 'b'], 'mu': {'nu': [1, 2]}}}
+      settings = {'bar': {'baz': 'b'}}
+      overlay = Settings._inject_defaults(settings, defaults)
+      self.assertEqual(len(overlay), 2)
+      self.assertEqual(list(overlay), ['bar', 'foo'])
+      self.assertIn('foo', overlay)
+      self.assertNotIn('baz', overlay)
+      self.assertIs(overlay['bar'], overlay['bar'])
+      self.assertIsNot(overlay['bar']['mu'], defaults['bar']['mu'])
+      self.assertEqual(overlay, {'foo': 0, 'bar': {'baz': 'b', 'mu': {'nu': 1}}})
+      self.assertEqual(settings, {'bar': {'baz': 'b'}})
+
+      list_defaults = {'foo': [1, 2]}
+      list_overlay = Settings._inject_defaults({}, list_defaults)
+      self.assertIs(list_overlay['foo'], list_overlay['foo'])
+      list_overlay['foo'].append(3)
+      self.assertEqual(list_defaults, {'foo': [1, 2]})
+
+      plain = overlay.materialize()
+      self.assertEqual(plain, overlay)
+      self.assertIs(type(plain['bar']['mu']), dict)
+      plain['bar']['mu']['nu'] = 2
+      self.assertEqual(defaults['bar']['mu'], {'nu': 1})
+
+      s = Settings({}, valid, defaults)
+      self.assertEqual(s.materialize(),
+                       {'foo': 0, 'bar': {'baz': 'a', 'mu': {'nu': 1}}})
+      self.assertEqual(json.loads(json.dumps(s.materialize())), s)
+      self.assertIs(type(s['bar']), dict)
+      self.assertIs(type(s['bar']['mu']), dict)
+      self.assertIs(s['bar'], s['bar'])
+      self.assertEqual(json.loads(json.dumps(dict(s))), s)
+      self.assertEqual(json.loads(json.dumps(dict(s.items()))), s)
+      s['bar']['mu']['nu'] = 2
+      self.assertEqual(defaults['bar']['mu'], {'nu': 1})
+      s = Settings({}, valid, defaults)
+      self.assertEqual(s.updated(foo=1).materialize()['bar'], s['bar'])
+      s = s.with_patch([{'op': 'replace', 'path': '/bar/mu/nu', 'value': 2}])
+      self.assertEqual(s['bar']['mu'], {'nu': 2})
+      self.assertEqual(defaults['bar']['mu'], {'nu': 1})
+
    def test_primitive_validity(self):
       Settings._primitive_validity_check('x', ['x','y','z'])
       Settings._primitive_validity_check('z', ['x','y','z'])
@@ -230,6 +314,36 @@ class SettingsTest(unittest.TestCase):
       Settings._validity_check({'foo':3.4}, {'foo':r'\d+(\.\d+)?:re'})
       Settings._validity_check({'foo':34}, {'foo':r'\d+(\.\d+)?:re'})
 
+   def test_regex_cache(self):
+      cache = RegexCache(maxsize=2)
+      matcher = cache.get(r'F\w:re:IS')
+      self.assertEqual((cache.hits, cache.misses), (0, 1))
+      self.assertIs(cache.get(r'F\w:re:IS'), matcher)
+      self.assertEqual((cache.hits, cache.misses), (1, 1))
+      self.assertTrue(matcher.matches('foo'))
+      self.assertEqual(matcher.flags & (re.I | re.S), re.I | re.S)
+
+      self.assertIsNone(cache.get('foo'))
+      self.assertIsNone(cache.get('foo'))
+      self.assertEqual((cache.hits, cache.misses), (1, 1))
+      self.assertIsNone(cache.get('foo:read'))
+      self.assertEqual((len(cache), cache.misses), (1, 2))
+
+      cache.get(r'\d+:re')
+      cache.get(r'\w+:re')
+      self.assertEqual(len(cache), 2)
+      cache.get(r'F\w:re:IS')
+      self.assertEqual(cache.misses, 5)
+
+      cache.clear()
+      self.assertEqual((len(cache), cache.hits, cache.misses), (0, 0, 0))
+
+      REGEX_CACHE.clear()
+      Settings._validity_check({'foo': '12:34'}, {'foo': r'\d{2}:\d{2}:re'})
+      Settings._validity_check({'foo': '23:45'}, {'foo': r'\d{2}:\d{2}:re'})
+      self.assertEqual(REGEX_CACHE.misses, 1)
+      self.assertEqual(REGEX_CACHE.hits, 1)
+
    def test_is_in_prim_order(self):
       Settings._validity_check({'foo':'foov'},{'foo':['foov','*:bool',r'\d+:re']})
       Settings._validity_check({'foo':True},{'foo':['foov','*:bool',r'\d+:re']})
@@ -287,6 +401,78 @@ class SettingsTest(unittest.TestCase):
          {'foo': {'bar': 'baz'}},
          {'foo': [{'bar': ['mu', 'baz']}]})
 
+   def test_compile_schema(self):
+      valid = {'foo': [0, 1], 'bar': ['barval', r'baz\d:re', '*:bool'],
+               'baz': {'mu': [['a', 'b'], ['c']]}}
+      schema = Settings.compile_schema(valid)
+      self.assertIs(Settings.compile_schema(schema), schema)
+      self.assertIs(schema.valid, valid)
+
+      s = Settings({'foo': 1, 'bar': 'baz3', 'baz': {'mu': [['b']]}}, schema)
+      self.assertEqual(s['bar'], 'baz3')
+      Settings({'foo': 0, 'bar': True, 'baz': {'mu': [['c'], []]}}, schema)
+      self.assertTrue(schema.is_valid(
+         {'foo': 0, 'bar': 'barval', 'baz': {'mu': [['a', 'b']]}}))
+      self.assertFalse(schema.is_valid(
+         {'foo': 0, 'bar': 'barval', 'baz': {'mu': [['a', 'c']]}}))
+      self.assertFalse(schema.is_valid({'foo': 0, 'bar': 'barval'}))
+
+      with self.assertRaises(InvalidSettingError):
+         Settings({'foo': 2, 'bar': 'barval', 'baz': {'mu': []}}, schema)
+      with self.assertRaises(InvalidSettingError):
+         Settings({'foo': 0, 'bar': 'bazz', 'baz': {'mu': []}}, schema)
+      with self.assertRaises(InvalidSettingError):
+         Settings({'foo': 0, 'bar': None, 'baz': {'mu': []}}, schema)
+
+      with self.assertRaises(InvalidWildcardError):
+         Settings.compile_schema({'foo': '*:foo'})
+      with self.assertRaises(InvalidRegexError):
+         Settings.compile_schema({'foo': '(:re'})
+
+   def test_error_details(self):
+      valid = {'foo': {'bar': ['a', 'b'], 'baz': [['c', 'd'], 'e']},
+               'mu': [0, 1]}
+
+      with self.assertRaises(InvalidSettingError) as cm:
+         Settings({'foo': {'bar': 'a', 'baz': ['e', ['c'], ['c', 'e']]},
+                   'mu': 0}, valid)
+      self.assertEqual(cm.exception.path, 'foo.baz[2]')
+      self.assertEqual(cm.exception.value, ['c', 'e'])
+      self.assertEqual(cm.exception.alternatives, [['c', 'd'], 'e'])
+      self.assertIn('foo.baz[2]', str(cm.exception))
+
+      with self.assertRaises(InvalidSettingError) as cm:
+         Settings({'foo': {'bar': 'x', 'baz': []}, 'mu': 0}, valid)
+      self.assertEqual(cm.exception.path, 'foo.bar')
+      self.assertEqual(cm.exception.value, 'x')
+      self.assertEqual(cm.exception.alternatives, ['a', 'b'])
+      self.assertEqual(cm.exception.errors, [])
+
+      with self.assertRaises(InvalidSettingError) as cm:
+         Settings({'foo': {'bar': 'a', 'baz': []}, 'mu': 0, 'nu': 1}, valid)
+      self.assertEqual(cm.exception.path, 'nu')
+      self.assertEqual(cm.exception.reason, 'unknown setting')
+
+      with self.assertRaises(InvalidSettingError) as cm:
+         Settings({'foo': {'baz': []}, 'mu': 0}, valid)
+      self.assertEqual(cm.exception.path, 'foo.bar')
+      self.assertEqual(cm.exception.reason, 'missing setting')
+
+      with self.assertRaises(InvalidSettingError) as cm:
+         Settings({'foo': {'bar': 'x', 'baz': ['e', 'f', ['d', 'g']]},
+                   'mu': None}, valid, collect_errors=True)
+      self.assertEqual(
+         [(e.path, e.value) for e in cm.exception.errors],
+         [('foo.bar', 'x'), ('foo.baz[1]', 'f'), ('foo.baz[2]', ['d', 'g']),
+          ('mu', None)])
+      self.assertEqual(cm.exception.path, 'foo.bar')
+      self.assertTrue(str(cm.exception).startswith('4 invalid settings'))
+
+      with self.assertRaises(InvalidSettingError) as cm:
+         Settings({'foo': {'bar': 'a', 'baz': []}}, valid, collect_errors=True)
+      self.assertEqual(len(cm.exception.errors), 1)
+      self.assertEqual(cm.exception.path, 'mu')
+
    def test_ctor_with_settings_file(self):
       s = Settings('foo_settings.json',
                    {'foo':[0, 1], 'bar':['barval', 'barval2']})
@@ -297,6 +483,221 @@ class SettingsTest(unittest.TestCase):
          Settings('foo_settings.json',
                   {'foo':[0, 1], 'bar':['barval2', 'barval3']})
 
+   def test_validate_many(self):
+      with open('bad_settings.json', 'w') as bad:
+         bad.write('{"foo": ')
+      valid = {'foo': [0, 1], 'bar': ['barval', 'barval2']}
+      sources = [
+         'foo_settings.json',
+         {'foo': 0, 'bar': 'barval2'},
+         {'foo': 2, 'bar': 'barval'},
+         'bad_settings.json',
+         'nonexistent_settings.json',
+         {'foo': 1}
+      ]
+
+      not_objects = []
+      for i, doc in enumerate([5, 'str', []]):
+         not_objects.append("not_object{}_settings.json".format(i))
+         with open(not_objects[-1], 'w') as f:
+            json.dump(doc, f)
+      sources += not_objects
+
+      try:
+         for workers in [None, 2]:
+            for cache in [None, ValidationCache()]:
+               results = list(Settings.validate_many(
+                  not_objects, valid, {'bar': 'barval'}, workers=workers,
+                  cache=cache))
+               for r in results:
+                  self.assertIsNone(r.settings)
+                  self.assertIsInstance(r.error, InvalidSettingError)
+                  self.assertEqual(r.error.path, '')
+
+            results = list(Settings.validate_many(
+               sources, valid, {'bar': 'barval'}, workers=workers,
+               chunksize=2))
+            self.assertEqual([r.source for r in results], sources)
+            self.assertEqual(results[0].settings,
+                             {'foo': 1, 'bar': 'barval'})
+            self.assertIsNone(results[0].error)
+            self.assertEqual(results[1].settings['bar'], 'barval2')
+            self.assertIsNone(results[2].settings)
+            self.assertIsInstance(results[2].error, InvalidSettingError)
+            self.assertIsInstance(results[3].error, ValueError)
+            self.assertIsInstance(results[4].error, OSError)
+            self.assertEqual(results[5].settings, {'foo': 1, 'bar': 'barval'})
+            self.assertIsInstance(results[6].error, InvalidSettingError)
+      finally:
+         for path in ['bad_settings.json'] + not_objects:
+            os.remove(path)
+
+   def test_updated(self):
+      valid = {'foo': [0, 1], 'bar': {'baz': ['a', 'b'], 'mu': [['c', 'd']]},
+               'nu': '*:str'}
+      defaults = {'foo': 0, 'bar': {'baz': 'a', 'mu': []}}
+      s = Settings({'nu': 'x', 'bar': {'baz': 'b'}}, valid, defaults)
+
+      s2 = s.updated(foo=1)
+      self.assertEqual(s2['foo'], 1)
+      self.assertEqual(s['foo'], 0)
+      self.assertIs(s2['bar'], s['bar'])
+
+      s3 = s2.updated(bar={'mu': [['d']]}, foo=None)
+      self.assertEqual(s3['bar'], {'baz': 'a', 'mu': [['d']]})
+      self.assertEqual(s3['foo'], 0)
+      self.assertEqual(s2['bar'], {'baz': 'b', 'mu': []})
+
+      with self.assertRaises(InvalidSettingError) as cm:
+         s.updated(bar={'baz': 'c'})
+      self.assertEqual(cm.exception.path, 'bar.baz')
+      with self.assertRaises(InvalidSettingError) as cm:
+         s.updated(mu=1)
+      self.assertEqual(cm.exception.reason, 'unknown setting')
+
+   def test_with_patch(self):
+      valid = {'foo': [0, 1], 'bar': {'baz': ['a', 'b'], 'mu': [['c', 'd']]},
+               'nu': {'x/y': ['*:int']}}
+      s = Settings({'foo': 0, 'bar': {'baz': 'a', 'mu': [['c'], ['d']]},
+                    'nu': {'x/y': 3}}, valid)
+
+      s2 = s.with_patch([
+         {'op': 'test', 'path': '/bar/baz', 'value': 'a'},
+         {'op': 'replace', 'path': '/bar/mu/0/0', 'value': 'd'},
+         {'op': 'add', 'path': '/bar/mu/-', 'value': ['c', 'd']},
+         {'op': 'add', 'path': '/bar/mu/0', 'value': []},
+         {'op': 'replace', 'path': '/nu/x~1y', 'value': 4}])
+      self.assertEqual(s2['bar']['mu'], [[], ['d'], ['d'], ['c', 'd']])
+      self.assertEqual(s2['nu'], {'x/y': 4})
+      self.assertEqual(s['bar']['mu'], [['c'], ['d']])
+      self.assertEqual(s['nu'], {'x/y': 3})
+      self.assertIs(s2['bar']['mu'][2], s['bar']['mu'][1])
+
+      s3 = s2.with_patch([
+         {'op': 'remove', 'path': '/bar/mu/0'},
+         {'op': 'move', 'from': '/bar/mu/2', 'path': '/bar/mu/0'},
+         {'op': 'copy', 'from': '/foo', 'path': '/nu/x~1y'}])
+      self.assertEqual(s3['bar']['mu'], [['c', 'd'], ['d'], ['d']])
+      self.assertEqual(s3['nu'], {'x/y': 0})
+      self.assertIs(s3['foo'], s2['foo'])
+
+      s5 = s.with_patch([
+         {'op': 'replace', 'path': '/foo', 'value': 1},
+         {'op': 'replace', 'path': '/bar/baz', 'value': 'b'}])
+      self.assertEqual(list(s5), ['foo', 'bar', 'nu'])
+      self.assertEqual(list(s5['bar']), ['baz', 'mu'])
+      self.assertEqual(s5['bar']['baz'], 'b')
+
+      s6 = s.with_patch([{'op': 'move', 'from': '/bar', 'path': '/bar'},
+                         {'op': 'move', 'from': '/bar/mu/1',
+                          'path': '/bar/mu/1'}])
+      self.assertEqual(s6, s)
+      self.assertEqual(list(s6), ['foo', 'bar', 'nu'])
+      with self.assertRaises(InvalidPatchError):
+         s.with_patch([{'op': 'move', 'from': '/zeta', 'path': '/zeta'}])
+
+      s4 = s.with_patch([{'op': 'replace', 'path': '',
+                          'value': {'foo': 1, 'bar': {'baz': 'b', 'mu': []},
+                                    'nu': {'x/y': 1}}}])
+      self.assertEqual(s4['foo'], 1)
+
+      with self.assertRaises(InvalidSettingError) as cm:
+         s.with_patch([{'op': 'add', 'path': '/bar/mu/0/-', 'value': 'x'}])
+      self.assertEqual(cm.exception.path, 'bar.mu[0]')
+      with self.assertRaises(InvalidSettingError) as cm:
+         s.with_patch([{'op': 'remove', 'path': '/bar/baz'}])
+      self.assertEqual(cm.exception.reason, 'missing setting')
+      with self.assertRaises(InvalidSettingError) as cm:
+         s.with_patch([{'op': 'add', 'path': '/bar/zeta', 'value': 1}])
+      self.assertEqual(cm.exception.path, 'bar.zeta')
+      with self.assertRaises(InvalidSettingError):
+         s.with_patch([{'op': 'replace', 'path': '/nu/x~1y', 'value': 'a'}])
+
+      with self.assertRaises(InvalidPatchError):
+         s.with_patch([{'op': 'test', 'path': '/foo', 'value': 1}])
+      with self.assertRaises(InvalidPatchError):
+         s.with_patch([{'op': 'replace', 'path': '/zeta', 'value': 1}])
+      with self.assertRaises(InvalidPatchError):
+         s.with_patch([{'op': 'add', 'path': '/bar/mu/5', 'value': []}])
+      with self.assertRaises(InvalidPatchError):
+         s.with_patch([{'op': 'frobnicate', 'path': '/foo'}])
+      with self.assertRaises(InvalidPatchError):
+         s.with_patch([{'op': 'move', 'from': '/bar', 'path': '/bar/mu'}])
+      self.assertEqual(s['bar']['mu'], [['c'], ['d']])
+
+   def test_stream(self):
+      valid = {'foo': [1, 2], 'bar': {'baz': ['a', 'b'], 'mu': ['*:int']}}
+      defaults = {'bar': {'baz': 'a', 'mu': 0}}
+      with open('foo_settings.json', 'w') as settings:
+         json.dump({'foo': 2, 'bar': {'mu': 5}}, settings)
+      s = Settings.stream('foo_settings.json', valid, defaults, chunk_size=3)
+      self.assertEqual(s, {'foo': 2, 'bar': {'baz': 'a', 'mu': 5}})
+      self.assertEqual(s, Settings('foo_settings.json', valid, defaults))
+
+      with open('foo_settings.json', 'w') as settings:
+         json.dump({'a': 1.25, 'b': -2.5e-3}, settings)
+      for chunk_size in [1, 4, 8]:
+         self.assertEqual(
+            Settings.stream('foo_settings.json', {'a': '*:float',
+                                                  'b': '*:float'},
+                            chunk_size=chunk_size),
+            {'a': 1.25, 'b': -2.5e-3})
+
+      with open('foo_settings.json', 'w') as settings:
+         settings.write('{"foo": 3, "bar": {"baz": "c"}, "nu": [1, 2')
+      with self.assertRaises(InvalidSettingError) as cm:
+         Settings.stream('foo_settings.json', valid, defaults, chunk_size=3)
+      self.assertEqual(cm.exception.path, 'foo')
+      with self.assertRaises(json.JSONDecodeError):
+         Settings.stream('foo_settings.json', valid, defaults,
+                         collect_errors=True)
+
+      with open('foo_settings.json', 'w') as settings:
+         json.dump({'foo': 3, 'bar': {'baz': 'c'}}, settings)
+      with self.assertRaises(InvalidSettingError) as cm:
+         Settings.stream('foo_settings.json', valid, collect_errors=True)
+      self.assertEqual(sorted(e.path for e in cm.exception.errors),
+                       ['bar.baz', 'bar.mu', 'foo'])
+
+      # keys only the defaults supply are validated like the constructor does
+      with open('foo_settings.json', 'w') as settings:
+         json.dump({'foo': 2}, settings)
+      for bad_defaults, path in [({'bar': 'zzz'}, 'bar'),
+                                 ({'bar': {'baz': 'a', 'mu': 0}, 'extra': 1},
+                                  'extra')]:
+         for collect_errors in [False, True]:
+            with self.assertRaises(InvalidSettingError) as cm:
+               Settings('foo_settings.json', valid, bad_defaults,
+                        collect_errors)
+            with self.assertRaises(InvalidSettingError) as stream_cm:
+               Settings.stream('foo_settings.json', valid, bad_defaults,
+                               collect_errors, chunk_size=3)
+            self.assertEqual(stream_cm.exception.path, path)
+            self.assertEqual(stream_cm.exception.path, cm.exception.path)
+
+   def test_deep_nesting(self):
+      settings, defaults = {}, {}
+      s, d = settings, defaults
+      for i in range(5000):
+         s['x'], d['x'] = {}, {'y': i}
+         s, d = s['x'], d['x']
+      s['z'] = 1
+      node = Settings._inject_defaults(settings, defaults)['x']
+      for i in range(4999):
+         self.assertEqual(node['y'], i)
+         node = node['x']
+      self.assertEqual(node, {'y': 4999, 'z': 1})
+      self.assertEqual(s, {'z': 1})
+
+      depth = 100
+      valid, settings = {'z': [1]}, {'z': 1}
+      for i in range(depth):
+         valid, settings = {'x': valid}, {'x': settings}
+      node = Settings(settings, valid)
+      for i in range(depth):
+         node = node['x']
+      self.assertEqual(node, {'z': 1})
+
    def test_getitem(self):
       s = self.settings
       self.assertEqual(s['foo'], 1)
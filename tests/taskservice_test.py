@@ -0,0 +1,146 @@
+from lib.taskservice import *
+from lib.backends import make_task
+from lib.sched import Sched
+from lib.worker import handle
+from tests.test_helpers import task_settings
+from datetime import datetime
+
+import unittest
+
+
+class FakeComError(Exception):
+   """stand-in for pywintypes.com_error"""
+
+   def __init__(self, hresult):
+      super().__init__(hresult, 'error', None, None)
+      self.hresult = hresult
+
+
+class FakeRegisteredTask:
+   """stand-in for an IRegisteredTask"""
+
+   def __init__(self, path, xml):
+      self.Path = path
+      self.Name = path.rsplit('\\', 1)[-1]
+      self.Xml = xml
+      self.State = 3
+      self.NextRunTime = datetime(2018, 2, 1, 10, 0)
+      self.LastRunTime = datetime(1899, 12, 30)
+      self.LastTaskResult = SCHED_S_TASK_HAS_NOT_RUN
+
+
+class FakeFolder:
+   """stand-in for an ITaskFolder"""
+
+   def __init__(self, path):
+      self.path = path
+      self.tasks = {}
+      self.folders = []
+
+   def RegisterTask(self, name, xml, flags, user, password, logon_type):
+      if flags != TASK_CREATE_OR_UPDATE:
+         raise FakeComError(-2147024713)
+      self.tasks[name] = FakeRegisteredTask(self.path + name, xml)
+
+   def DeleteTask(self, name, flags):
+      if self.tasks.pop(name, None) is None:
+         raise FakeComError(-2147024894)
+
+   def GetTask(self, name):
+      try:
+         return self.tasks[name]
+      except KeyError:
+         raise FakeComError(-2147024894)
+
+   def GetTasks(self, flags):
+      return list(self.tasks.values())
+
+   def GetFolders(self, flags):
+      return list(self.folders)
+
+
+class FakeService:
+   """stand-in for the Schedule.Service COM object"""
+
+   def __init__(self):
+      self.root = FakeFolder('\\')
+
+   def GetFolder(self, path):
+      return self.root
+
+
+class TaskServiceTest(unittest.TestCase):
+   """unit tests for TaskServiceBackend and the task xml it registers"""
+
+   def setUp(self):
+      self.service = FakeService()
+      self.backend = TaskServiceBackend(self.service)
+
+   def test_xml_round_trip(self):
+      variants = [
+         dict(schedule='once', start_time='10:00', start_date='01\\31\\2018'),
+         dict(schedule='minute', modifier=15),
+         dict(schedule='hourly', modifier=2, end_date='03\\01\\2018'),
+         dict(schedule='daily', modifier=3, start_time='06:30'),
+         dict(schedule='weekly', days=['MON', 'FRI'], modifier=2),
+         dict(schedule='monthly', modifier='LASTDAY', months=['JAN']),
+         dict(schedule='monthly', modifier='SECOND', days=['TUE']),
+         dict(schedule='monthly', modifier=1, start_date='02\\01\\2018'),
+         dict(schedule='onstart'), dict(schedule='onlogon')]
+      for variant in variants:
+         settings = task_settings(**variant)
+         self.backend.create(settings, 'C:\\batcave\\_foo.bat')
+         task = self.backend.query('_foo')
+         expected = make_task('_foo', settings, 'C:\\batcave\\_foo.bat')
+         # a start that isn't set is taken from the time of the call
+         for field in Sched._RECONCILED:
+            if field in ('start_time', 'start_date') and \
+               not variant.get(field):
+               continue
+            self.assertEqual(getattr(task, field), getattr(expected, field),
+                             (variant, field))
+
+   def test_query(self):
+      self.assertEqual(self.backend.query('_foo'), ())
+      self.backend.create(task_settings(
+         schedule='monthly', modifier=3, start_date='02\\01\\2018'),
+         'C:\\batcave\\_foo.bat')
+      task = self.backend.query('_foo')
+      self.assertEqual(task.task_name, '\\_foo')
+      self.assertEqual(task.status, 'Ready')
+      self.assertEqual(task.last_run_time, 'N/A')
+      self.assertEqual(task.last_result, 'N/A')
+      self.assertEqual(task.next_run_time, '02/01/2018 10:00:00 AM')
+      self.assertEqual(task.months, 'FEB, MAY, AUG, NOV')
+
+      def denied(name):
+         raise FakeComError(-2147024891)
+      self.service.root.GetTask = denied
+      with self.assertRaises(FakeComError):
+         self.backend.query('_foo')
+
+   def test_delete_and_bulk_query(self):
+      for name in ['_foo', '_bar']:
+         self.backend.create(task_settings(name=name), None)
+      sub = FakeFolder('\\sub\\')
+      sub.RegisterTask('_baz', task_xml(task_settings(), None),
+                       TASK_CREATE_OR_UPDATE, '', '', 3)
+      self.service.root.folders.append(sub)
+      self.assertEqual(sorted(self.backend.bulk_query()), ['_bar', '_foo'])
+      tasks = self.backend.bulk_query(top_lv_only=False)
+      self.assertEqual(tasks['_baz'].task_name, '\\sub\\_baz')
+      self.assertTrue(self.backend.delete('_foo'))
+      self.assertFalse(self.backend.delete('_foo'))
+      self.assertEqual(sorted(self.backend.bulk_query()), ['_bar'])
+
+   def test_worker_handle(self):
+      reply = handle(self.backend, {
+         'id': 1, 'op': 'create',
+         'args': {'settings': task_settings(), 'batpath': 'C:\\_foo.bat'}})
+      self.assertIsNone(reply['result'])
+      reply = handle(self.backend, {'id': 2, 'op': 'query',
+                                    'args': {'taskname': '_foo'}})
+      self.assertEqual(reply['result']['values'][8], 'C:\\_foo.bat')
+
+if __name__ == '__main__':
+   unittest.main()
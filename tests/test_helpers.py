@@ -1,4 +1,8 @@
 import lib.helpers as dammit
+from lib.sched import Sched
+from datetime import timedelta
+
+import copy
 
 class MockRestore():
    """Simple way for mocking and restoring back to init"""
@@ -32,3 +36,34 @@ class MockRestore():
 def keep_fkn_trying(
    callback, args=None, kwargs=None, max_attempts=10, interval_sec=1):
    dammit.keep_fkn_trying(callback, args, kwargs, max_attempts, interval_sec)
+
+class FakeClock():
+   """clock returning a settable time in seconds since the epoch, for
+   driving schedulers without sleeping
+   """
+
+   def __init__(self, dt):
+      """create a FakeClock set to datetime |dt|"""
+
+      self.now = dt.timestamp()
+
+   def __call__(self):
+      """return the current fake time"""
+
+      return self.now
+
+   def advance(self, **kwargs):
+      """move the clock forward by timedelta(**kwargs)"""
+
+      self.now += timedelta(**kwargs).total_seconds()
+
+def task_settings(**settings):
+   """return a complete settings dict for a task named '_foo' that runs
+   'python _foo.py' once, with Sched._DEFAULTS for the optional settings.
+   Any setting can be overridden through |**settings|.
+   """
+
+   task = copy.deepcopy(Sched._DEFAULTS)
+   task.update(name='_foo', run_cmd='python _foo.py', schedule='once')
+   task.update(settings)
+   return task
@@ -0,0 +1,124 @@
+from lib.settings import Settings
+from lib.validation_cache import ValidationCache
+from lib.custom_exceptions import *
+
+import unittest
+import json
+import os
+import pickle
+import shutil
+import tests.test_helpers as dammit
+
+
+class ValidationCacheTest(unittest.TestCase):
+   """unit tests for ValidationCache"""
+
+   def write_settings(self, settings):
+      with open('foo_settings.json', 'w') as settings_file:
+         json.dump(settings, settings_file)
+
+   def remove_files(self):
+      if os.path.isfile('foo_settings.json'):
+         os.remove('foo_settings.json')
+      if os.path.isdir('validation_cache'):
+         shutil.rmtree('validation_cache')
+
+   def setUp(self):
+      self.valid = {'foo': [0, 1], 'bar': ['barval', 'barval2']}
+      self.schema = Settings.compile_schema(self.valid)
+      self.write_settings({'foo': 1})
+
+   def test_memory_cache(self):
+      cache = ValidationCache()
+      s = Settings('foo_settings.json', self.schema, {'bar': 'barval'},
+                   cache=cache)
+      self.assertEqual(s, {'foo': 1, 'bar': 'barval'})
+      self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+      s = Settings('foo_settings.json', self.valid, {'bar': 'barval'},
+                   cache=cache)
+      self.assertEqual(s, {'foo': 1, 'bar': 'barval'})
+      self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+      Settings('foo_settings.json', self.schema, {'bar': 'barval2'},
+               cache=cache)
+      self.assertEqual(cache.misses, 2)
+      Settings('foo_settings.json', {'foo': [1], 'bar': ['barval']},
+               {'bar': 'barval'}, cache=cache)
+      self.assertEqual(cache.misses, 3)
+
+      self.write_settings({'foo': 0, 'bar': 'barval2'})
+      s = Settings('foo_settings.json', self.schema, {'bar': 'barval'},
+                   cache=cache)
+      self.assertEqual(s['foo'], 0)
+      self.assertEqual(cache.misses, 4)
+
+      self.write_settings({'foo': 2})
+      with self.assertRaises(InvalidSettingError):
+         Settings('foo_settings.json', self.schema, {'bar': 'barval'},
+                  cache=cache)
+      with self.assertRaises(InvalidSettingError):
+         Settings('foo_settings.json', self.schema, {'bar': 'barval'},
+                  cache=cache)
+      self.assertEqual(cache.misses, 6)
+
+      s = Settings({'foo': 1, 'bar': 'barval'}, self.schema, cache=cache)
+      self.assertEqual(cache.misses, 6)
+
+      cache.clear()
+      self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+   def test_copies(self):
+      valid = {'foo': [0, 1], 'bar': {'baz': ['a', 'b']}}
+      self.write_settings({'foo': 1, 'bar': {'baz': 'a'}})
+      for cache in (ValidationCache(), ValidationCache('validation_cache')):
+         s1 = Settings('foo_settings.json', valid, cache=cache)
+         s1['bar']['baz'] = 'b'
+         s2 = Settings('foo_settings.json', valid, cache=cache)
+         self.assertEqual(s2['bar'], {'baz': 'a'})
+         s2['bar']['baz'] = 'b'
+         s3 = Settings('foo_settings.json', valid,
+                       cache=pickle.loads(pickle.dumps(cache)))
+         self.assertEqual(s3['bar'], {'baz': 'a'})
+         self.assertEqual(cache.hits, 1)
+
+   def test_disk_cache(self):
+      cache = ValidationCache('validation_cache', maxsize=1)
+      Settings('foo_settings.json', self.schema, {'bar': 'barval'},
+               cache=cache)
+      self.assertEqual(len(os.listdir('validation_cache')), 1)
+
+      other = pickle.loads(pickle.dumps(cache))
+      s = Settings('foo_settings.json', self.schema, {'bar': 'barval'},
+                   cache=other)
+      self.assertEqual(s, {'foo': 1, 'bar': 'barval'})
+      self.assertEqual((other.hits, other.misses), (1, 0))
+
+      with open(os.path.join('validation_cache',
+                             os.listdir('validation_cache')[0]), 'w') as f:
+         f.write('{"foo": ')
+      self.write_settings({'foo': 0})
+      Settings('foo_settings.json', self.schema, {'bar': 'barval'},
+               cache=cache)
+      self.write_settings({'foo': 1})
+      s = Settings('foo_settings.json', self.schema, {'bar': 'barval'},
+                   cache=ValidationCache('validation_cache'))
+      self.assertEqual(s, {'foo': 1, 'bar': 'barval'})
+
+      cache.clear()
+      self.assertEqual(os.listdir('validation_cache'), [])
+
+   def test_validate_many(self):
+      cache = ValidationCache('validation_cache')
+      for i in range(2):
+         results = list(Settings.validate_many(
+            ['foo_settings.json'] * 3, self.schema, {'bar': 'barval'},
+            workers=2 if i else None, chunksize=1, cache=cache))
+         self.assertTrue(all(r.settings['bar'] == 'barval' for r in results))
+      self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+   def tearDown(self):
+      dammit.keep_fkn_trying(self.remove_files)
+
+if __name__ == '__main__':
+   unittest.main()
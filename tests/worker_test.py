@@ -0,0 +1,132 @@
+from lib.worker import *
+from lib.backends import RecordingBackend
+from lib.sched import Sched
+from tests.test_helpers import task_settings
+from lib.custom_exceptions import *
+
+import unittest
+import asyncio
+import io
+import json
+import os
+import shutil
+import subprocess
+import tests.test_helpers as dammit
+
+
+class WorkerTest(unittest.TestCase):
+   """unit tests for the worker line protocol, run against the local
+   stand-in worker
+   """
+
+   def settings(self, **settings):
+      return task_settings(**settings)
+
+   def remove_files(self):
+      with os.scandir() as files:
+         for f in files:
+            if f.name.startswith('_worker') or \
+               f.name.startswith('batcave\\_worker'):
+               os.remove(f.name)
+      if os.path.isdir('batcave'):
+         shutil.rmtree('batcave')
+
+   def setUp(self):
+      self.backend = WorkerBackend()
+
+   def test_handle(self):
+      backend = RecordingBackend({'delete': subprocess.CalledProcessError(
+         1, ['schtasks'], 'ERROR: Access is denied.')})
+      self.assertIsNone(handle(backend, {
+         'id': 1, 'op': 'create',
+         'args': {'settings': self.settings(), 'batpath': None}})['result'])
+      reply = handle(backend, {'id': 2, 'op': 'query',
+                               'args': {'taskname': '_foo'}})
+      self.assertEqual(reply['id'], 2)
+      self.assertEqual(reply['result']['values'][1], '\\_foo')
+      self.assertEqual(handle(backend, {'op': 'bulk_query'})['result']
+                       ['fields'], TASK_FIELDS)
+      self.assertEqual(handle(backend, {'op': 'delete',
+                                        'args': {'taskname': '_foo'}})
+                       ['error']['returncode'], 1)
+      self.assertEqual(handle(backend, {'op': 'bogus'})['error']['type'],
+                       'ValueError')
+
+      stdout = io.StringIO()
+      serve(backend, io.StringIO(
+         '{"id": 7, "op": "query", "args": {"taskname": "_bar"}}\n\n'
+         'garbage\n'), stdout)
+      replies = [json.loads(line) for line in stdout.getvalue().splitlines()]
+      self.assertEqual(replies[0], {'id': 7, 'result': None})
+      self.assertEqual(replies[1]['error']['type'], 'JSONDecodeError')
+
+   def test_backend(self):
+      backend = self.backend
+      self.assertEqual(backend.query('_foo'), ())
+      backend.create(self.settings(start_time='10:00'), None)
+      task = backend.query('_foo')
+      self.assertEqual(task.task_name, '\\_foo')
+      self.assertEqual(task.start_time, '10:00:00 AM')
+      self.assertEqual(list(backend.bulk_query()), ['_foo'])
+      self.assertEqual(asyncio.run(backend.aquery('_foo')), task)
+      self.assertTrue(asyncio.run(backend.adelete('_foo')))
+      self.assertFalse(backend.delete('_foo'))
+      backend.create(self.settings(schedule='monthly', modifier='LASTDAY',
+                                   start_time='10:00'), None)
+      self.assertEqual(backend.query('_foo').schedule_type, 'Monthly')
+      with self.assertRaises(WorkerError):
+         backend.create(self.settings(schedule='daily', modifier='LAST'),
+                        None)
+
+   def test_pipelining(self):
+      client = self.backend.pool.clients[0]
+      pid = client.call('ping')
+      futures = [client.submit('query', taskname="_foo{}".format(i))
+                 for i in range(500)]
+      self.assertEqual([f.result() for f in futures], [None] * 500)
+      self.assertEqual(client.call('ping'), pid)
+      self.assertEqual(len(client), 0)
+
+   def test_crash_restart(self):
+      client = self.backend.pool.clients[0]
+      pid = client.call('ping')
+      futures = [client.submit('ping') for i in range(100)]
+      client.kill()
+      for future in futures:
+         try:
+            self.assertEqual(future.result(), pid)
+         except WorkerCrashedError:
+            pass
+      self.assertNotEqual(client.call('ping'), pid)
+      self.assertEqual(client.restarts, 1)
+
+      client.kill()
+      self.assertEqual(self.backend.query('_foo'), ())
+      self.assertEqual(client.restarts, 2)
+
+   def test_pool(self):
+      backend = WorkerBackend(size=3)
+      try:
+         futures = [backend.pool.submit('ping') for i in range(300)]
+         self.assertEqual(len(set(f.result() for f in futures)), 3)
+      finally:
+         backend.close()
+
+   def test_sched(self):
+      files = ["_worker{}.json".format(i) for i in range(20)]
+      for i, f in enumerate(files):
+         Sched.gen_sched_settings_file(
+            f, name="_worker{}".format(i), run_cmd='python _foo.py',
+            schedule='weekly', days=['MON'])
+      results = Sched.schedule_many(files, concurrency=8,
+                                    backend=self.backend)
+      self.assertTrue(all(r.error is None for r in results))
+      self.assertEqual(len(self.backend.bulk_query()), 20)
+      self.assertTrue(Sched.is_task_scheduled('_worker3', self.backend))
+
+   def tearDown(self):
+      self.backend.close()
+      dammit.keep_fkn_trying(self.remove_files)
+
+if __name__ == '__main__':
+   unittest.main()